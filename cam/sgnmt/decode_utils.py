@@ -34,6 +34,7 @@ import uuid
 from cam.sgnmt import ui
 from cam.sgnmt import io
 from cam.sgnmt import utils
+from cam.sgnmt.misc import prefetch
 from cam.sgnmt.predictors.parse import ParsePredictor, TokParsePredictor, \
                                        BpeParsePredictor
 from cam.sgnmt.decoding import combination
@@ -65,6 +66,7 @@ from cam.sgnmt.decoding.syncbeam import SyncBeamDecoder
 from cam.sgnmt.decoding.fstbeam import FSTBeamDecoder
 from cam.sgnmt.decoding.predlimitbeam import PredLimitBeamDecoder
 from cam.sgnmt.decoding.combibeam import CombiBeamDecoder
+from cam.sgnmt.decoding.speculative import SpeculativeDecoder
 from cam.sgnmt.output import TextOutputHandler, \
                              NBestOutputHandler, \
                              NgramOutputHandler, \
@@ -151,6 +153,7 @@ def base_init(new_args):
     # Log summation (how to compute log(exp(l1)+exp(l2)) for log values l1,l2)
     if args.log_sum == 'tropical':
         utils.log_sum = utils.log_sum_tropical_semiring
+    prefetch.set_prefetch_threads(args.prefetch_threads)
     ui.validate_args(args)
     if args.run_diagnostics:
         ui.run_diagnostics()
@@ -228,6 +231,7 @@ def add_predictors(decoder):
     pred_weight = 1.0
     try:
         for idx, pred in enumerate(preds): # Add predictors one by one
+            start_time = time.time()
             wrappers = []
             if '_' in pred: 
                 # Handle weights when we have wrapper predictors
@@ -331,7 +335,10 @@ def add_predictors(decoder):
                                      _get_override_args("marg_path"),
                                      args.lmbda,
                                      args.ppmi,
-                                     args.epsilon)
+                                     args.epsilon,
+                                     args.fairseq_quantize,
+                                     args.fairseq_quantize_check,
+                                     args.fairseq_quantize_check_threshold)
             elif pred == "bracket":
                 p = BracketPredictor(args.syntax_max_terminal_id,
                                      args.syntax_pop_id,
@@ -355,13 +362,16 @@ def add_predictors(decoder):
                                  args.use_fst_weights,
                                  args.normalize_fst_weights,
                                  skip_bos_weight=args.fst_skip_bos_weight,
-                                 to_log=args.fst_to_log)
+                                 to_log=args.fst_to_log,
+                                 prefetch_lookahead=args.prefetch_lookahead)
             elif pred == "nfst":
                 p = NondeterministicFstPredictor(_get_override_args("fst_path"),
                                                  args.use_fst_weights,
                                                  args.normalize_fst_weights,
                                                  args.fst_skip_bos_weight,
-                                                 to_log=args.fst_to_log)
+                                                 to_log=args.fst_to_log,
+                                                 prefetch_lookahead=
+                                                    args.prefetch_lookahead)
             elif pred == "forced":
                 p = ForcedPredictor(
                                 args.trg_test, 
@@ -402,7 +412,9 @@ def add_predictors(decoder):
                                  args.normalize_rtn_weights,
                                  to_log=args.fst_to_log,
                                  minimize_rtns=args.minimize_rtns,
-                                 rmeps=args.remove_epsilon_in_rtns)
+                                 rmeps=args.remove_epsilon_in_rtns,
+                                 prefetch_lookahead=args.prefetch_lookahead,
+                                 cache_size=args.rtn_cache_size)
             elif pred == "kenlm":
                 p = KenLMPredictor(args.lm_path)
             elif pred == "wc":
@@ -416,7 +428,8 @@ def add_predictors(decoder):
             elif pred == "ngramc":
                 p = NgramCountPredictor(_get_override_args("ngramc_path"),
                                         _get_override_args("ngramc_order"),
-                                        args.ngramc_discount_factor)
+                                        args.ngramc_discount_factor,
+                                        args.prefetch_lookahead)
             elif pred == "unkc":
                 p = UnkCountPredictor(
                      _get_override_args("pred_src_vocab_size"), 
@@ -427,7 +440,8 @@ def add_predictors(decoder):
                 p = NBLengthPredictor(args.src_test_raw, 
                                       length_model_weights, 
                                       args.use_length_point_probs,
-                                      args.length_model_offset)
+                                      args.length_model_offset,
+                                      args.max_len_factor)
             elif pred == "extlength":
                 p = ExternalLengthPredictor(args.extlength_path)
             elif pred == "lrhiero":
@@ -436,7 +450,8 @@ def add_predictors(decoder):
                     fw = utils.split_comma(args.grammar_feature_weights, float)
                 p = RuleXtractPredictor(args.rules_path,
                                         args.use_grammar_weights,
-                                        fw)
+                                        fw,
+                                        args.rules_cache_dir)
             else:
                 logging.fatal("Predictor '%s' not available. Please check "
                               "--predictors for spelling errors." % pred)
@@ -520,13 +535,16 @@ def add_predictors(decoder):
                 elif wrapper == "word2char":
                     map_path = _get_override_args("word2char_map")
                     # word2char always wraps unbounded predictors
-                    p = Word2charPredictor(map_path, p)
+                    p = Word2charPredictor(map_path, 
+                                           p, 
+                                           args.word2char_prefix_scores)
                 elif wrapper == "skipvocab":
                     # skipvocab always wraps unbounded predictors
                     p = SkipvocabPredictor(args.skipvocab_vocab, 
                                            args.skipvocab_stop_size, 
                                            args.beam, 
-                                           p)
+                                           p,
+                                           args.skipvocab_cache_size)
                 elif wrapper == "fsttok":
                     fsttok_path = _get_override_args("fsttok_path")
                     # fsttok always wraps unbounded predictors
@@ -549,8 +567,9 @@ def add_predictors(decoder):
                     decoder.remove_predictors()
                     return
             decoder.add_predictor(pred, p, pred_weight)
-            logging.info("Initialized predictor {} (weight: {})".format(
-                             pred, pred_weight))
+            logging.info("Initialized predictor {} (weight: {}) in {:.2f} "
+                         "seconds".format(pred, pred_weight, 
+                                          time.time() - start_time))
     except IOError as e:
         logging.fatal("One of the files required for setting up the "
                       "predictors could not be read: %s" % e)
@@ -656,6 +675,12 @@ def create_decoder():
             decoder = DijkstraDecoder(args)
         elif args.decoder == "dijkstra_ts":
             decoder = DijkstraTSDecoder(args)
+        elif args.decoder == "speculative":
+            draft_predictor = FairseqPredictor(args.speculative_draft_path,
+                                               args.fairseq_user_dir,
+                                               args.fairseq_lang_pair,
+                                               args.n_cpu_threads)
+            decoder = SpeculativeDecoder(args, draft_predictor)
         else:
             logging.fatal("Decoder %s not available. Please double-check the "
                           "--decoder parameter." % args.decoder)
@@ -906,6 +931,8 @@ def do_decode(decoder,
     logging.info("Start time: %s" % start_time)
     sen_indices = []
     counts = []
+    if src_sentences is not False:
+        prefetch.set_prefetch_range(len(src_sentences))
     for sen_idx in get_sentence_indices(args.range, src_sentences):
         decoder.set_current_sen_id(sen_idx)
         try:
@@ -968,6 +995,7 @@ def do_decode(decoder,
                                                        e,
                                                        traceback.format_exc()))
     print(sum(counts))
+    prefetch.shutdown_prefetching()
     logging.info("Decoding finished. Time: %.2f" % (time.time() - start_time))
     try:
         for output_handler in output_handlers:
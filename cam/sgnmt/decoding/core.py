@@ -557,6 +557,25 @@ class Decoder(Observable):
                         if not isinstance(el[0], UnboundedVocabularyPredictor)]
         # Get bounded posteriors
         bounded_posteriors = [p.predict_next() for (p, _) in bounded_predictors]
+        return self.combine_bounded_posteriors(bounded_posteriors, top_n)
+
+    def combine_bounded_posteriors(self, bounded_posteriors, top_n=0):
+        """Second half of ``apply_predictors()``: Queries the unbounded
+        vocabulary predictors and combines all predictor scores. This 
+        can be used by decoders which obtain the posteriors of the
+        bounded predictors in other ways than with ``predict_next()``.
+
+        Args:
+            bounded_posteriors (list): Posteriors of the bounded 
+                                       vocabulary predictors in the
+                                       order of ``predictors``
+            top_n (int): If positive, return only the best n words.
+        
+        Returns:
+            combined,score_breakdown: like in ``apply_predictors()``
+        """
+        bounded_predictors = [el for el in self.predictors 
+                        if not isinstance(el[0], UnboundedVocabularyPredictor)]
         non_zero_words = self._get_non_zero_words(bounded_predictors,
                                                   bounded_posteriors)
         if not non_zero_words: # Special case: no word is possible
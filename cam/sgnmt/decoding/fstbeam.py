@@ -19,16 +19,12 @@
 from cam.sgnmt import utils
 from cam.sgnmt.decoding.beam import BeamDecoder
 from cam.sgnmt.decoding.core import PartialHypothesis
+from cam.sgnmt.misc.lattice import CompiledFst
+import heapq
+import itertools
 import logging
 
 from cam.sgnmt.utils import load_fst
-try:
-    import pywrapfst as fst
-except ImportError:
-    try:
-        import openfst_python as fst
-    except ImportError:
-        pass # Deal with it in decode.py
 
 
 class FSTBeamDecoder(BeamDecoder):
@@ -39,6 +35,12 @@ class FSTBeamDecoder(BeamDecoder):
     expanded until all of them arrive at the same state id, and are
     then compared with each other to select the set of active 
     hypotheses in the next time step.
+    
+    The FST is compiled into a transition table (one dictionary from
+    label to next state for each FST state) when it is loaded. The
+    number of synchronization rounds and the number of hypotheses 
+    which are idle at the synchronization state while others are still
+    expanded are collected in ``sync_stats``.
     """
     
     def __init__(self, decoder_args):
@@ -53,35 +55,80 @@ class FSTBeamDecoder(BeamDecoder):
         super(FSTBeamDecoder, self).__init__(decoder_args)
         self.fst_path = decoder_args.fst_path
         self.max_word_len = decoder_args.max_word_len
+        self.transitions = []
+        self.sync_stats = {}
+        self.tiebreaker = itertools.count()
     
     def _register_sub_score(self, score):
-        """Updates best_scores and min_score. """
+        """Updates sub_best_scores and sub_min_score. 
+        ``sub_best_scores`` is a min-heap with the beam size best 
+        scores."""
         if not self.maintain_best_scores:
             return
-        self.sub_best_scores.append(score)
-        self.sub_best_scores.sort(reverse=True)
+        if len(self.sub_best_scores) < self.beam_size:
+            heapq.heappush(self.sub_best_scores, score)
+        else:
+            heapq.heappushpop(self.sub_best_scores, score)
         if len(self.sub_best_scores) >= self.beam_size:
-            self.sub_best_scores = self.sub_best_scores[:self.beam_size]
-            self.sub_min_score = self.sub_best_scores[-1] 
+            self.sub_min_score = self.sub_best_scores[0]
 
-    def _get_label2node(self, root_node):
-        return {arc.olabel: arc.nextstate 
-                for arc in self.cur_fst.arcs(root_node)}
+    def _compile_transitions(self, fst_obj):
+        """Builds the transition table for ``fst_obj``. """
+        lattice = CompiledFst(fst_obj)
+        nextstates = lattice.nextstates.tolist()
+        self.transitions = [
+            {label: nextstates[begin] 
+             for label, (begin, _) in label_ranges.items()}
+            for label_ranges in lattice.label_ranges]
+        return lattice.start
 
-    def _find_start_node(self):
-        for arc in self.cur_fst.arcs(self.cur_fst.start()):
-            if arc.olabel == utils.GO_ID:
-                return arc.nextstate
-        logging.error("Start symbol %d not found in fstbeam FST!" % utils.GO_ID)
+    def _find_start_node(self, start):
+        node = self.transitions[start].get(utils.GO_ID)
+        if node is None:
+            logging.error("Start symbol %d not found in fstbeam FST!" 
+                          % utils.GO_ID)
+        return node
 
     def _get_initial_hypos(self):
         """Get the list of initial ``PartialHypothesis``. """
-        self.cur_fst = load_fst(utils.get_path(self.fst_path,
-                                               self.current_sen_id+1))
+        cur_fst = load_fst(utils.get_path(self.fst_path,
+                                          self.current_sen_id+1))
+        start = self._compile_transitions(cur_fst)
         init_hypo = PartialHypothesis(self.get_predictor_states())
-        init_hypo.fst_node = self._find_start_node()
+        init_hypo.fst_node = self._find_start_node(start)
         return [init_hypo]
     
+    def decode(self, src_sentence):
+        """Decodes a single source sentence with beam search and logs
+        synchronization statistics.
+        """
+        self.sync_stats = {"expansions": 0, 
+                           "sync_rounds": 0, 
+                           "max_sync_rounds": 0,
+                           "idle_hypos": 0,
+                           "dropped_hypos": 0}
+        ret = super(FSTBeamDecoder, self).decode(src_sentence)
+        stats = self.sync_stats
+        logging.info("FSTBeam stats: %d expansions, %d sync rounds (max: %d), "
+                     "%d idle hypos, %d hypos beyond sync state" % (
+                         stats["expansions"],
+                         stats["sync_rounds"],
+                         stats["max_sync_rounds"],
+                         stats["idle_hypos"],
+                         stats["dropped_hypos"]))
+        return ret
+    
+    def _add_closed_hypo(self, closed_hypos, hypo, score):
+        """Adds a hypothesis at the synchronization state. Without
+        hypothesis recombination, only the beam size best hypotheses
+        are kept in the min-heap ``closed_hypos``.
+        """
+        entry = (score, next(self.tiebreaker), hypo)
+        if self.hypo_recombination or len(closed_hypos) < self.beam_size:
+            heapq.heappush(closed_hypos, entry)
+        elif score > closed_hypos[0][0]:
+            heapq.heapreplace(closed_hypos, entry)
+    
     def _expand_hypo(self, hypo):
         """Expand hypo until all of the beam size best hypotheses end 
         with ``sync_symb`` or EOS.
@@ -92,13 +139,17 @@ class FSTBeamDecoder(BeamDecoder):
         Return:
             list. List of expanded hypotheses.
         """
+        stats = self.sync_stats
+        stats["expansions"] += 1
         # Get initial expansions
-        l2n = self._get_label2node(hypo.fst_node)
+        l2n = self.transitions[hypo.fst_node]
         deepest_node = -1
         next_hypos = []
         next_scores = []
         for next_hypo in super(FSTBeamDecoder, self)._expand_hypo(hypo):
-            node_id = l2n[next_hypo.trgt_sentence[-1]]
+            node_id = l2n.get(next_hypo.trgt_sentence[-1])
+            if node_id is None:
+                continue
             deepest_node = max(node_id, deepest_node)
             next_hypo.fst_node = node_id
             next_hypos.append(next_hypo)
@@ -110,7 +161,7 @@ class FSTBeamDecoder(BeamDecoder):
         closed_hypos = []
         for next_hypo, next_score in zip(next_hypos, next_scores):
             if next_hypo.fst_node == deepest_node:
-                closed_hypos.append(next_hypo)
+                self._add_closed_hypo(closed_hypos, next_hypo, next_score)
             else:
                 open_hypos.append(next_hypo)
                 open_hypos_scores.append(next_score)
@@ -121,26 +172,36 @@ class FSTBeamDecoder(BeamDecoder):
                 logging.debug("Maximum word length reached.")
                 break
             it = it + 1
+            stats["sync_rounds"] += 1
+            stats["idle_hypos"] += len(closed_hypos)
             next_hypos = []
             next_scores = []
             self.sub_min_score = self.min_score
             self.sub_best_scores = []
             for h in open_hypos:
                 if h.score > self.sub_min_score:
-                    l2n = self._get_label2node(h.fst_node)
+                    l2n = self.transitions[h.fst_node]
                     for next_hypo in super(FSTBeamDecoder, self)._expand_hypo(h):
                         next_score = self._get_combined_score(next_hypo)
                         if next_score > self.sub_min_score:
-                            next_hypo.fst_node = l2n[next_hypo.trgt_sentence[-1]]
+                            next_hypo.fst_node = l2n.get(
+                                next_hypo.trgt_sentence[-1], -1)
+                            if next_hypo.fst_node < 0:
+                                continue
                             if next_hypo.fst_node < deepest_node: # Keep
                                 next_hypos.append(next_hypo)
                                 next_scores.append(next_score)
                                 self._register_sub_score(next_score)
                             elif next_hypo.fst_node == deepest_node: # Add to closed
-                                closed_hypos.append(next_hypo)
+                                self._add_closed_hypo(closed_hypos, 
+                                                      next_hypo, 
+                                                      next_score)
                             elif next_hypo.fst_node > deepest_node: # Log
+                                stats["dropped_hypos"] += 1
                                 logging.debug("FSTBeam: Deepest node exceeded")
             open_hypos = self._get_next_hypos(next_hypos, next_scores)
+        stats["max_sync_rounds"] = max(stats["max_sync_rounds"], it - 1)
+        closed_hypos = [h for _, _, h in closed_hypos]
         logging.debug("Expand %f: %s (%d)" % (hypo.score,
                                               hypo.trgt_sentence, 
                                               hypo.fst_node))
@@ -149,4 +210,3 @@ class FSTBeamDecoder(BeamDecoder):
                                               h.trgt_sentence, 
                                               h.fst_node))
         return closed_hypos
-
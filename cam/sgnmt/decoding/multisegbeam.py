@@ -560,7 +560,9 @@ class MultisegBeamDecoder(Decoder):
         posteriors = []
         for p, _ in self.predictors:
             posterior = p.predict_next()
-            posterior[utils.UNK_ID] = p.get_unk_probability(posterior) 
+            unk_prob = p.get_unk_probability(posterior)
+            posterior = posterior.copy() # Might be shared by the predictor
+            posterior[utils.UNK_ID] = unk_prob
             posteriors.append(posterior)
         return posteriors
 
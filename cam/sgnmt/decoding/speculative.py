@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+# coding=utf-8
+# Copyright 2019 The SGNMT Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Implementation of greedy search with speculative decoding """
+
+import copy
+import logging
+
+from cam.sgnmt import utils
+from cam.sgnmt.decoding.core import Decoder, Hypothesis
+from cam.sgnmt.decoding.greedy import GreedyDecoder
+
+
+class SpeculativeDecoder(Decoder):
+    """Greedy decoding with a small draft model. In each round, the
+    draft predictor proposes up to k tokens via an internal
+    ``GreedyDecoder``. The main predictor scores all proposals in a
+    single forward pass with ``predict_next_forced()``. We accept the
+    longest prefix of the proposals which agrees with the greedy
+    decisions of the main predictor, plus the first token of the main
+    predictor after that prefix. Scores are combined in the same way
+    as in ``apply_predictors()``, so the result is the same as greedy
+    decoding with the main predictor alone up to numerical ties: The 
+    single-pass verification of transformer models can differ from 
+    step-wise decoding by floating point rounding, which may flip
+    decisions between (nearly) equally scored words. Set 
+    ``speculative_check`` to compare each sentence with the output of
+    the ``GreedyDecoder``.
+
+    The main predictor must be the only predictor and must implement
+    ``predict_next_forced()`` and ``rollback()`` (e.g. 
+    ``FairseqPredictor``). The main predictor extends its incremental
+    states by all proposals in the verification pass and drops the 
+    rejected ones with ``rollback()``. Rejected draft tokens are rolled
+    back with ``get_state()`` and ``set_state()`` of the draft 
+    predictor.
+    """
+
+    def __init__(self, decoder_args, draft_predictor):
+        """Creates a new speculative decoder. The following values are
+        fetched from `decoder_args`:
+
+            speculative_k (int): Maximum number of draft tokens to
+                                 verify in one pass of the main
+                                 predictor
+            speculative_check (bool): If true, decode each sentence 
+                                      with the ``GreedyDecoder`` as 
+                                      well and warn if the results
+                                      differ
+
+        Args:
+            decoder_args (object): Decoder configuration passed through
+                                   from the configuration API.
+            draft_predictor (Predictor): Predictor for the small draft
+                                         model
+        """
+        super(SpeculativeDecoder, self).__init__(decoder_args)
+        self.k = max(1, decoder_args.speculative_k)
+        self.draft_decoder = GreedyDecoder(decoder_args)
+        self.draft_decoder.add_predictor("draft", draft_predictor)
+        self.n_proposed = 0
+        self.n_accepted = 0
+        self.check_decoder = None
+        if decoder_args.speculative_check:
+            self.check_decoder = GreedyDecoder(decoder_args)
+        self.n_check_mismatches = 0
+
+    def _propose(self, max_tokens):
+        """Greedily proposes up to ``max_tokens`` draft tokens.
+
+        Returns:
+            tuple. List of draft tokens and the draft predictor states
+            right before each token was consumed.
+        """
+        proposals = []
+        draft_states = []
+        while len(proposals) < max_tokens:
+            posterior, _ = self.draft_decoder.apply_predictors(1)
+            draft_states.append(copy.deepcopy(
+                self.draft_decoder.get_predictor_states()))
+            word = utils.argmax(posterior)
+            proposals.append(word)
+            if word == utils.EOS_ID:
+                break
+            self.draft_decoder.consume(word)
+        return proposals, draft_states
+
+    def _verify(self, proposals):
+        """Runs the main predictor over the current prefix extended by
+        ``proposals`` in one pass and returns the greedy decisions of
+        the main predictor together with their scores. Afterwards, the
+        history of the main predictor is the current prefix extended by
+        the accepted proposals.
+
+        Returns:
+            list. Tuples (word, score, score_breakdown) along the 
+            greedy path of the main predictor, at most 
+            ``len(proposals)+1`` long
+        """
+        predictor = self.predictors[0][0]
+        posteriors = predictor.predict_next_forced(proposals)
+        decisions = []
+        for pos, posterior in enumerate(posteriors):
+            self.apply_predictors_count += 1
+            combined, breakdown = self.combine_bounded_posteriors(
+                [posterior], 1)
+            word = utils.argmax(combined)
+            decisions.append((word, combined[word], breakdown[word]))
+            if pos >= len(proposals) or word != proposals[pos]:
+                break
+            if word == utils.EOS_ID:
+                break
+        n_accepted = sum(1 for pos, decision in enumerate(decisions)
+                         if pos < len(proposals) 
+                            and decision[0] == proposals[pos])
+        predictor.rollback(len(proposals) - n_accepted)
+        return decisions
+
+    def _check_against_greedy(self, src_sentence, hypo):
+        """Decodes ``src_sentence`` with the ``GreedyDecoder`` and the
+        main predictor, and warns if the result differs from ``hypo``.
+        This reinitializes the main predictor.
+        """
+        self.check_decoder.predictors = self.predictors
+        self.check_decoder.current_sen_id = self.current_sen_id - 1
+        greedy_hypo = self.check_decoder.decode(src_sentence)[0]
+        if greedy_hypo.trgt_sentence != hypo.trgt_sentence:
+            self.n_check_mismatches += 1
+            logging.warn("Speculative decoding differs from greedy decoding "
+                         "for sentence %d (%d mismatches so far). "
+                         "Speculative (%f): %s Greedy (%f): %s" % (
+                             self.current_sen_id + 1,
+                             self.n_check_mismatches,
+                             hypo.total_score,
+                             " ".join(str(w) for w in hypo.trgt_sentence),
+                             greedy_hypo.total_score,
+                             " ".join(str(w) 
+                                      for w in greedy_hypo.trgt_sentence)))
+        else:
+            logging.debug("Speculative decoding matches greedy decoding "
+                          "for sentence %d" % (self.current_sen_id + 1))
+
+    def decode(self, src_sentence):
+        """Decodes a single source sentence greedily with speculative
+        decoding.
+
+        Args:
+            src_sentence (list): List of source word ids without <S> or
+                                 </S> which make up the source sentence
+
+        Returns:
+            list. A list of a single best ``Hypothesis`` instance."""
+        if (len(self.predictors) != 1
+                or not hasattr(self.predictors[0][0], "predict_next_forced")
+                or not hasattr(self.predictors[0][0], "rollback")):
+            logging.fatal("The speculative decoder requires exactly one "
+                          "predictor which supports predict_next_forced "
+                          "and rollback, e.g. fairseq.")
+            return [], 0
+        self.count = 0
+        self.initialize_predictors(src_sentence)
+        self.draft_decoder.initialize_predictors(src_sentence)
+        trgt_sentence = []
+        score_breakdown = []
+        trgt_word = None
+        score = 0.0
+        while trgt_word != utils.EOS_ID and len(trgt_sentence) <= self.max_len:
+            max_tokens = min(self.k, self.max_len + 1 - len(trgt_sentence))
+            proposals, draft_states = self._propose(max_tokens)
+            decisions = self._verify(proposals)
+            self.count += 1
+            n_accepted = 0
+            for pos, (word, word_score, breakdown) in enumerate(decisions):
+                if (trgt_word == utils.EOS_ID
+                        or len(trgt_sentence) > self.max_len):
+                    break
+                trgt_word = word
+                score += word_score
+                trgt_sentence.append(trgt_word)
+                score_breakdown.append(breakdown)
+                if pos < len(proposals) and word == proposals[pos]:
+                    n_accepted += 1
+                else: # Not consumed by the main predictor in _verify
+                    self.consume(trgt_word)
+            self.n_proposed += len(proposals)
+            self.n_accepted += n_accepted
+            logging.debug("Partial hypothesis (%f): %s (accepted %d/%d)" % (
+                    score, " ".join([str(i) for i in trgt_sentence]),
+                    n_accepted, len(proposals)))
+            if trgt_word == utils.EOS_ID or len(trgt_sentence) > self.max_len:
+                break
+            # Synchronize draft predictor with the committed prefix
+            if n_accepted < len(proposals):
+                self.draft_decoder.set_predictor_states(
+                    draft_states[n_accepted])
+            else:
+                self.draft_decoder.apply_predictors(1)
+            self.draft_decoder.consume(trgt_word)
+        hypo = Hypothesis(trgt_sentence, score, score_breakdown)
+        if self.check_decoder is not None:
+            self._check_against_greedy(src_sentence, hypo)
+        self.add_full_hypo(hypo)
+        logging.debug("Speculative decoding: accepted %d of %d draft tokens"
+                      % (self.n_accepted, self.n_proposed))
+        return self.full_hypos, self.count
@@ -47,6 +47,10 @@ from cam.sgnmt.predictors.core import UnboundedVocabularyPredictor
 args = get_args()
 decode_utils.base_init(args)
 
+FORCED_SCORING_TOLERANCE = 0.001
+"""Maximum score difference between forced and step-wise scoring
+before a warning is logged."""
+
 class ForcedDecoder(core.Decoder):
     """Forced decoder implementation. The decode() function returns
     the same hypos as the GreedyDecoder with forced predictor. However,
@@ -58,6 +62,63 @@ class ForcedDecoder(core.Decoder):
         """Initialize the decoder and load target sentences."""
         super(ForcedDecoder, self).__init__(decoder_args)
         self.trg_sentences = load_sentences(decoder_args.trg_test, "target")
+        self.forced_scoring = decoder_args.forced_scoring
+        self.check_forced_scoring = decoder_args.forced_scoring
+
+    def _get_forced_posteriors(self, src_sentence, trg_sentence):
+        """Scores the reference in a single pass with all predictors
+        which support teacher forcing. This also consumes the reference.
+        For the first sentence, the forced posteriors are compared with
+        step-wise posteriors from ``predict_next()``.
+
+        Args:
+            src_sentence (list): Source sentence
+            trg_sentence (list): Reference including </S>
+
+        Returns:
+            dict. Posteriors along ``trg_sentence`` by predictor index
+        """
+        forced_posteriors = {}
+        for idx, (p, _) in enumerate(self.predictors):
+            if not hasattr(p, "predict_next_forced"):
+                continue
+            step_posteriors = None
+            if self.check_forced_scoring:
+                step_posteriors = []
+                for trg_word in trg_sentence:
+                    step_posteriors.append(p.predict_next())
+                    p.consume(trg_word)
+                p.initialize(src_sentence)
+            forced_posteriors[idx] = p.predict_next_forced(trg_sentence[:-1])
+            if step_posteriors is not None:
+                self._compare_posteriors(idx, trg_sentence, step_posteriors,
+                                         forced_posteriors[idx])
+        self.check_forced_scoring = False
+        return forced_posteriors
+
+    def _compare_posteriors(self, idx, trg_sentence, step_posteriors,
+                            forced_posteriors):
+        """Logs the differences between step-wise and forced
+        posteriors of predictor ``idx`` along ``trg_sentence``. """
+        max_diff = 0.0
+        n_argmax_diffs = 0
+        for trg_word, step, forced in zip(trg_sentence, 
+                                          step_posteriors, 
+                                          forced_posteriors):
+            diff = abs(utils.common_get(step, trg_word, 0.0)
+                       - utils.common_get(forced, trg_word, 0.0))
+            max_diff = max(max_diff, diff)
+            if utils.argmax(step) != utils.argmax(forced):
+                n_argmax_diffs += 1
+        if max_diff > FORCED_SCORING_TOLERANCE or n_argmax_diffs > 0:
+            logging.warn("Forced scoring of predictor %d differs from "
+                         "step-wise scoring: max. score difference %f, "
+                         "different best words at %d positions" % (
+                             idx, max_diff, n_argmax_diffs))
+        else:
+            logging.info("Forced scoring of predictor %d agrees with "
+                         "step-wise scoring (max. score difference %f)" % (
+                             idx, max_diff))
 
     def decode(self, src_sentence):
         self.initialize_predictors(src_sentence)
@@ -66,13 +127,22 @@ class ForcedDecoder(core.Decoder):
         score = 0.0
         all_posteriors = []
         all_unk_scores = []
-        for trg_word in trg_sentence:
+        # With --forced_scoring, predictors with teacher forcing support
+        # score the full reference in a single pass, which also 
+        # consumes it
+        forced_posteriors = {}
+        if self.forced_scoring:
+            forced_posteriors = self._get_forced_posteriors(src_sentence, 
+                                                            trg_sentence)
+        for pos, trg_word in enumerate(trg_sentence):
             self.apply_predictors_count += 1
             breakdown = []
             posteriors = []
             unk_scores = []
-            for (p, w) in self.predictors:
-                if isinstance(p, UnboundedVocabularyPredictor):
+            for idx, (p, w) in enumerate(self.predictors):
+                if idx in forced_posteriors:
+                    posterior = forced_posteriors[idx][pos]
+                elif isinstance(p, UnboundedVocabularyPredictor):
                     posterior = p.predict_next([trg_word])
                 else: 
                     posterior = p.predict_next()
@@ -85,7 +155,9 @@ class ForcedDecoder(core.Decoder):
             all_posteriors.append(posteriors)
             all_unk_scores.append(unk_scores)
             score_breakdown.append(breakdown)
-            self.consume(trg_word)
+            for idx, (p, _) in enumerate(self.predictors):
+                if idx not in forced_posteriors:
+                    p.consume(trg_word)
         self.add_full_hypo(core.Hypothesis(trg_sentence, score, score_breakdown))
         self.last_meta_data = {
             "src_sentence": np.array(src_sentence + [utils.EOS_ID]),
@@ -4,5 +4,10 @@ framework (blocks, tensorflow...). For example, this includes rolling
 out sparse features into a dense representation or searching for the 
 best surface form for a given attribute vector. ``trie`` contains a
 generic trie implementation, ``unigram`` can be used for keeping 
-track of unigram statistics during decoding.
+track of unigram statistics during decoding. ``lattice`` compiles
+OpenFST lattices into flat arrays for fast arc lookups. ``textindex``
+provides lazy per-sentence access to large n-best lists and reference
+files. ``ngram_store`` holds n-gram posteriors in compact (optionally
+memory mapped) arrays, and ``prefetch`` loads per-sentence resources 
+like lattices or n-gram posteriors in the background.
 """
\ No newline at end of file
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# coding=utf-8
+# Copyright 2019 The SGNMT Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module contains ``CompiledFst``, a compact array-based
+representation of OpenFST lattices. Converting a lattice once per
+sentence removes all FST library calls and weight conversions from the
+inner loops of the automata predictors.
+"""
+
+import numpy as np
+
+from cam.sgnmt.utils import w2f
+
+
+NO_ARCS = (0, 0)
+"""Empty arc range returned by ``CompiledFst.find_arcs``. """
+
+
+class CompiledFst(object):
+    """CSR-style representation of an FST. The arcs leaving ``state``
+    are stored at the positions ``offsets[state]:offsets[state+1]`` of
+    the arrays ``labels``, ``weights``, and ``nextstates``. Within a
+    state, arcs are sorted by output label (stable, so the original arc
+    order is kept among arcs with the same label). ``label_ranges``
+    contains a dictionary for each state which maps output labels to
+    the (begin, end) positions of the arcs with this label.
+
+    Weights are stored as they are in the FST, i.e. with cost semantics
+    if the lattice uses the tropical or log semiring.
+    """
+
+    def __init__(self, fst_obj):
+        """Compiles the FST ``fst_obj``.
+
+        Args:
+            fst_obj (Fst): OpenFST object with states 0..n-1
+        """
+        self.start = fst_obj.start()
+        self.n_states = fst_obj.num_states()
+        offsets = [0]
+        labels = []
+        weights = []
+        nextstates = []
+        final_weights = []
+        self.label_ranges = []
+        for state in range(self.n_states):
+            arcs = sorted([(arc.olabel, w2f(arc.weight), arc.nextstate)
+                           for arc in fst_obj.arcs(state)],
+                          key=lambda arc: arc[0])
+            ranges = {}
+            for pos, (label, weight, nextstate) in enumerate(arcs,
+                                                             len(labels)):
+                begin = ranges[label][0] if label in ranges else pos
+                ranges[label] = (begin, pos + 1)
+            for label, weight, nextstate in arcs:
+                labels.append(label)
+                weights.append(weight)
+                nextstates.append(nextstate)
+            offsets.append(len(labels))
+            final_weights.append(w2f(fst_obj.final(state)))
+            self.label_ranges.append(ranges)
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.labels = np.array(labels, dtype=np.int64)
+        self.weights = np.array(weights, dtype=np.float64)
+        self.nextstates = np.array(nextstates, dtype=np.int64)
+        self.final_weights = np.array(final_weights, dtype=np.float64)
+
+    def arc_range(self, state):
+        """Returns the (begin, end) positions of all arcs leaving
+        ``state``. """
+        return self.offsets[state], self.offsets[state+1]
+
+    def find_arcs(self, state, label):
+        """Returns the (begin, end) positions of the arcs leaving
+        ``state`` with output label ``label``. The range is empty if
+        there is no such arc.
+        """
+        return self.label_ranges[state].get(label, NO_ARCS)
+
+    def find_arc(self, state, label):
+        """Returns the position of the first arc leaving ``state`` with
+        output label ``label``, or -1 if there is no such arc.
+        """
+        begin, end = self.label_ranges[state].get(label, NO_ARCS)
+        return begin if begin < end else -1
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+# coding=utf-8
+# Copyright 2019 The SGNMT Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module contains a compact array-based storage for n-gram
+posteriors as used by the ``ngramc`` predictor. The posteriors of a
+whole test set can be compiled into a single binary file with
+``compile_ngram_posteriors``, which is memory mapped by
+``NgramPosteriorStore``. Per-sentence text files in the format
+<ngram> : <score> are still supported via ``load_ngram_posteriors``.
+
+Each n-gram is split into a context (all but the last word) and the
+last word. For each context, the possible last words and their scores
+are stored in contiguous slices of the ``words`` and ``scores`` arrays.
+"""
+
+import json
+import logging
+import struct
+
+import numpy as np
+
+from cam.sgnmt import utils
+
+
+MAGIC = b"SGNMTNG1"
+"""Magic bytes at the beginning of compiled n-gram posterior files. """
+
+
+_ARRAY_DTYPES = [("sen_offsets", np.int64),
+                 ("ctx_token_offsets", np.int64),
+                 ("ctx_tokens", np.int32),
+                 ("ctx_entry_offsets", np.int64),
+                 ("words", np.int32),
+                 ("scores", np.float64)]
+"""Names and data types of the arrays in a compiled file. """
+
+
+def parse_ngram_file(path):
+    """Reads a text file with lines in the format <ngram> : <score>.
+
+    Args:
+        path (string): Path to the n-gram posterior file
+
+    Returns:
+        dict. Maps context tuples to dictionaries from the last word
+        to the score. N-grams which end with <S> are skipped since 
+        <S> is never predicted.
+    """
+    entries = {}
+    with open(path) as f:
+        for line in f:
+            ngram, score = line.split(':')
+            words = tuple(int(w) for w in ngram.strip().split())
+            if words[-1] == utils.GO_ID:
+                continue
+            entries.setdefault(words[:-1], {})[words[-1]] = float(score)
+    return entries
+
+
+def _flatten(entries):
+    """Converts a context dictionary as returned by
+    ``parse_ngram_file`` into lists of offsets, context tokens, words
+    and scores. Contexts are sorted.
+    """
+    ctx_token_offsets = [0]
+    ctx_tokens = []
+    ctx_entry_offsets = [0]
+    words = []
+    scores = []
+    for ctx in sorted(entries):
+        ctx_tokens.extend(ctx)
+        ctx_token_offsets.append(len(ctx_tokens))
+        for w, score in sorted(entries[ctx].items()):
+            words.append(w)
+            scores.append(score)
+        ctx_entry_offsets.append(len(words))
+    return ctx_token_offsets, ctx_tokens, ctx_entry_offsets, words, scores
+
+
+class NgramPosteriors(object):
+    """N-gram posteriors of a single sentence. ``get`` maps a context
+    tuple to the arrays of possible next words and their scores. 
+    Contexts of the same length are packed into a sorted array of
+    fixed-size keys, so that a lookup is a single ``np.searchsorted``
+    call.
+    """
+
+    def __init__(self, ctx_token_offsets, ctx_tokens, ctx_entry_offsets,
+                 words, scores, order=0):
+        """Creates the posteriors from the flat arrays.
+
+        Args:
+            ctx_token_offsets (array): Offsets into ``ctx_tokens``
+            ctx_tokens (array): Concatenated context tokens
+            ctx_entry_offsets (array): Offsets into ``words`` and
+                                       ``scores``, relative to the
+                                       first entry of the sentence.
+                                       Contexts must be sorted
+            words (array): Last words of the n-grams
+            scores (array): Scores of the n-grams
+            order (int): If positive, only use n-grams of this order
+        """
+        self.words = words
+        self.scores = scores
+        self.order = order
+        self.entry_offsets = np.asarray(ctx_entry_offsets)
+        token_offsets = np.asarray(ctx_token_offsets)
+        tokens = np.asarray(ctx_tokens)
+        ctx_lens = np.diff(token_offsets)
+        self.index = {}
+        for ctx_len in np.unique(ctx_lens).tolist():
+            if order > 0 and ctx_len != order - 1:
+                continue
+            ctx_idxs = np.nonzero(ctx_lens == ctx_len)[0]
+            rows = tokens[token_offsets[ctx_idxs][:, None] 
+                          + np.arange(ctx_len)]
+            self.index[ctx_len] = (_pack_contexts(rows, ctx_len), ctx_idxs)
+        self.max_history_len = max(self.index) if self.index else 0
+
+    def get(self, ctx):
+        """Returns the next words and scores for the context ``ctx``.
+
+        Args:
+            ctx (tuple): Context words
+
+        Returns:
+            tuple. Arrays of words and scores, or ``None`` if ``ctx``
+            is not a context of any n-gram
+        """
+        entry = self.index.get(len(ctx))
+        if entry is None:
+            return None
+        keys, ctx_idxs = entry
+        key = _pack_contexts(np.array([ctx]), len(ctx))
+        pos = int(np.searchsorted(keys, key[0]))
+        if pos == len(keys) or keys[pos] != key[0]:
+            return None
+        idx = ctx_idxs[pos]
+        begin = int(self.entry_offsets[idx])
+        end = int(self.entry_offsets[idx+1])
+        return self.words[begin:end], self.scores[begin:end]
+
+
+def _pack_contexts(rows, ctx_len):
+    """Packs each row of the 2-D array ``rows`` into a single fixed-size
+    key. Word ids are stored as big-endian unsigned integers, so keys
+    compare like the context tuples.
+
+    Args:
+        rows (array): Contexts of length ``ctx_len``, one per row
+        ctx_len (int): Context length
+
+    Returns:
+        array. One-dimensional array of keys
+    """
+    if ctx_len == 0:
+        return np.zeros((len(rows),), dtype=np.int8)
+    packed = np.ascontiguousarray(rows, dtype=">u4")
+    return packed.view(np.dtype((np.void, 4 * ctx_len))).reshape(-1)
+
+
+def load_ngram_posteriors(path, order=0):
+    """Loads n-gram posteriors from a text file.
+
+    Args:
+        path (string): Path to the n-gram posterior file
+        order (int): If positive, only use n-grams of this order
+
+    Returns:
+        NgramPosteriors. The posteriors in ``path``
+    """
+    logging.debug("Loading n-gram scores from %s..." % path)
+    (ctx_token_offsets, ctx_tokens, ctx_entry_offsets,
+     words, scores) = _flatten(parse_ngram_file(path))
+    return NgramPosteriors(ctx_token_offsets, ctx_tokens, ctx_entry_offsets,
+                           np.array(words, dtype=np.int32),
+                           np.array(scores, dtype=np.float64),
+                           order)
+
+
+def compile_ngram_posteriors(path_tmpl, n_sentences, out_path):
+    """Compiles per-sentence n-gram posterior text files into a single
+    binary file which can be read with ``NgramPosteriorStore``.
+
+    Args:
+        path_tmpl (string): Path to the text files with placeholder %d
+                            for the sentence id (starting from 1)
+        n_sentences (int): Number of sentences
+        out_path (string): Path to the compiled file
+    """
+    sen_offsets = [0]
+    ctx_token_offsets = [0]
+    ctx_tokens = []
+    ctx_entry_offsets = [0]
+    words = []
+    scores = []
+    for sen_id in range(n_sentences):
+        (sen_token_offsets, sen_tokens, sen_entry_offsets,
+         sen_words, sen_scores) = _flatten(parse_ngram_file(
+            utils.get_path(path_tmpl, sen_id+1)))
+        ctx_token_offsets.extend(len(ctx_tokens) + o
+                                 for o in sen_token_offsets[1:])
+        ctx_entry_offsets.extend(len(words) + o
+                                 for o in sen_entry_offsets[1:])
+        ctx_tokens.extend(sen_tokens)
+        words.extend(sen_words)
+        scores.extend(sen_scores)
+        sen_offsets.append(len(ctx_entry_offsets) - 1)
+    arrays = {"sen_offsets": sen_offsets,
+              "ctx_token_offsets": ctx_token_offsets,
+              "ctx_tokens": ctx_tokens,
+              "ctx_entry_offsets": ctx_entry_offsets,
+              "words": words,
+              "scores": scores}
+    header = {"n_sentences": n_sentences, "arrays": {}}
+    offset = 0
+    for name, dtype in _ARRAY_DTYPES:
+        arrays[name] = np.array(arrays[name], dtype=dtype)
+        header["arrays"][name] = [offset, len(arrays[name])]
+        offset += arrays[name].nbytes
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_offset = len(MAGIC) + 8 + len(header_bytes)
+    padding = (-data_offset) % 8
+    header_bytes += b" " * padding
+    with open(out_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for name, _ in _ARRAY_DTYPES:
+            f.write(arrays[name].tobytes())
+    logging.info("Compiled n-gram posteriors of %d sentences (%d contexts, "
+                 "%d n-grams) to %s" % (n_sentences,
+                                         len(ctx_entry_offsets) - 1,
+                                         len(words),
+                                         out_path))
+
+
+def is_ngram_store(path):
+    """Returns true if ``path`` is a compiled n-gram posterior file. """
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except IOError:
+        return False
+
+
+class NgramPosteriorStore(object):
+    """Read-only access to a file created with
+    ``compile_ngram_posteriors``. All arrays are memory mapped, so
+    loading the posteriors of a sentence only reads the pages which are
+    touched by context lookups.
+    """
+
+    def __init__(self, path, order=0):
+        """Opens a compiled n-gram posterior file.
+
+        Args:
+            path (string): Path to the compiled file
+            order (int): If positive, only use n-grams of this order
+        """
+        self.order = order
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise IOError("%s is not a compiled n-gram file" % path)
+            header_len = struct.unpack("<Q", f.read(8))[0]
+            header = json.loads(f.read(header_len).decode("utf-8"))
+        data_offset = len(MAGIC) + 8 + header_len
+        self.n_sentences = header["n_sentences"]
+        for name, dtype in _ARRAY_DTYPES:
+            offset, length = header["arrays"][name]
+            if length > 0:
+                arr = np.memmap(path, dtype=dtype, mode="r",
+                                offset=data_offset + offset,
+                                shape=(length,))
+            else:
+                arr = np.zeros((0,), dtype=dtype)
+            setattr(self, name, arr)
+
+    def get_sentence(self, sen_id):
+        """Returns the n-gram posteriors of a sentence.
+
+        Args:
+            sen_id (int): Sentence id (starting from 0)
+
+        Returns:
+            NgramPosteriors. Posteriors of sentence ``sen_id``
+        """
+        if sen_id >= self.n_sentences:
+            logging.warn("No n-gram posteriors for sentence %d" % (sen_id+1))
+            return NgramPosteriors([0], [], [0], self.words[:0],
+                                   self.scores[:0])
+        ctx_begin = int(self.sen_offsets[sen_id])
+        ctx_end = int(self.sen_offsets[sen_id+1])
+        token_offsets = self.ctx_token_offsets[ctx_begin:ctx_end+1]
+        entry_offsets = self.ctx_entry_offsets[ctx_begin:ctx_end+1]
+        first_token = int(token_offsets[0])
+        first_entry = int(entry_offsets[0])
+        last_entry = int(entry_offsets[-1])
+        return NgramPosteriors(
+            token_offsets - first_token,
+            self.ctx_tokens[first_token:int(token_offsets[-1])],
+            entry_offsets - first_entry,
+            self.words[first_entry:last_entry],
+            self.scores[first_entry:last_entry],
+            self.order)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# coding=utf-8
+# Copyright 2019 The SGNMT Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module implements asynchronous prefetching of per-sentence
+resources like translation lattices or n-gram posterior files. While
+sentence i is decoded, the resources for sentences i+1..i+k are loaded
+and parsed in a background thread pool.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import weakref
+
+
+_EXECUTOR = None
+"""Thread pool shared by all ``Prefetcher`` instances. """
+
+
+_N_THREADS = 2
+"""Number of threads in the shared thread pool. """
+
+
+_N_SENTENCES = None
+"""If set, sentence ids from this value on are never prefetched. """
+
+
+_PREFETCHERS = weakref.WeakSet()
+"""All live ``Prefetcher`` instances. """
+
+
+def set_prefetch_threads(n_threads):
+    """Sets the number of threads of the prefetching thread pool. This
+    must be called before the first resource is prefetched.
+
+    Args:
+        n_threads (int): Number of background threads
+    """
+    global _N_THREADS
+    _N_THREADS = max(1, n_threads)
+
+
+def set_prefetch_range(n_sentences):
+    """Sets the number of sentences in the test set. Resources for 
+    sentence ids beyond the end of the test set are not prefetched.
+
+    Args:
+        n_sentences (int): Number of sentences, or None if unknown
+    """
+    global _N_SENTENCES
+    _N_SENTENCES = n_sentences
+
+
+def shutdown_prefetching():
+    """Cancels all pending prefetch jobs and waits for running jobs
+    to finish. This should be called after decoding.
+    """
+    global _EXECUTOR
+    for prefetcher in list(_PREFETCHERS):
+        prefetcher.cancel()
+    if _EXECUTOR is not None:
+        _EXECUTOR.shutdown(wait=True)
+        _EXECUTOR = None
+
+
+def _get_executor():
+    """Creates the shared thread pool on first use. """
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        _EXECUTOR = ThreadPoolExecutor(max_workers=_N_THREADS)
+    return _EXECUTOR
+
+
+class Prefetcher(object):
+    """Loads per-sentence resources ahead of time. ``load_func`` is
+    called with the (0-based) sentence id and returns the parsed
+    resource. ``get(sen_id)`` returns the resource for ``sen_id`` and
+    schedules loading the next ``lookahead`` sentences in the
+    background. We assume that sentences are decoded in ascending
+    order; if this is not the case, resources are loaded synchronously
+    on cache misses.
+
+    At most ``lookahead+1`` resources are held in memory.
+    """
+
+    def __init__(self, load_func, lookahead=0):
+        """Creates a new prefetcher.
+
+        Args:
+            load_func (function): Maps a sentence id to the resource
+            lookahead (int): Number of sentences to load ahead of time.
+                             If 0, resources are loaded synchronously
+                             in ``get()``
+        """
+        self.load_func = load_func
+        self.lookahead = max(0, lookahead)
+        self.futures = OrderedDict()
+        _PREFETCHERS.add(self)
+
+    def _schedule(self, sen_id):
+        """Submits the load job for ``sen_id`` if not done yet and if
+        ``sen_id`` is within the test set.
+        """
+        if _N_SENTENCES is not None and sen_id >= _N_SENTENCES:
+            return
+        if sen_id not in self.futures:
+            self.futures[sen_id] = _get_executor().submit(self.load_func,
+                                                          sen_id)
+
+    def _evict(self, sen_id):
+        """Drops all cached resources outside the prefetch window. """
+        for key in list(self.futures.keys()):
+            if key < sen_id or key > sen_id + self.lookahead:
+                self.futures.pop(key).cancel()
+
+    def cancel(self):
+        """Cancels all pending load jobs and drops cached resources. """
+        for future in self.futures.values():
+            future.cancel()
+        self.futures.clear()
+
+    def get(self, sen_id):
+        """Returns the resource for ``sen_id``.
+
+        Args:
+            sen_id (int): Sentence id (starting from 0)
+
+        Returns:
+            object. The return value of ``load_func(sen_id)``
+        """
+        if self.lookahead <= 0:
+            return self.load_func(sen_id)
+        future = self.futures.pop(sen_id, None)
+        self._evict(sen_id)
+        for next_id in range(sen_id + 1, sen_id + self.lookahead + 1):
+            self._schedule(next_id)
+        if future is None:
+            logging.debug("Prefetch miss for sentence %d" % (sen_id + 1))
+            return self.load_func(sen_id)
+        return future.result()
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+# coding=utf-8
+# Copyright 2019 The SGNMT Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module provides lazy per-sentence access to large text files
+like Moses n-best lists or reference files. A byte offset index is
+built once and cached next to the file. Sentences are read on demand
+through a memory map, so that a process only touches the parts of the
+file which belong to the sentences it decodes.
+"""
+
+from collections import OrderedDict
+import logging
+import mmap
+import os
+
+import numpy as np
+
+
+CHUNK_SIZE = 1 << 26
+"""Number of bytes to scan at once when building the index. """
+
+
+def _find_line_starts(mm, size):
+    """Returns the byte offsets of all lines in the memory map ``mm``.
+    The last element is the file size. """
+    starts = [np.zeros((1,), dtype=np.int64)]
+    for chunk_start in range(0, size, CHUNK_SIZE):
+        chunk = np.frombuffer(mm[chunk_start:chunk_start+CHUNK_SIZE],
+                              dtype=np.uint8)
+        starts.append(np.flatnonzero(chunk == 10).astype(np.int64)
+                      + chunk_start + 1)
+    starts = np.concatenate(starts)
+    if starts[-1] != size:
+        starts = np.append(starts, size)
+    return starts
+
+
+class IndexedTextFile(object):
+    """Lazy per-sentence access to a text file. In plain mode, line i
+    belongs to sentence i. In n-best mode, lines are grouped by the
+    sentence id in the first column of the Moses n-best format, and
+    lines of the same sentence do not need to be contiguous.
+
+    The index is stored in ``<path>.idx.npz`` (``<path>.nbestidx.npz``
+    in n-best mode) and rebuilt if the file is newer than the index.
+    The ``read_ahead`` sentences after the last requested one are
+    announced to the OS with ``madvise`` where supported, and recently
+    read sentences are kept in a small cache.
+    """
+
+    def __init__(self, path, nbest=False, read_ahead=4):
+        """Opens the file and loads or builds the index.
+
+        Args:
+            path (string): Path to the text file
+            nbest (bool): If true, group lines by the sentence id in
+                          the first column
+            read_ahead (int): Size of the read-ahead window in
+                              sentences
+        """
+        self.path = path
+        self.read_ahead = read_ahead
+        self.cache = OrderedDict()
+        self.size = os.path.getsize(path)
+        self.f = open(path, "rb")
+        self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ) \
+            if self.size > 0 else b""
+        self._load_index(nbest)
+
+    def _load_index(self, nbest):
+        """Sets ``line_starts``, ``line_ends``, and ``sen_offsets``.
+        Lines of sentence i are at positions
+        ``sen_offsets[i]:sen_offsets[i+1]`` of the line arrays.
+        """
+        index_path = "%s.%sidx.npz" % (self.path, "nbest" if nbest else "")
+        if (os.path.isfile(index_path)
+                and os.path.getmtime(index_path) >= os.path.getmtime(self.path)):
+            with np.load(index_path) as data:
+                self.line_starts = data["line_starts"]
+                self.line_ends = data["line_ends"]
+                self.sen_offsets = data["sen_offsets"]
+            return
+        logging.info("Building line index for %s..." % self.path)
+        offsets = _find_line_starts(self.mm, self.size)
+        line_starts = offsets[:-1]
+        line_ends = offsets[1:]
+        if not nbest:
+            self.line_starts = line_starts
+            self.line_ends = line_ends
+            self.sen_offsets = np.arange(len(line_starts) + 1, dtype=np.int64)
+        else:
+            sen_ids = np.full((len(line_starts),), -1, dtype=np.int64)
+            mm = self.mm
+            for idx, (start, end) in enumerate(zip(line_starts.tolist(),
+                                                   line_ends.tolist())):
+                sep = mm.find(b"|||", start, end)
+                if sep >= 0:
+                    try:
+                        sen_ids[idx] = int(mm[start:sep])
+                    except ValueError:
+                        pass
+            valid = sen_ids >= 0
+            n_malformed = len(sen_ids) - int(valid.sum())
+            if n_malformed > 0:
+                logging.warn("Skipping %d malformed lines in n-best list %s"
+                             % (n_malformed, self.path))
+            sen_ids = sen_ids[valid]
+            order = np.argsort(sen_ids, kind="mergesort")
+            self.line_starts = line_starts[valid][order]
+            self.line_ends = line_ends[valid][order]
+            n_sentences = int(sen_ids.max()) + 1 if len(sen_ids) else 0
+            self.sen_offsets = np.searchsorted(
+                sen_ids[order], np.arange(n_sentences + 1)).astype(np.int64)
+        # Write to a temporary file first such that concurrent 
+        # processes never read a partially written index
+        tmp_path = "%s.%d.tmp" % (index_path, os.getpid())
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez(f,
+                         line_starts=self.line_starts,
+                         line_ends=self.line_ends,
+                         sen_offsets=self.sen_offsets)
+            os.replace(tmp_path, index_path)
+        except (IOError, OSError) as e:
+            logging.warn("Could not write line index %s: %s" % (index_path, e))
+
+    def __len__(self):
+        """Returns the number of sentences. """
+        return len(self.sen_offsets) - 1
+
+    def _advise(self, sen_id):
+        """Asks the OS to prefetch the pages of the next sentences. """
+        if not hasattr(self.mm, "madvise") or self.read_ahead <= 0:
+            return
+        first = min(sen_id + 1, len(self))
+        last = min(sen_id + 1 + self.read_ahead, len(self))
+        if first >= last:
+            return
+        lines = slice(self.sen_offsets[first], self.sen_offsets[last])
+        if lines.start >= lines.stop:
+            return
+        start = int(self.line_starts[lines].min())
+        end = int(self.line_ends[lines].max())
+        start -= start % mmap.PAGESIZE
+        try:
+            self.mm.madvise(mmap.MADV_WILLNEED, start, end - start)
+        except (AttributeError, ValueError, OSError):
+            pass
+
+    def get_lines(self, sen_id):
+        """Returns the lines which belong to sentence ``sen_id``.
+
+        Args:
+            sen_id (int): Sentence id (starting from 0)
+
+        Returns:
+            list. Lines (without trailing newline) of the sentence, or
+            an empty list if ``sen_id`` is out of range
+        """
+        lines = self.cache.get(sen_id)
+        if lines is not None:
+            return lines
+        if sen_id < 0 or sen_id >= len(self):
+            return []
+        lines = [self.mm[start:end].decode("utf-8").rstrip("\n")
+                 for start, end in zip(
+                     self.line_starts[self.sen_offsets[sen_id]:
+                                      self.sen_offsets[sen_id+1]].tolist(),
+                     self.line_ends[self.sen_offsets[sen_id]:
+                                    self.sen_offsets[sen_id+1]].tolist())]
+        self.cache[sen_id] = lines
+        while len(self.cache) > max(1, self.read_ahead):
+            self.cache.popitem(last=False)
+        self._advise(sen_id)
+        return lines
@@ -32,12 +32,15 @@ has compatibility reasons, as lattices generated by HiFST have these
 symbols.
 """
 
-import glob
+from collections import OrderedDict
 import logging
 import os
+import re
 import sys
 
 from cam.sgnmt import utils
+from cam.sgnmt.misc.lattice import CompiledFst
+from cam.sgnmt.misc.prefetch import Prefetcher
 from cam.sgnmt.predictors.core import Predictor
 from cam.sgnmt.utils import w2f, load_fst
 
@@ -54,10 +57,29 @@ EPS_ID = 0
 """OpenFST's reserved ID for epsilon arcs. """
 
 
+def load_compiled_lattice(path):
+    """Loads an FST with ``load_fst`` and compiles it to a 
+    ``CompiledFst``. This is used as load function for prefetching.
+    
+    Args:
+        path (string): Path to the FST file
+    
+    Returns:
+        tuple. The FST and the ``CompiledFst``, or (None, None) if the
+        FST could not be read.
+    """
+    fst_obj = load_fst(path)
+    if not fst_obj:
+        return None, None
+    return fst_obj, CompiledFst(fst_obj)
+
+
 class FstPredictor(Predictor):
     """This predictor can read determinized translation lattices. The
     predictor state consists of the current node. This is unique as the
-    lattices are determinized.
+    lattices are determinized. Lattices are converted to a 
+    ``CompiledFst`` when they are loaded, so that ``predict_next`` and
+    ``consume`` do not need to call the FST library.
     """
     
     def __init__(self,
@@ -65,7 +87,8 @@ class FstPredictor(Predictor):
                  use_weights,
                  normalize_scores,
                  skip_bos_weight = True,
-                 to_log = True):
+                 to_log = True,
+                 prefetch_lookahead = 0):
         """Creates a new fst predictor.
         
         Args:
@@ -85,13 +108,20 @@ class FstPredictor(Predictor):
                            arc weights in FSTs normally have cost (i.e.
                            neg. log values) semantics. Therefore, if
                            true, we multiply arc weights by -1.
+            prefetch_lookahead (int): Number of lattices to load in the
+                                      background ahead of time
         """
         super(FstPredictor, self).__init__()
         self.fst_path = fst_path
+        self.prefetcher = Prefetcher(
+            lambda sen_id: load_compiled_lattice(
+                utils.get_path(fst_path, sen_id+1)),
+            prefetch_lookahead)
         self.weight_factor = -1.0 if to_log else 1.0
         self.use_weights = use_weights
         self.normalize_scores = normalize_scores
         self.cur_fst = None
+        self.cur_lattice = None
         self.add_bos_to_eos_score = not skip_bos_weight
         self.cur_node = -1
         
@@ -115,8 +145,10 @@ class FstPredictor(Predictor):
         """
         if self.cur_node < 0:
             return {}
-        scores = {arc.olabel: self.weight_factor*w2f(arc.weight)
-                for arc in self.cur_fst.arcs(self.cur_node)}
+        begin, end = self.cur_lattice.arc_range(self.cur_node)
+        scores = dict(zip(
+            self.cur_lattice.labels[begin:end].tolist(),
+            (self.weight_factor*self.cur_lattice.weights[begin:end]).tolist()))
         if utils.EOS_ID in scores and self.add_bos_to_eos_score:
             scores[utils.EOS_ID] += self.bos_score
         return self.finalize_posterior(scores,
@@ -129,13 +161,13 @@ class FstPredictor(Predictor):
         Args:
             src_sentence (list):  Not used
         """
-        self.cur_fst = load_fst(utils.get_path(self.fst_path,
-                                               self.current_sen_id+1))
-        self.cur_node = self.cur_fst.start() if self.cur_fst else None
+        self.cur_fst, self.cur_lattice = self.prefetcher.get(
+            self.current_sen_id)
+        self.cur_node = self.cur_lattice.start if self.cur_lattice else -1
         self.bos_score = self.consume(utils.GO_ID)
         if not self.bos_score: # Override None
             self.bos_score = 0.0
-        if self.cur_node is None:
+        if self.cur_node < 0:
             logging.warn("The lattice for sentence %d does not contain any "
                          "valid path. Please double-check that the lattice "
                          "is not empty and that paths contain the begin-of-"
@@ -158,17 +190,15 @@ class FstPredictor(Predictor):
         """
         if self.cur_node < 0:
             return
-        from_state = self.cur_node
-        self.cur_node = None
-        unk_arc = None
-        for arc in self.cur_fst.arcs(from_state):
-            if arc.olabel == word:
-                self.cur_node = arc.nextstate
-                return self.weight_factor*w2f(arc.weight)
-            elif arc.olabel == utils.UNK_ID:
-                unk_arc = arc
-        if unk_arc is not None:
-            self.cur_node = unk_arc.nextstate
+        arc = self.cur_lattice.find_arc(self.cur_node, word)
+        if arc >= 0:
+            self.cur_node = int(self.cur_lattice.nextstates[arc])
+            return self.weight_factor*float(self.cur_lattice.weights[arc])
+        arc = self.cur_lattice.find_arc(self.cur_node, utils.UNK_ID)
+        if arc >= 0:
+            self.cur_node = int(self.cur_lattice.nextstates[arc])
+        else:
+            self.cur_node = -1
     
     def get_state(self):
         """Returns the current node. """
@@ -180,17 +210,17 @@ class FstPredictor(Predictor):
 
     def initialize_heuristic(self, src_sentence):
         """Creates a matrix of shortest distances between nodes. """
-        self.distances = fst.shortestdistance(self.cur_fst, reverse=True)
+        self.distances = [w2f(d) for d in 
+                          fst.shortestdistance(self.cur_fst, reverse=True)]
     
     def estimate_future_cost(self, hypo):
         """The FST predictor comes with its own heuristic function. We
         use the shortest path in the fst as future cost estimator. """
-        if not self.cur_node:
+        if self.cur_node < 0:
             return 0.0
-        last_word = hypo.trgt_sentence[-1]
-        for arc in self.cur_fst.arcs(self.cur_node):
-            if arc.olabel == last_word:
-                return w2f(self.distances[arc.nextstate])
+        arc = self.cur_lattice.find_arc(self.cur_node, hypo.trgt_sentence[-1])
+        if arc >= 0:
+            return self.distances[self.cur_lattice.nextstates[arc]]
         return 0.0
     
     def is_equal(self, state1, state2):
@@ -202,7 +232,15 @@ class NondeterministicFstPredictor(Predictor):
     """This predictor can handle non-deterministic translation 
     lattices. In contrast to the fst predictor for deterministic
     lattices, we store a set of nodes which are all reachable from
-    the start node through the current history.
+    the start node through the current history. Like the fst 
+    predictor, we operate on a ``CompiledFst`` version of the lattice.
+    
+    Epsilon closures and the best score for each label on the outgoing
+    arcs of a node are computed on demand and memoized for the current
+    lattice. Therefore, the cost of ``predict_next`` and ``consume`` is
+    proportional to the number of non-epsilon arcs of the active nodes.
+    The predictor state is a tuple of (weight, node) pairs sorted by
+    node.
     """
     
     def __init__(self, 
@@ -210,7 +248,8 @@ class NondeterministicFstPredictor(Predictor):
                  use_weights, 
                  normalize_scores, 
                  skip_bos_weight = True, 
-                 to_log = True):
+                 to_log = True,
+                 prefetch_lookahead = 0):
         """Creates a new nfst predictor.
         
         Args:
@@ -226,16 +265,25 @@ class NondeterministicFstPredictor(Predictor):
                            arc weights in FSTs normally have cost (i.e.
                            neg. log values) semantics. Therefore, if
                            true, we multiply arc weights by -1.
+            prefetch_lookahead (int): Number of lattices to load in the
+                                      background ahead of time
         """
         super(NondeterministicFstPredictor, self).__init__()
         self.fst_path = fst_path
+        self.prefetcher = Prefetcher(
+            lambda sen_id: load_compiled_lattice(
+                utils.get_path(fst_path, sen_id+1)),
+            prefetch_lookahead)
         self.weight_factor = -1.0 if to_log else 1.0
         self.score_max_func = max if to_log else min
         self.use_weights = use_weights
         self.skip_bos_weight = skip_bos_weight
         self.normalize_scores = normalize_scores
         self.cur_fst = None
-        self.cur_nodes = []
+        self.cur_lattice = None
+        self.cur_nodes = ()
+        self.eps_closures = {}
+        self.label_scores = {}
         
     def get_unk_probability(self, posterior):
         """Always returns negative infinity: Words outside the 
@@ -260,19 +308,57 @@ class NondeterministicFstPredictor(Predictor):
             together with their scores, or an empty set if we currently
             have no active nodes or fst.
         """
-        scores = {}
-        for weight,node in self.cur_nodes:
-            for arc in self.cur_fst.arcs(node): 
-                if arc.olabel != EPS_ID:
-                    score = weight + self.weight_factor*w2f(arc.weight) 
-                    if arc.olabel in scores:
-                        scores[arc.olabel] = self.score_max_func(
-                                        scores[arc.olabel], score)
+        if len(self.cur_nodes) == 1:
+            weight, node = self.cur_nodes[0]
+            scores = {label: weight + score 
+                      for label, score in self._get_label_scores(node)}
+        else:
+            scores = {}
+            score_max_func = self.score_max_func
+            for weight,node in self.cur_nodes:
+                for label, score in self._get_label_scores(node):
+                    score += weight
+                    if label in scores:
+                        scores[label] = score_max_func(scores[label], score)
                     else:
-                        scores[arc.olabel] = score 
+                        scores[label] = score 
         return self.finalize_posterior(scores,
                 self.use_weights, self.normalize_scores)
     
+    def _get_label_scores(self, node):
+        """Returns (label, score) pairs for all non-epsilon labels on 
+        the outgoing arcs of ``node``. If there are multiple arcs with
+        the same label, the best score is used. Results are memoized.
+        """
+        label_scores = self.label_scores.get(node)
+        if label_scores is None:
+            lattice = self.cur_lattice
+            scores = {}
+            begin, end = lattice.arc_range(node)
+            arc_scores = self.weight_factor*lattice.weights[begin:end]
+            for label, score in zip(lattice.labels[begin:end].tolist(),
+                                    arc_scores.tolist()):
+                if label != EPS_ID:
+                    if label in scores:
+                        scores[label] = self.score_max_func(scores[label], 
+                                                            score)
+                    else:
+                        scores[label] = score 
+            label_scores = list(scores.items())
+            self.label_scores[node] = label_scores
+        return label_scores
+    
+    def _get_eps_closure(self, node):
+        """Returns the (weight, node) pairs for all nodes with 
+        non-epsilon arcs which are reachable from ``node`` via epsilon
+        arcs. Results are memoized.
+        """
+        closure = self.eps_closures.get(node)
+        if closure is None:
+            closure = self._follow_eps({node: 0.0})
+            self.eps_closures[node] = closure
+        return closure
+    
     def initialize(self, src_sentence):
         """Loads the FST from the file system and consumes the start
         of sentence symbol. 
@@ -280,11 +366,15 @@ class NondeterministicFstPredictor(Predictor):
         Args:
             src_sentence (list):  Not used
         """
-        self.cur_fst = load_fst(utils.get_path(self.fst_path,
-                                               self.current_sen_id+1))
-        self.cur_nodes = []
-        if self.cur_fst:
-            self.cur_nodes = self._follow_eps({self.cur_fst.start(): 0.0})
+        self.cur_fst, self.cur_lattice = self.prefetcher.get(
+            self.current_sen_id)
+        self.eps_closures = {}
+        self.label_scores = {}
+        self.cur_nodes = ()
+        if self.cur_lattice:
+            self.cur_nodes = tuple(sorted(
+                self._get_eps_closure(self.cur_lattice.start),
+                key=lambda n: n[1]))
         self.consume(utils.GO_ID)
         if not self.cur_nodes:
             logging.warn("The lattice for sentence %d does not contain any "
@@ -304,20 +394,30 @@ class NondeterministicFstPredictor(Predictor):
             word (int): Word on an outgoing arc from the current node
         """
         d_unconsumed = {}
+        lattice = self.cur_lattice
         # Collect distances to nodes reachable by word
         for weight,node in self.cur_nodes:
-            for arc in self.cur_fst.arcs(node):
-                if arc.olabel == word:
-                    next_node = arc.nextstate
-                    next_score = weight + self.weight_factor*w2f(arc.weight)
-                    if d_unconsumed.get(next_node, utils.NEG_INF) < next_score:
-                        d_unconsumed[next_node] = next_score
+            begin, end = lattice.find_arcs(node, word)
+            for arc in range(begin, end):
+                next_node = int(lattice.nextstates[arc])
+                next_score = weight + self.weight_factor*float(lattice.weights[arc])
+                if d_unconsumed.get(next_node, utils.NEG_INF) < next_score:
+                    d_unconsumed[next_node] = next_score
+        if not d_unconsumed:
+            self.cur_nodes = ()
+            return
         # Subtract the word score from the last predict_next 
         consumed_score = self.score_max_func(d_unconsumed.values()) \
              if (word != utils.GO_ID or self.skip_bos_weight) else 0.0
         # Add epsilon reachable states
-        self.cur_nodes = self._follow_eps({node: score - consumed_score
-                    for node,score in d_unconsumed.items()})
+        d = {}
+        for node,score in d_unconsumed.items():
+            score -= consumed_score
+            for weight, next_node in self._get_eps_closure(node):
+                next_score = score + weight
+                if d.get(next_node, utils.NEG_INF) < next_score:
+                    d[next_node] = next_score
+        self.cur_nodes = tuple((d[node], node) for node in sorted(d))
     
     def _follow_eps(self, roots):
         """BFS to find nodes reachable from root through eps arcs. This
@@ -331,51 +431,53 @@ class NondeterministicFstPredictor(Predictor):
         open_nodes = dict(roots)
         d = {}
         visited = dict(roots)
+        lattice = self.cur_lattice
         while open_nodes:
             next_open = {}
             for node,score in open_nodes.items():
-                has_noneps = False
-                for arc in self.cur_fst.arcs(node):
-                    if arc.olabel == EPS_ID:
-                        next_node = arc.nextstate
-                        next_score = score + self.weight_factor*w2f(arc.weight)
-                        if visited.get(next_node, utils.NEG_INF) < next_score:
-                            visited[next_node] = next_score
-                            next_open[next_node] = next_score
-                    else:
-                        has_noneps = True
+                begin, end = lattice.find_arcs(node, EPS_ID)
+                for arc in range(begin, end):
+                    next_node = int(lattice.nextstates[arc])
+                    next_score = score + self.weight_factor*float(lattice.weights[arc])
+                    if visited.get(next_node, utils.NEG_INF) < next_score:
+                        visited[next_node] = next_score
+                        next_open[next_node] = next_score
+                n_arcs = lattice.offsets[node+1] - lattice.offsets[node]
+                has_noneps = n_arcs > end - begin
                 if has_noneps:
                     d[node] = score
             open_nodes = next_open
         return [(weight, node) for node, weight in d.items()]
         
     def get_state(self):
-        """Returns the set of current nodes """
+        """Returns the tuple of current nodes """
         return self.cur_nodes
     
     def set_state(self, state):
-        """Sets the set of current nodes """
+        """Sets the tuple of current nodes """
         self.cur_nodes = state
 
     def initialize_heuristic(self, src_sentence):
         """Creates a matrix of shortest distances between all nodes """
-        self.distances = fst.shortestdistance(self.cur_fst, reverse=True)
+        self.distances = [w2f(d) for d in 
+                          fst.shortestdistance(self.cur_fst, reverse=True)]
     
     def estimate_future_cost(self, hypo):
         """The FST predictor comes with its own heuristic function. We
         use the shortest path in the fst as future cost estimator. """
         last_word = hypo.trgt_sentence[-1]
         dists = []
-        for n in self.cur_nodes:
-            for arc in self.cur_fst[n].arcs:
-                if arc.olabel == last_word:
-                    dists.append(w2f(self.distances[arc.nextstate]))
-                    break
+        for _, n in self.cur_nodes:
+            arc = self.cur_lattice.find_arc(n, last_word)
+            if arc >= 0:
+                dists.append(self.distances[self.cur_lattice.nextstates[arc]])
         return 0.0 if not dists else min(dists)
     
     def is_equal(self, state1, state2):
         """Returns true if the current nodes are the same """
-        return sorted([n for _,n in state1]) == sorted([n for _,n in state2])
+        if len(state1) != len(state2):
+            return False
+        return all(n1 == n2 for (_, n1), (_, n2) in zip(state1, state2))
 
 
 class RtnPredictor(Predictor):
@@ -403,7 +505,9 @@ class RtnPredictor(Predictor):
                  normalize_scores,
                  to_log = True,
                  minimize_rtns = False,
-                 rmeps = True):
+                 rmeps = True,
+                 prefetch_lookahead = 0,
+                 cache_size = 1000):
         """Creates a new RTN predictor.
         
         Args:
@@ -421,6 +525,13 @@ class RtnPredictor(Predictor):
                                   operation
             rmeps (bool): Remove epsilons in the FST after each replace
                           operation 
+            prefetch_lookahead (int): Number of root FSTs to load in the
+                                      background ahead of time
+            cache_size (int): Maximum number of sub FSTs which are kept
+                              in memory across sentences. Sub FSTs are
+                              identified by file identity, so sentence
+                              directories can share sub FSTs through
+                              hard or symbolic links
         """
         super(RtnPredictor, self).__init__()
         self.root_path = rtn_path
@@ -430,6 +541,10 @@ class RtnPredictor(Predictor):
         self.normalize_scores = normalize_scores
         self.weight_factor = -1.0 if to_log else 1.0
         self.cur_fst = None # current root fst
+        self.cur_fst_processed = True
+        self.cache_size = cache_size
+        self.fst_cache = OrderedDict() # LRU cache: file identity -> sub fst
+        self.sub_fsts = {} # fst id -> sub fst for the current sentence
         start_id = '1'
         try:
             with open("%s/ntmap" % self.root_path) as f:
@@ -438,6 +553,7 @@ class RtnPredictor(Predictor):
         except:
             logging.warn("Could not find NT S in ntmap. Assuming its ID 1")
         self.root_fst_prefix = "1%s000" % start_id.zfill(3)
+        self.prefetcher = Prefetcher(self._load_root_fst, prefetch_lookahead)
         
     def get_unk_probability(self, posterior):
         """Always returns negative infinity: Words outside the 
@@ -448,41 +564,76 @@ class RtnPredictor(Predictor):
         """
         return utils.NEG_INF
     
-    def initialize(self, src_sentence):
-        """Loads the root RTN and consumes the start of sentence 
-        symbol.
+    def _get_root_fst_span(self, file_name):
+        """Returns the span end encoded in the name of a root FST file,
+        i.e. the last number after ``root_fst_prefix``, or -1 if there
+        is none.
+        """
+        numbers = re.findall(r"\d+", file_name[len(self.root_fst_prefix):-4])
+        return int(numbers[-1]) if numbers else -1
+    
+    def _load_root_fst(self, sen_id):
+        """Finds and reads the root FST for the given sentence.
         
         Args:
-            src_sentence (list):  Not used
+            sen_id (int): Sentence id (starting from 0)
+        
+        Returns:
+            fst. The root FST or ``None`` if it could not be read
         """
+        file_name = "%s/%d.fst" % (self.root_path, sen_id+1)
         try:
-            file_name = "%s/%d.fst" % (self.root_path, self.current_sen_id+1)
             if not os.access(file_name, os.R_OK): # Find root FST
-                search_pattern = '%s/%d/%s*.fst' % (self.root_path,
-                                                    self.current_sen_id+1,
-                                                    self.root_fst_prefix)
-                candidates = glob.glob(search_pattern)
+                sen_dir = '%s/%d' % (self.root_path, sen_id+1)
+                candidates = sorted(
+                    (f for f in os.listdir(sen_dir)
+                     if f.startswith(self.root_fst_prefix) 
+                        and f.endswith(".fst")),
+                    key=lambda f: (self._get_root_fst_span(f), f))
                 if not candidates:
-                    logging.error("Could not find root fst in %s" % 
-                                    search_pattern)
-                    self.cur_fst = None
-                    return
+                    logging.error("Could not find root fst in %s/%s*.fst" % 
+                                    (sen_dir, self.root_fst_prefix))
+                    return None
                 if len(candidates) > 1:
-                    logging.warn("Ambiguous root fst for %s. Take the one "
-                                 "with largest span." % search_pattern)
-                    candidates = sorted(candidates)
-                file_name = candidates[-1]
-            self.cur_fst = fst.Fst.read(file_name) 
+                    logging.warn("Ambiguous root fst for %s/%s*.fst. Take the "
+                                 "one with largest span." % (
+                                     sen_dir, self.root_fst_prefix))
+                file_name = "%s/%s" % (sen_dir, candidates[-1])
+            root_fst = fst.Fst.read(file_name) 
             logging.debug("Read (root)fst from %s" % file_name)
+            return root_fst
         except Exception as e:
             logging.error("%s error reading fst from %s: %s" %
                 (sys.exc_info()[1], file_name, e))
-            self.cur_fst = None
-        finally:
-            self.cur_history = []
-            self.sub_fsts = {}
+        return None
+    
+    def initialize(self, src_sentence):
+        """Loads the root RTN and consumes the start of sentence 
+        symbol.
+        
+        Args:
+            src_sentence (list):  Not used
+        """
+        self.cur_fst = self.prefetcher.get(self.current_sen_id)
+        self.cur_fst_processed = False
+        self.cur_history = []
+        self.sub_fsts = {}
         self.consume(utils.GO_ID)
     
+    def _process_fst(self, f):
+        """Applies epsilon removal and minimization to ``f`` according
+        to ``--remove_epsilon_in_rtns`` and ``--minimize_rtns``.
+        
+        Returns:
+            fst. The processed FST
+        """
+        if self.rmeps or self.minimize_rtns:
+            f.rmepsilon()
+        if self.minimize_rtns:
+            f = fst.determinize(f)
+            f.minimize()
+        return f
+    
     def expand_rtn(self, func):
         """This method expands the RTN as far as necessary. This means
         that the RTN is expanded s.t. we can build the posterior for 
@@ -513,13 +664,11 @@ class RtnPredictor(Predictor):
                             for (nt_label, f) in label_fst_map.items()],
                         epsilon_on_replace=True)
                 self.cur_fst = replaced_fst
+                self.cur_fst_processed = False
                 updated = True
-        if self.rmeps or self.minimize_rtns:
-            self.cur_fst.rmepsilon()
-        if self.minimize_rtns:
-            tmp = fst.determinize(self.cur_fst.determinize)
-            self.cur_fst = tmp
-            self.cur_fst.minimize()
+        if not self.cur_fst_processed:
+            self.cur_fst = self._process_fst(self.cur_fst)
+            self.cur_fst_processed = True
     
     def add_to_label_fst_map_recursive(self, 
                                        label_fst_map, 
@@ -574,20 +723,39 @@ class RtnPredictor(Predictor):
         return len(s) == 10 and s[0] == '1'
 
     def get_sub_fst(self, fst_id):
-        """ Load sub fst from the file system or the cache """
+        """Load sub fst from the file system or the cache. Sub FSTs are
+        kept in an LRU cache which persists across sentences. Paths are
+        specific to a sentence, so the cache is keyed by the identity of
+        the file (device, inode, size, and modification time). This way,
+        sub FSTs which are shared between sentence directories via links
+        are read only once. Epsilon removal and minimization are applied
+        once when the sub FST is loaded.
+        """
         if fst_id in self.sub_fsts:
             return self.sub_fsts[fst_id]
-        sub_fst_path = "%s/%d/%d.fst" %  (self.root_path,
-                                          self.current_sen_id+1,
+        sub_fst_path = "%s/%d/%d.fst" %  (self.root_path, 
+                                          self.current_sen_id+1, 
                                           fst_id)
         try:
-            sub_fst = fst.Fst.read(sub_fst_path)
-            logging.debug("Read sub fst from %s" % sub_fst_path)
-            self.sub_fsts[fst_id] = sub_fst
-            return sub_fst
-        except Exception as e:
-            logging.error("%s error reading sub fst from %s: %s" %
-                (sys.exc_info()[1], sub_fst_path, e))
+            st = os.stat(sub_fst_path)
+        except OSError:
+            logging.error("Sub fst %s does not exist" % sub_fst_path)
+            return None
+        cache_key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+        sub_fst = self.fst_cache.pop(cache_key, None)
+        if sub_fst is None:
+            try:
+                sub_fst = self._process_fst(fst.Fst.read(sub_fst_path))
+                logging.debug("Read sub fst from %s" % sub_fst_path)
+            except Exception as e:
+                logging.error("%s error reading sub fst from %s: %s" %
+                    (sys.exc_info()[1], sub_fst_path, e))
+                return None
+        self.fst_cache[cache_key] = sub_fst
+        while len(self.fst_cache) > self.cache_size:
+            self.fst_cache.popitem(last=False)
+        self.sub_fsts[fst_id] = sub_fst
+        return sub_fst
         
     def _add_to_cur_posterior(self, node, label, weight):
         """Can be used as ``func`` argument in ``expand_rtn`` to build
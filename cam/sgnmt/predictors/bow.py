@@ -26,6 +26,7 @@ import logging
 from cam.sgnmt import utils
 from cam.sgnmt.decoding.beam import BeamDecoder
 from cam.sgnmt.decoding.core import CLOSED_VOCAB_SCORE_NORM_NONE
+from cam.sgnmt.misc.textindex import IndexedTextFile
 from cam.sgnmt.misc.trie import SimpleTrie
 from cam.sgnmt.misc.unigram import FileUnigramTable, \
     BestStatsUnigramTable, FullStatsUnigramTable, AllStatsUnigramTable
@@ -96,8 +97,7 @@ class BagOfWordsPredictor(Predictor):
                                      hypothesis recombination
         """
         super(BagOfWordsPredictor, self).__init__()
-        with open(trg_test_file) as f:
-            self.lines = f.read().splitlines()
+        self.trg_file = IndexedTextFile(trg_test_file)
         if heuristic_scores_file:
             self.estimates = FileUnigramTable(heuristic_scores_file)
         elif collect_stats_strategy == 'best':
@@ -130,50 +130,67 @@ class BagOfWordsPredictor(Predictor):
     
     def predict_next(self):
         """If the bag is empty, the only allowed symbol is EOS. 
-        Otherwise, return the list of keys in the bag.
+        Otherwise, return the list of words in the bag.
         """
-        if not self.bag: # Empty bag
+        if not any(self.bag): # Empty bag
             return {utils.EOS_ID : 0.0}
-        ret = {w : 0.0 for w in self.bag}
+        ret = {w : 0.0 for w, cnt in zip(self.bag_words, self.bag) if cnt}
         if self.accept_subsets:
             ret[utils.EOS_ID] = 0.0
         return ret
     
     def initialize(self, src_sentence):
-        """Creates a new bag for the current target sentence..
+        """Creates a new bag for the current target sentence. The 
+        distinct words of the reference are stored in ``bag_words``,
+        and the bag itself is a tuple of counts aligned with 
+        ``bag_words``.
         
         Args:
             src_sentence (list):  Not used
         """
         self.best_hypo_score = NEG_INF
-        self.bag = {}
-        for w in self.lines[self.current_sen_id].strip().split(): 
+        self.full_bag = {}
+        lines = self.trg_file.get_lines(self.current_sen_id)
+        for w in (lines[0].strip().split() if lines else []):
             int_w = int(w)
-            self.bag[int_w] = self.bag.get(int_w, 0) + 1
-        self.full_bag = dict(self.bag)
+            self.full_bag[int_w] = self.full_bag.get(int_w, 0) + 1
+        self.bag_words = tuple(sorted(self.full_bag))
+        self.word_pos = {w: pos for pos, w in enumerate(self.bag_words)}
+        self.full_counts = tuple(self.full_bag[w] for w in self.bag_words)
+        self.empty_bag = (0,) * len(self.bag_words)
+        self.bag = self.full_counts
+        self.word_estimates = None
+        if self.equivalence_vocab > 0:
+            self.equivalence_pos = [
+                pos for pos, w in enumerate(self.bag_words)
+                if w < self.equivalence_vocab and w != utils.UNK_ID]
+            self.oov_pos = [
+                pos for pos, w in enumerate(self.bag_words)
+                if w >= self.equivalence_vocab or w == utils.UNK_ID]
         
     def consume(self, word):
-        """Updates the bag by deleting the consumed word.
+        """Updates the bag by decrementing the count of the consumed
+        word. The count tuple is replaced, not modified in place.
         
         Args:
             word (int): Next word to consume
         """
         if word == utils.EOS_ID:
-            self.bag = {}
+            self.bag = self.empty_bag
             return
-        if not word in self.bag:
+        pos = self.word_pos.get(word)
+        if pos is None or not self.bag[pos]:
             logging.warn("Consuming word which is not in bag-of-words!")
             return
-        cnt = self.bag.pop(word)
-        if cnt > 1 and not self.accept_duplicates:
-            self.bag[word] = cnt - 1
+        cnt = self.bag[pos] - 1 if not self.accept_duplicates else 0
+        self.bag = self.bag[:pos] + (cnt,) + self.bag[pos+1:]
     
     def get_state(self):
-        """State of this predictor is the current bag """
+        """State of this predictor is the current count tuple """
         return self.bag
     
     def set_state(self, state):
-        """State of this predictor is the current bag """
+        """State of this predictor is the current count tuple """
         self.bag = state
 
     def initialize_heuristic(self, src_sentence):
@@ -185,6 +202,7 @@ class BagOfWordsPredictor(Predictor):
             src_sentence (list): Not used
         """
         self.estimates.reset()
+        self.word_estimates = None
         if self.diverse_heuristic:
             self.explored_bags = SimpleTrie()
     
@@ -194,6 +212,7 @@ class BagOfWordsPredictor(Predictor):
         message to the unigram table ``self.estimates``.
         """
         self.estimates.notify(message, message_type)
+        self.word_estimates = None
         if self.diverse_heuristic and message_type == MESSAGE_TYPE_FULL_HYPO:
             self._update_explored_bags(message)
     
@@ -210,19 +229,36 @@ class BagOfWordsPredictor(Predictor):
                 cnt = 0.0
             self.explored_bags.add(key, cnt + 1.0)
                     
+    def _get_word_estimates(self):
+        """Returns a dictionary with the unigram estimates of all words
+        in the bag and EOS, and sets ``full_bag_cost`` to the summed 
+        estimates of the full bag plus EOS. Both are cached until the
+        unigram table changes.
+        """
+        if self.word_estimates is None:
+            self.word_estimates = {w: self.estimates.estimate(w)
+                                   for w in self.bag_words}
+            self.word_estimates[utils.EOS_ID] = self.estimates.estimate(
+                                                                utils.EOS_ID)
+            self.full_bag_cost = self.word_estimates[utils.EOS_ID] + sum(
+                [cnt*self.word_estimates[w]
+                 for w, cnt in zip(self.bag_words, self.full_counts)])
+        return self.word_estimates
+                    
     def estimate_future_cost(self, hypo):
         """The bow predictor comes with its own heuristic function. We
         use the sum of scores of the remaining words as future cost 
-        estimator. 
+        estimator. Since this sum is linear in the word counts, it is
+        computed as the cached score of the full bag minus the scores
+        of the words in ``hypo``.
         """
         acc = 0.0
         if self.heuristic_add_remaining:
-            remaining = dict(self.full_bag)
-            remaining[utils.EOS_ID] = 1
-            for w in hypo.trgt_sentence:
-                remaining[w] -= 1
-            acc -= sum([cnt*self.estimates.estimate(w) 
-                            for w,cnt in remaining.items()])
+            word_estimates = self._get_word_estimates()
+            consumed = sum([word_estimates[w] if w in word_estimates
+                            else self.estimates.estimate(w)
+                            for w in hypo.trgt_sentence])
+            acc -= self.full_bag_cost - consumed
         if self.diverse_heuristic:
             key = list(hypo.trgt_sentence)
             key.sort()
@@ -234,17 +270,16 @@ class BagOfWordsPredictor(Predictor):
                             for w in hypo.trgt_sentence])
         return acc
     
-    def _get_unk_bag(self, org_bag):
-        if self.equivalence_vocab <= 0:
-            return org_bag
-        unk_bag = {}
-        for word,cnt in org_bag.items():
-            idx = word if word < self.equivalence_vocab else utils.UNK_ID
-            unk_bag[idx] = unk_bag.get(idx, 0) + cnt
-        return unk_bag
+    def _get_unk_bag(self, counts):
+        """Returns the counts of the words within the equivalence vocab
+        and the summed count of all other words. """
+        return (tuple(counts[pos] for pos in self.equivalence_pos),
+                sum(counts[pos] for pos in self.oov_pos))
     
     def is_equal(self, state1, state2):
         """Returns true if the bag is the same """
+        if self.equivalence_vocab <= 0:
+            return state1 == state2
         return self._get_unk_bag(state1) == self._get_unk_bag(state2) 
 
 
@@ -331,9 +366,10 @@ class BagOfWordsSearchPredictor(BagOfWordsPredictor):
         """
         if self.pre_mode:
             return super(BagOfWordsSearchPredictor, self).predict_next()
-        if not self.bag: # Empty bag
+        if not any(self.bag): # Empty bag
             return {utils.EOS_ID : 0.0}
-        ret = {w : 0.0 for w in self.missing}
+        ret = {w : 0.0 for w, cnt in zip(self.bag_words, self.missing) 
+               if cnt}
         if self.accept_subsets:
             ret[utils.EOS_ID] = 0.0
         if self.skeleton_pos < len(self.skeleton):
@@ -370,7 +406,7 @@ class BagOfWordsSearchPredictor(BagOfWordsPredictor):
         self._set_up_full_mode()
         logging.debug("BOW Skeleton (score=%f missing=%d): %s" % (
                                           score,
-                                          sum(self.missing.values()),
+                                          sum(self.missing),
                                           self.skeleton))
         self.main_decoder.current_sen_id -= 1
         self.main_decoder.initialize_predictors(src_sentence)
@@ -379,17 +415,19 @@ class BagOfWordsSearchPredictor(BagOfWordsPredictor):
     def _set_up_full_mode(self):
         """This method initializes ``missing`` by using
         ``self.skeleton`` and ``self.full_bag`` and removes
-        duplicates from ``self.skeleton``.
+        duplicates from ``self.skeleton``. Like the bag, ``missing``
+        is a tuple of counts aligned with ``bag_words``.
         """
-        self.bag = dict(self.full_bag)
-        missing = dict(self.full_bag)
+        self.bag = self.full_counts
+        missing = list(self.full_counts)
         skeleton_no_duplicates = []
         for word in self.skeleton:
-            if missing[word] > 0:
-                missing[word] -= 1
+            pos = self.word_pos.get(word)
+            if pos is not None and missing[pos] > 0:
+                missing[pos] -= 1
                 skeleton_no_duplicates.append(word)
         self.skeleton = skeleton_no_duplicates
-        self.missing = {w: cnt for w, cnt in missing.items() if cnt > 0}
+        self.missing = tuple(missing)
         
     def consume(self, word):
         """Calls super class ``consume``. If not in ``pre_mode``,
@@ -404,10 +442,11 @@ class BagOfWordsSearchPredictor(BagOfWordsPredictor):
         if (self.skeleton_pos < len(self.skeleton) 
                  and word == self.skeleton[self.skeleton_pos]):
             self.skeleton_pos += 1
-        elif word in self.missing:
-            self.missing[word] -= 1
-            if self.missing[word] <= 0:
-                del self.missing[word]
+        else:
+            pos = self.word_pos.get(word)
+            if pos is not None and self.missing[pos] > 0:
+                self.missing = (self.missing[:pos] + (self.missing[pos]-1,)
+                                + self.missing[pos+1:])
     
     def get_state(self):
         """If in pre_mode, state of this predictor is the current bag
@@ -204,6 +204,20 @@ class Predictor(Observer):
             bool. True if both states are equal, false if not
         """
         return False
+
+    def get_state_key(self):
+        """Returns a hashable key for the current predictor state which
+        compares by value, i.e. two states have the same key if and 
+        only if they are equal in the sense of ``is_equal()``. This 
+        can be used to cache results by predictor state without 
+        calling ``get_state()``. The default implementation returns 
+        None, which means that the predictor does not provide state 
+        keys.
+        
+        Returns:
+            object. Hashable state key, or None
+        """
+        return None
     
     def notify(self, message, message_type = MESSAGE_TYPE_DEFAULT):
         """We implement the ``notify`` method from the ``Observer``
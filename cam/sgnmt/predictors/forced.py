@@ -20,9 +20,8 @@ multiple references in form of a n-best list (forcedlst
 ``ForcedLstPredictor``). 
 """
 
-import logging
-
 from cam.sgnmt import utils
+from cam.sgnmt.misc.textindex import IndexedTextFile
 from cam.sgnmt.predictors.core import Predictor
 from cam.sgnmt.utils import NEG_INF
 
@@ -117,6 +116,35 @@ class ForcedPredictor(Predictor):
         return n1 == n2 and s1 == s2
 
 
+class NbestTrie(object):
+    """Prefix trie over the entries of an n-best list. Nodes are 
+    integers. ``children[node]`` maps words to child nodes, and 
+    ``eos_scores[node]`` contains the score of the n-best entry which
+    ends at ``node`` (or ``None``). The root node is 0.
+    """
+    
+    def __init__(self, entries):
+        """Builds the trie.
+        
+        Args:
+            entries (list): List of (score, sentence) tuples. If there
+                            are duplicates, the last score is used.
+        """
+        self.children = [{}]
+        self.eos_scores = [None]
+        for score, sentence in entries:
+            node = 0
+            for word in sentence:
+                next_node = self.children[node].get(word)
+                if next_node is None:
+                    next_node = len(self.children)
+                    self.children[node][word] = next_node
+                    self.children.append({})
+                    self.eos_scores.append(None)
+                node = next_node
+            self.eos_scores[node] = score
+
+
 class ForcedLstPredictor(Predictor):
     """This predictor can be used for direct n-best list rescoring. In
     contrast to the ``ForcedPredictor``, it reads an n-best list in 
@@ -131,8 +159,14 @@ class ForcedLstPredictor(Predictor):
     Note: Behavior is undefined if you have duplicates in the n-best
     list
     
-    TODO: Would be much more efficient to use Tries for 
-    cur_trgt_sentences instead of a flat list.
+    The n-best list is not read into memory at startup. Instead, a byte
+    offset index is built once (see ``IndexedTextFile``) and only the
+    entries of the current sentence are parsed in ``initialize``.
+    
+    The n-best entries of the current sentence are organized in an
+    ``NbestTrie``. The predictor state is the current trie node, or a
+    tuple of trie nodes if ``match_unk`` is true since UNKs in the
+    n-best list can match any word.
     """
     
     def __init__(self, 
@@ -157,28 +191,33 @@ class ForcedLstPredictor(Predictor):
                                 if you wish to do that.
         """
         super(ForcedLstPredictor, self).__init__()
-        self.trg_sentences = []
+        self.trg_file = IndexedTextFile(trg_test_file, nbest=True)
+        self.use_scores = use_scores
+        self.feat_name = feat_name
         self.match_unk = match_unk
+    
+    def _load_entries(self, sen_id):
+        """Parses the n-best list entries of a single sentence.
+        
+        Args:
+            sen_id (int): Sentence id (starting from 0)
+        
+        Returns:
+            list. List of (score, sentence) tuples
+        """
+        entries = []
         score = 0.0
-        with open(trg_test_file) as f:
-            for line in f:
-                parts = line.split("|||")
-                if len(parts) < 2:
-                    logging.warn("Malformed line %s in n-best list %s" % (
-                                        line.strip(),
-                                        trg_test_file))
-                else:
-                    if use_scores:
-                        score = self._get_score(parts, feat_name)
-                    sen_id = int(parts[0].strip())
-                    while len(self.trg_sentences) <= sen_id:
-                        self.trg_sentences.append([])
-                    sen = [int(w) for w in parts[1].strip().split()]
-                    if sen and sen[0] == utils.GO_ID:
-                        sen  = sen[1:]
-                    if sen and sen[-1] == utils.EOS_ID:
-                        sen = sen[:-1]
-                    self.trg_sentences[sen_id].append((score, sen))
+        for line in self.trg_file.get_lines(sen_id):
+            parts = line.split("|||")
+            if self.use_scores:
+                score = self._get_score(parts, self.feat_name)
+            sen = [int(w) for w in parts[1].strip().split()]
+            if sen and sen[0] == utils.GO_ID:
+                sen  = sen[1:]
+            if sen and sen[-1] == utils.EOS_ID:
+                sen = sen[:-1]
+            entries.append((score, sen))
+        return entries
         
     def _get_score(self, parts, feat_name):
         """Get the score for a hypothesis.
@@ -208,34 +247,24 @@ class ForcedLstPredictor(Predictor):
         return NEG_INF
     
     def predict_next(self):
-        """Outputs 0.0 (i.e. prob=1) for all words for which there is 
-        an entry ``in cur_trg_sentences``, and the score in 
-        ``cur_trg_sentences`` if the current history is by itself equal
-        to an entry in ``cur_trg_sentences``.
-        
-        TODO: The implementation here is fairly inefficient as it scans 
-        through all target sentences linearly. Would be better to 
-        organize the target sentences in a Trie
+        """Outputs 0.0 (i.e. prob=1) for all words which are children 
+        of the current trie node, and the score of the n-best entry 
+        which ends at the current node for </S>.
         """
-        scores = {}
-        hist_len = len(self.history)
-        for sen_score,trg_sentence in self.cur_trg_sentences:
-            sen_len = len(trg_sentence)
-            if sen_len < hist_len:
-                continue
-            if self.match_unk:
-                hist = [self.history[i] 
-                      if trg_sentence[i] != utils.UNK_ID else utils.UNK_ID
-                      for i in range(hist_len)]
-            else:
-                hist = self.history 
-            if trg_sentence[:hist_len] == hist:
-                if sen_len == hist_len:
-                    scores[utils.EOS_ID] = sen_score
-                else:
-                    scores[trg_sentence[hist_len]] = 0.0
-        if not utils.EOS_ID in scores:
-            scores[utils.EOS_ID] = NEG_INF
+        if self.match_unk:
+            scores = {}
+            eos_score = NEG_INF
+            for node in self.cur_node:
+                scores.update(dict.fromkeys(self.trie.children[node], 0.0))
+                if self.trie.eos_scores[node] is not None:
+                    eos_score = max(eos_score, self.trie.eos_scores[node])
+            scores[utils.EOS_ID] = eos_score
+            return scores
+        if self.cur_node < 0:
+            return {utils.EOS_ID: NEG_INF}
+        scores = dict.fromkeys(self.trie.children[self.cur_node], 0.0)
+        eos_score = self.trie.eos_scores[self.cur_node]
+        scores[utils.EOS_ID] = NEG_INF if eos_score is None else eos_score
         return scores
     
     def initialize(self, src_sentence):
@@ -245,23 +274,35 @@ class ForcedLstPredictor(Predictor):
         Args:
             src_sentence (list): Not used
         """
-        self.cur_trg_sentences = self.trg_sentences[self.current_sen_id] 
-        self.history = []
+        self.trie = NbestTrie(self._load_entries(self.current_sen_id))
+        self.cur_node = (0,) if self.match_unk else 0
     
     def consume(self, word):
-        """Extends the current history by ``word``. """
-        self.history.append(word)
+        """Moves to the child of the current trie node labelled with 
+        ``word``. If there is no such child, the predictor enters an
+        invalid state (node -1 or empty tuple if ``match_unk``).
+        """
+        children = self.trie.children
+        if self.match_unk:
+            next_nodes = set()
+            for node in self.cur_node:
+                for w in (word, utils.UNK_ID):
+                    if w in children[node]:
+                        next_nodes.add(children[node][w])
+            self.cur_node = tuple(sorted(next_nodes))
+        elif self.cur_node >= 0:
+            self.cur_node = children[self.cur_node].get(word, -1)
     
     def get_state(self):
-        """Returns the current history. """
-        return self.history
+        """Returns the current trie node. """
+        return self.cur_node
     
     def set_state(self, state):
-        """Sets the current history. """
-        self.history = state
+        """Sets the current trie node. """
+        self.cur_node = state
 
     def is_equal(self, state1, state2):
-        """Returns true if the history is the same """
+        """Returns true if the trie nodes are the same """
         return state1 == state2
 
 
@@ -37,9 +37,13 @@ ATTENTION: This implementation is experimental!!
 
 from cam.sgnmt.predictors.core import Predictor
 from cam.sgnmt import utils
+import hashlib
 import logging
+import os
+import pickle
 import re
 import gzip
+import time
 
 class Cell:
     """Comparable to a CYK cell: A set of hypotheses. If duplicates are
@@ -779,6 +783,83 @@ class RuleSet:
             self.span_len_range_updated = False
         
 
+def get_rules_cache_path(rules_path, feature_weights, cache_dir):
+    """Get the path to the binary cache of a rules file. The file name
+    contains a hash of the content of ``rules_path`` and the feature
+    weights, so that the cache is invalidated if either changes.
+    
+    Args:
+        rules_path (string): Path to the ruleXtract rules file
+        feature_weights (list): Rule feature weights or ``None``
+        cache_dir (string): Directory for cached grammars
+    
+    Returns:
+        string. Path to the cache file
+    """
+    h = hashlib.sha1()
+    with open(rules_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    h.update(repr(feature_weights).encode("utf-8"))
+    return os.path.join(cache_dir, "%s.%s.pkl" % (
+        os.path.basename(rules_path), h.hexdigest()))
+
+
+def load_rules(rules_path, feature_weights = None, cache_dir = None):
+    """Loads a ``RuleSet`` from a ruleXtract rules file (optionally
+    gzipped). If ``cache_dir`` is set, the parsed ``RuleSet`` including
+    the tries and span length ranges is stored there in binary form,
+    and read from there in subsequent calls with the same rules file
+    and feature weights.
+    
+    Args:
+        rules_path (string): Path to the ruleXtract rules file
+        feature_weights (list): Rule feature weights or ``None``
+        cache_dir (string): Directory for cached grammars or ``None``
+                            to disable caching
+    
+    Returns:
+        RuleSet. Rule set with updated span length ranges
+    """
+    start_time = time.time()
+    cache_path = None
+    if cache_dir:
+        cache_path = get_rules_cache_path(rules_path, 
+                                          feature_weights, 
+                                          cache_dir)
+        if os.path.isfile(cache_path):
+            with open(cache_path, "rb") as f:
+                rules, last_id = pickle.load(f)
+            Rule.last_id = max(Rule.last_id, last_id)
+            logging.info("Loaded %d rules from cache %s in %.2f seconds" % (
+                rules.n_rules, cache_path, time.time() - start_time))
+            return rules
+    rules = RuleSet()
+    with (gzip.open(rules_path, "rt") if rules_path[-3:] == '.gz' 
+                                     else open(rules_path)) as f:
+        for line in f:
+            rules.parse(line, feature_weights)
+    rules.update_span_len_range()
+    logging.info("%d rules loaded (%d discarded because not in GNF) in "
+                 "%.2f seconds" % (rules.n_rules, 
+                                   rules.n_discarded,
+                                   time.time() - start_time))
+    if cache_path:
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            tmp_path = "%s.%d.tmp" % (cache_path, os.getpid())
+            with open(tmp_path, "wb") as f:
+                pickle.dump((rules, Rule.last_id), f, 
+                            pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, cache_path)
+            logging.info("Stored compiled grammar in %s" % cache_path)
+        except (IOError, OSError) as e:
+            logging.warn("Could not write grammar cache %s: %s" % (
+                cache_path, e))
+    return rules
+
+
 class RuleXtractPredictor(Predictor):
     """Predictor based on ruleXtract rules. Bins are organized 
     according the number of target words. We assume that no rule 
@@ -809,11 +890,17 @@ class RuleXtractPredictor(Predictor):
     non-terminals as produced with ruleXtract.
     """
     
-    def __init__(self, ruleXtract_path, use_weights, feature_weights = None):
+    def __init__(self, 
+                 ruleXtract_path, 
+                 use_weights, 
+                 feature_weights = None,
+                 cache_dir = None):
         """Creates a new hiero predictor.
         
         Args:
-            ruleXtract_path (string): Path to the rules file
+            ruleXtract_path (string): Path to the rules file. Use the
+                                      placeholder %d for per-sentence
+                                      filtered grammars
             use_weights (bool): If false, set all hypothesis scores 
                                 uniformly to 0 (= log 1). If true,
                                 use the rule weights to compute
@@ -821,17 +908,25 @@ class RuleXtractPredictor(Predictor):
             feature_weights (list): Rule feature weights to compute
                                     the rule scores. If this is none
                                     we use uniform weights
+            cache_dir (string): If set, store compiled grammars in this
+                                directory and load them from there in
+                                later runs
         """
         super(RuleXtractPredictor, self).__init__()
         self.use_weights = use_weights
-        self.rules = RuleSet()
-        with (gzip.open(ruleXtract_path) if ruleXtract_path[-3:] == '.gz' 
-                                         else open(ruleXtract_path)) as f:
-            for line in f:
-                self.rules.parse(line, feature_weights)
-        self.rules.update_span_len_range()
-        logging.info("%d rules loaded (%d discarded because not in GNF)" %
-            (self.rules.n_rules, self.rules.n_discarded))
+        self.ruleXtract_path = ruleXtract_path
+        self.feature_weights = feature_weights
+        self.cache_dir = cache_dir
+        self.per_sentence = "%d" in ruleXtract_path
+        self.rules = None
+        if not self.per_sentence:
+            self._set_rules(load_rules(ruleXtract_path, 
+                                       feature_weights, 
+                                       cache_dir))
+    
+    def _set_rules(self, rules):
+        """Sets the rule set and looks up the start symbol. """
+        self.rules = rules
         if not 'S' in self.rules.nt2id:
             logging.fatal("No rule with start symbol S found!") 
         self.start_nt = self.rules.nt2id['S']
@@ -897,7 +992,15 @@ class RuleXtractPredictor(Predictor):
         return self.finalize_posterior(posterior, self.use_weights, False)
     
     def initialize(self, src_sentence):
-        """Delete all bins and add the initial cell to the first bin """
+        """Delete all bins and add the initial cell to the first bin. If
+        we use per-sentence grammars, load the grammar for the current
+        sentence first.
+        """
+        if self.per_sentence:
+            self._set_rules(load_rules(
+                utils.get_path(self.ruleXtract_path, self.current_sen_id+1),
+                self.feature_weights,
+                self.cache_dir))
         self.stacks = []
         self.n_consumed = 0
         self.src_seq = [utils.GO_ID] + src_sentence + [utils.EOS_ID]
@@ -28,6 +28,11 @@ import math
 from scipy.special import logsumexp, gammaln
 
 from cam.sgnmt import utils
+from cam.sgnmt.misc.ngram_store import NgramPosteriorStore, \
+                                        is_ngram_store, \
+                                        load_ngram_posteriors
+from cam.sgnmt.misc.prefetch import Prefetcher
+from cam.sgnmt.misc.textindex import IndexedTextFile
 from cam.sgnmt.misc.trie import SimpleTrie
 from cam.sgnmt.predictors.core import Predictor, UnboundedVocabularyPredictor
 import numpy as np
@@ -49,18 +54,27 @@ def load_external_lengths(path):
         list of dicts mapping a length to its scores, one dict for each
         sentence.
     """
-    lengths = []
     with open(path) as f:
-        for line in f:
-            scores = {}
-            for pair in line.strip().split():
-                if ':' in pair:
-                    length, score = pair.split(':')
-                    scores[int(length)] = float(score)
-                else:
-                    scores[int(pair)] = 0.0
-            lengths.append(scores)
-    return lengths
+        return [parse_external_lengths(line) for line in f]
+
+
+def parse_external_lengths(line):
+    """Parses a single line of an external length file.
+    
+    Args:
+        line (string): Blank separated <length>:<score> pairs
+    
+    Returns:
+        dict. Maps lengths to scores
+    """
+    scores = {}
+    for pair in line.strip().split():
+        if ':' in pair:
+            length, score = pair.split(':')
+            scores[int(length)] = float(score)
+        else:
+            scores[int(pair)] = 0.0
+    return scores
 
 def load_external_ids(path):
     """
@@ -98,9 +112,14 @@ class NBLengthPredictor(Predictor):
     The biases w10 and w11 are optional.
     
     The predictor predicts EOS with NB(#consumed_words,r,p)
+    
+    The EOS scores for all lengths up to the maximum hypothesis length
+    are computed at once in ``initialize``, so ``predict_next`` is a
+    single array lookup.
     """
     
-    def __init__(self, text_file, model_weights, use_point_probs, offset = 0):
+    def __init__(self, text_file, model_weights, use_point_probs, offset = 0,
+                 max_len_factor = 2.0):
         """Creates a new target sentence length model predictor.
         
         Args:
@@ -114,6 +133,9 @@ class NBLengthPredictor(Predictor):
                                     0.0 otherwise 
             offset (int): Subtract this from hypothesis length before
                           applying the NB model
+            max_len_factor (float): EOS scores are precomputed up to
+                                    this times the source sentence
+                                    length, and extended on demand
         """
         super(NBLengthPredictor, self).__init__()
         self.use_point_probs = use_point_probs
@@ -126,16 +148,14 @@ class NBLengthPredictor(Predictor):
                     % (2*NUM_FEATURES, 2*NUM_FEATURES+2))
         self.r_weights = model_weights[0:NUM_FEATURES] + [model_weights[-2]]
         self.p_weights = model_weights[NUM_FEATURES:2*NUM_FEATURES] + [model_weights[-1]]
-        self.src_features = self._extract_features(text_file)
+        self.max_len_factor = max_len_factor
+        self.src_file = IndexedTextFile(text_file)
         self.n_consumed = 0 
 
-    def _extract_features(self, file_name):
-        """Extract all features from the source sentences. """
-        feats = []
-        with open(file_name) as f:
-            for line in f:
-                feats.append(self._analyse_sentence(line.strip()))
-        return feats
+    def _extract_features(self, sen_id):
+        """Extract features from the source sentence ``sen_id``. """
+        lines = self.src_file.get_lines(sen_id)
+        return self._analyse_sentence(lines[0].strip() if lines else "")
     
     def _analyse_sentence(self, sentence):
         """Extract features for a single source sentence.
@@ -167,25 +187,14 @@ class NBLengthPredictor(Predictor):
         """Returns a dictionary with single entry for EOS. """
         if self.n_consumed == 0:
             return {utils.EOS_ID : utils.NEG_INF}
-        return {utils.EOS_ID : self._get_eos_prob()}
+        if self.n_consumed >= len(self.eos_scores):
+            self._compute_eos_scores(2 * self.n_consumed)
+        return {utils.EOS_ID : self.eos_scores[self.n_consumed]}
     
-    def _get_eos_prob(self):
-        """Get loglikelihood according cur_p, cur_r, and n_consumed """
-        eos_point_prob = self._get_eos_point_prob(max(
-                                              1, 
-                                              self.n_consumed - self.offset))
-        if self.use_point_probs:
-            return eos_point_prob - self.max_eos_prob
-        if not self.prev_eos_probs:
-            self.prev_eos_probs.append(eos_point_prob)
-            return eos_point_prob
-        # bypass utils.log_sum because we always want to use logsumexp here 
-        prev_sum = logsumexp(np.asarray([p for p in self.prev_eos_probs])) 
-        self.prev_eos_probs.append(eos_point_prob)
-        # Desired prob is eos_point_prob / (1-last_eos_probs_sum)
-        return eos_point_prob - np.log(1.0-np.exp(prev_sum))
-    
-    def _get_eos_point_prob(self, n):
+    def _get_eos_point_probs(self, n):
+        """Get the NB loglikelihoods of the lengths in the array ``n``
+        according ``cur_p`` and ``cur_r``.
+        """
         return gammaln(n + self.cur_r) \
                 - gammaln(n + 1) \
                 - gammaln(self.cur_r) \
@@ -193,17 +202,31 @@ class NBLengthPredictor(Predictor):
                 + self.cur_r * np.log(1.0-self.cur_p)
     
     def _get_max_eos_prob(self):
-        """Get the maximum loglikelihood according cur_p, cur_r 
-        TODO: replace this brute force impl. with something smarter
+        """Get the maximum loglikelihood according cur_p, cur_r. The
+        NB distribution is unimodal with mode floor((r-1)p/(1-p)).
         """
-        max_prob = utils.NEG_INF
-        n_prob = max_prob
-        n = 0
-        while n_prob == max_prob:
-            n += 1
-            n_prob = self._get_eos_point_prob(n)
-            max_prob = max(max_prob, n_prob)
-        return max_prob
+        mode = max(1, int((self.cur_r-1.0) * self.cur_p / (1.0-self.cur_p)))
+        return np.max(self._get_eos_point_probs(np.array([mode, mode+1],
+                                                         dtype=np.float64)))
+    
+    def _compute_eos_scores(self, max_len):
+        """Sets ``eos_scores`` to the EOS scores for all hypothesis 
+        lengths up to ``max_len``. Without point probabilities, the EOS
+        score at length n is normalized by the probability mass which
+        is left after the EOS point probabilities of lengths 1..n-1.
+        """
+        n = np.maximum(1, np.arange(max_len + 1) - self.offset)
+        point_probs = self._get_eos_point_probs(n.astype(np.float64))
+        if self.use_point_probs:
+            scores = point_probs - self.max_eos_prob
+        else:
+            scores = np.copy(point_probs)
+            if max_len > 1:
+                prev_sums = np.logaddexp.accumulate(point_probs[1:-1])
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    scores[2:] -= np.log(1.0 - np.exp(prev_sums))
+        scores[0] = utils.NEG_INF
+        self.eos_scores = scores
     
     def initialize(self, src_sentence):
         """Extract features for the source sentence. Note that this
@@ -211,17 +234,18 @@ class NBLengthPredictor(Predictor):
         representation of the source sentence to extract features.
         
         Args:
-            src_sentence (list): Not used
+            src_sentence (list): Only the length is used
         """
-        feat = self.src_features[self.current_sen_id] + [1.0]
+        feat = self._extract_features(self.current_sen_id) + [1.0]
         self.cur_r  = max(EPS_R, np.dot(feat, self.r_weights));
         p = np.dot(feat, self.p_weights)
         p = 1.0 / (1.0 + math.exp(-p))
         self.cur_p = max(utils.EPS_P, min(1.0 - utils.EPS_P, p))
         self.n_consumed = 0
-        self.prev_eos_probs = []
         if self.use_point_probs:
             self.max_eos_prob = self._get_max_eos_prob()
+        self._compute_eos_scores(max(
+            1, int(np.ceil(self.max_len_factor * len(src_sentence)))))
     
     def consume(self, word):
         """Increases the current history length
@@ -232,21 +256,16 @@ class NBLengthPredictor(Predictor):
         self.n_consumed = self.n_consumed + 1
     
     def get_state(self):
-        """State consists of the number of consumed words, and the
-        accumulator for previous EOS probability estimates if we 
-        don't use point estimates.
-        """
-        return self.n_consumed,self.prev_eos_probs
+        """State consists of the number of consumed words. """
+        return self.n_consumed
     
     def set_state(self, state):
         """Set the predictor state """
-        self.n_consumed,self.prev_eos_probs = state
+        self.n_consumed = state
 
     def is_equal(self, state1, state2):
         """Returns true if the number of consumed words is the same """
-        n1,_ = state1
-        n2,_ = state2
-        return n1 == n2
+        return state1 == state2
 
 
 class WordCountPredictor(Predictor):
@@ -332,7 +351,9 @@ class WordCountPredictor(Predictor):
 
 class WeightNonTerminalPredictor(Predictor):
     """This wrapper multiplies the weight of given tokens (those outside
-    the min/max terminal range) by a factor."""
+    the min/max terminal range) by a factor. The factors are compiled
+    into a vector for dense slave posteriors and a key set for sparse
+    ones."""
     
     def __init__(self, slave_predictor,
                  penalty_factor=1.0,
@@ -360,19 +381,30 @@ class WeightNonTerminalPredictor(Predictor):
             max_nt_range = range(max_terminal_id + 1, vocab_size)
             nts = list(min_nt_range) + list(max_nt_range)
         self.slave_predictor = slave_predictor
-        self.mult = {tok: penalty_factor for tok in nts}
-        self.mult[utils.EOS_ID] = 1.0
-        self.mult[utils.UNK_ID] = 1.0
+        self.penalty_factor = penalty_factor
+        self.nonterminals = frozenset(nts) - set([utils.EOS_ID, 
+                                                  utils.UNK_ID])
+        self.mult = np.ones((max(self.nonterminals) + 1 
+                             if self.nonterminals else 0,))
+        self.mult[list(self.nonterminals)] = penalty_factor
         
     def get_unk_probability(self, posterior):
         return self.slave_predictor.get_unk_probability(posterior)
     
     def predict_next(self):
         posterior = self.slave_predictor.predict_next()
-        post_keys = set(utils.common_viewkeys(posterior))
-        for tok in self.mult:
-            if tok in post_keys:
-                posterior[tok] *= self.mult[tok]
+        if self.penalty_factor == 1.0:
+            return posterior
+        # Do not modify the slave posterior in place, it may be shared
+        # (e.g. by the bracket predictor)
+        posterior = posterior.copy()
+        if isinstance(posterior, np.ndarray):
+            n = min(len(posterior), len(self.mult))
+            posterior[:n] *= self.mult[:n]
+        else:
+            for tok in self.nonterminals.intersection(
+                                        utils.common_viewkeys(posterior)):
+                posterior[tok] *= self.penalty_factor
         return posterior
     
     def initialize(self, src_sentence):
@@ -408,7 +440,7 @@ class ExternalLengthPredictor(Predictor):
                            distributions.
         """
         super(ExternalLengthPredictor, self).__init__()
-        self.trg_lengths = load_external_lengths(path)
+        self.trg_file = IndexedTextFile(path)
         
     def get_unk_probability(self, posterior):
         """Returns 0=log 1 if the partial hypothesis does not exceed
@@ -420,23 +452,28 @@ class ExternalLengthPredictor(Predictor):
         return utils.NEG_INF
     
     def predict_next(self):
-        """Returns a dictionary with one entry and value 0 (=log 1). The
-        key is either the next word in the target sentence or (if the
-        target sentence has no more words) the end-of-sentence symbol.
+        """Returns a dictionary with a single entry for EOS with the
+        score of the current length. 
         """
-        if self.n_consumed in self.cur_scores: 
+        if self.n_consumed <= self.max_length: 
             return {utils.EOS_ID : self.cur_scores[self.n_consumed]}
         return {utils.EOS_ID : utils.NEG_INF} 
     
     def initialize(self, src_sentence):
         """Fetches the corresponding target sentence length 
-        distribution and resets the word counter.
+        distribution and resets the word counter. The distribution is
+        stored as array over all lengths up to the maximum length.
         
         Args:
             src_sentence (list):  Not used
         """
-        self.cur_scores = self.trg_lengths[self.current_sen_id]
-        self.max_length = max(self.cur_scores)
+        lines = self.trg_file.get_lines(self.current_sen_id)
+        scores = parse_external_lengths(lines[0] if lines else "")
+        self.max_length = max(scores) if scores else 0
+        self.cur_scores = np.full((self.max_length + 1,), utils.NEG_INF)
+        for length, score in scores.items():
+            if length >= 0:
+                self.cur_scores[length] = score
         self.n_consumed = 0
 
     def consume(self, word):
@@ -465,23 +502,37 @@ class NgramCountPredictor(Predictor):
     posteriors are loaded from a file. The predictor score is the sum of
     all n-gram posteriors in a hypothesis. """
     
-    def __init__(self, path, order=0, discount_factor=-1.0):
+    def __init__(self, path, order=0, discount_factor=-1.0,
+                 prefetch_lookahead=0):
         """Creates a new ngram count predictor instance.
         
         Args:
             path (string): Path to the n-gram posteriors. File format:
                            <ngram> : <score> (one ngram per line). Use
-                           placeholder %d for sentence id.
+                           placeholder %d for sentence id. Alternatively,
+                           path to a file created with 
+                           ``compile_ngram_posteriors`` which contains
+                           the posteriors of all sentences.
             order (int): If positive, count n-grams of the specified
                          order. Otherwise, count all n-grams
             discount_factor (float): If non-negative, discount n-gram
                                      posteriors by this factor each time 
                                      they are consumed 
+            prefetch_lookahead (int): Number of n-gram files to load in
+                                      the background ahead of time
         """
         super(NgramCountPredictor, self).__init__()
         self.path = path 
         self.order = order
         self.discount_factor = discount_factor
+        if "%d" not in path and is_ngram_store(path):
+            store = NgramPosteriorStore(path, order)
+            self.prefetcher = Prefetcher(store.get_sentence)
+        else:
+            self.prefetcher = Prefetcher(
+                lambda sen_id: load_ngram_posteriors(
+                    utils.get_path(path, sen_id+1), order),
+                prefetch_lookahead)
         
     def get_unk_probability(self, posterior):
         """Always return 0.0 """
@@ -492,50 +543,31 @@ class NgramCountPredictor(Predictor):
         are consistent with the current history.
         """
         posterior = {}
-        for i in reversed(range(len(self.cur_history)+1)):
-            scores = self.ngrams.get(self.cur_history[i:])
-            if scores:
+        history = tuple(self.cur_history)
+        for i in reversed(range(len(history)+1)):
+            entry = self.ngrams.get(history[i:])
+            if entry is not None:
+                words, scores = entry
                 factors = False
                 if self.discount_factor >= 0.0:
                     factors = self.discounts.get(self.cur_history[i:])
                 if not factors:
-                    for w,score in scores.items():
+                    for w,score in zip(words.tolist(), scores.tolist()):
                         posterior[w] = posterior.get(w, 0.0) + score
                 else:
-                    for w,score in scores.items():
+                    for w,score in zip(words.tolist(), scores.tolist()):
                         posterior[w] = posterior.get(w, 0.0) +  \
                                        factors.get(w, 1.0) * score
         return posterior
     
-    def _load_posteriors(self, path):
-        """Sets up self.max_history_len and self.ngrams """
-        self.max_history_len = 0
-        self.ngrams = SimpleTrie()
-        logging.debug("Loading n-gram scores from %s..." % path)
-        with open(path) as f:
-            for line in f:
-                ngram,score = line.split(':')
-                words = [int(w) for w in ngram.strip().split()]
-                if self.order > 0 and len(words) != self.order:
-                    continue
-                hist = words[:-1]
-                last_word = words[-1]
-                if last_word == utils.GO_ID:
-                    continue
-                self.max_history_len = max(self.max_history_len, len(hist))
-                p = self.ngrams.get(hist)
-                if p:
-                    p[last_word] = float(score.strip())
-                else:
-                    self.ngrams.add(hist, {last_word: float(score.strip())})
-    
     def initialize(self, src_sentence):
         """Loads n-gram posteriors and resets history.
         
         Args:
             src_sentence (list): not used
         """
-        self._load_posteriors(utils.get_path(self.path, self.current_sen_id+1))
+        self.ngrams = self.prefetcher.get(self.current_sen_id)
+        self.max_history_len = self.ngrams.max_history_len
         self.cur_history = [utils.GO_ID]
         self.discounts = SimpleTrie()
     
@@ -585,13 +617,14 @@ class NgramCountPredictor(Predictor):
             hist_short = hist1
         min_len = len(hist_short)
         for n in range(1, min_len+1): # Look up non matching in self.ngrams
-            key1 = hist1[-n:]
-            key2 = hist2[-n:]
+            key1 = tuple(hist1[-n:])
+            key2 = tuple(hist2[-n:])
             if key1 != key2:
-                if self.ngrams.get(key1) or self.ngrams.get(key2):
+                if (self.ngrams.get(key1) is not None 
+                        or self.ngrams.get(key2) is not None):
                     return False
         for n in range(min_len+1, len(hist_long)+1):
-            if self.ngrams.get(hist_long[-n:]):
+            if self.ngrams.get(tuple(hist_long[-n:])) is not None:
                 return False
         return True
 
@@ -643,6 +676,7 @@ class UnkCountPredictor(Predictor):
         src_n_unk = len([w for w in src_sentence if w == utils.UNK_ID 
                                                     or w > self.src_vocab_size])
         self.l = self.lambdas[min(len(self.lambdas)-1, src_n_unk)]
+        self.log_l = np.log(self.l)
         self.n_consumed = 0
         self.n_unk = 0
         self.unk_prob = self._get_poisson_prob(1)
@@ -657,7 +691,7 @@ class UnkCountPredictor(Predictor):
 
     def _get_poisson_prob(self, n):
         """Get the log of the poisson probability for n events. """
-        return n * np.log(self.l) - self.l - sum([np.log(i+1) for i in range(n)])
+        return n * self.log_l - self.l - gammaln(n + 1)
     
     def consume(self, word):
         """Increases unk counter by one if ``word`` is unk.
@@ -735,21 +769,24 @@ class NgramizePredictor(Predictor):
         self.scores and self.unk_scores, resets the history.
         """
         self.slave_predictor.initialize(src_sentence)
-        self.scores = []
-        self.unk_scores = []
+        scores = []
+        unk_scores = []
         trg_word = -1
         max_len = self.max_len_factor * len(src_sentence)
         l = 0
         while trg_word != utils.EOS_ID and l <= max_len:
             posterior = self.slave_predictor.predict_next()
             trg_word = utils.argmax(posterior)
-            self.scores.append(posterior)
-            self.unk_scores.append(self.slave_predictor.get_unk_probability(
+            scores.append(posterior)
+            unk_scores.append(self.slave_predictor.get_unk_probability(
                 posterior))
             self.slave_predictor.consume(utils.UNK_ID)
             l += 1
         logging.debug("ngramize uses %d time steps." % l)
-        self.history = []
+        self.scores = np.vstack(scores)
+        self.unk_scores = np.array(unk_scores, dtype=np.float64)
+        self.ngram_cache = {}
+        self.history = ()
         self.cur_unk_score = utils.NEG_INF
     
     def initialize_heuristic(self, src_sentence):
@@ -757,46 +794,63 @@ class NgramizePredictor(Predictor):
         logging.warning("ngramize does not support predictor heuristics")
         self.slave_predictor.initialize_heuristic(src_sentence)
     
-    def predict_next(self):
-        """Looks up ngram scores via self.scores. """
-        cur_hist_length = len(self.history)
-        this_scores = [[] for _ in range(cur_hist_length+1)]
-        this_unk_scores = [[] for _ in range(cur_hist_length+1)]
-        for pos in range(len(self.scores)):
-            this_scores[0].append(self.scores[pos])
-            this_unk_scores[0].append(self.unk_scores[pos])
-            acc = 0.0
-            for order, word in enumerate(self.history):
-                if pos + order + 1 >= len(self.scores):
-                    break
-                acc += utils.common_get(
-                    self.scores[pos + order], word, 
-                    self.unk_scores[pos + order])
-                this_scores[order+1].append(acc + self.scores[pos + order + 1])
-                this_unk_scores[order+1].append(
-                    acc + self.unk_scores[pos + order + 1])
+    def _get_word_scores(self, begin, end, word):
+        """Returns the recorded slave scores of ``word`` at the time
+        steps ``begin:end``. """
+        if word < self.scores.shape[1]:
+            return self.scores[begin:end, word]
+        return self.unk_scores[begin:end]
+
+    def _compute_ngram_scores(self, history):
+        """Computes the n-gram scores for ``history`` by summing over
+        all positions of ``history`` in the recorded slave posteriors.
+        ``acc[pos]`` holds the score of the first ``order`` words of 
+        ``history`` starting at time step ``pos``.
+        
+        Returns:
+            tuple. Posterior vector and UNK score
+        """
+        n_steps = len(self.unk_scores)
         combined_scores = []
         combined_unk_scores = []
-        for order, (scores, unk_scores) in enumerate(zip(this_scores, 
-                                                         this_unk_scores)):
-            if scores and order + 1 >= self.min_order:
-                score_matrix = np.vstack(scores)
-                combined_scores.append(logsumexp(score_matrix, axis=0))
-                combined_unk_scores.append(utils.log_sum(unk_scores))
+        acc = np.zeros((n_steps,))
+        for order in range(len(history) + 1):
+            n_rows = n_steps - order
+            if n_rows <= 0:
+                break
+            if order > 0:
+                acc = acc[:n_rows] + self._get_word_scores(
+                    order - 1, order - 1 + n_rows, history[order - 1])
+            if order + 1 >= self.min_order:
+                combined_scores.append(logsumexp(
+                    acc[:, None] + self.scores[order:order+n_rows], axis=0))
+                combined_unk_scores.append(utils.log_sum(
+                    acc + self.unk_scores[order:order+n_rows]))
         if not combined_scores:
-            self.cur_unk_score = 0.0
-            return {}
-        self.cur_unk_score = sum(combined_unk_scores)
-        return sum(combined_scores)
+            return {}, 0.0
+        return sum(combined_scores), sum(combined_unk_scores)
+    
+    def predict_next(self):
+        """Looks up ngram scores via self.scores. Scores are cached in
+        a hash table keyed by the n-gram history, so each history is
+        only scored once per sentence.
+        """
+        entry = self.ngram_cache.get(self.history)
+        if entry is None:
+            entry = self._compute_ngram_scores(self.history)
+            self.ngram_cache[self.history] = entry
+        posterior, self.cur_unk_score = entry
+        return posterior
         
     def get_unk_probability(self, posterior):
         return self.cur_unk_score
     
     def consume(self, word):
-        """Pass through to slave predictor """
+        """Adds ``word`` to the n-gram history, which holds at most
+        the last max_order-1 words.
+        """
         if self.max_history_length > 0:
-            self.history.append(word)
-            self.history = self.history[-self.max_history_length:]
+            self.history = (self.history + (word,))[-self.max_history_length:]
     
     def get_state(self):
         """State is the current n-gram history. """
@@ -35,7 +35,9 @@ class KenLMPredictor(UnboundedVocabularyPredictor):
     """KenLM predictor based on
     https://github.com/kpu/kenlm 
     
-    The predictor state is described by the n-gram history.
+    The predictor state is a native ``kenlm.State`` object. States are
+    never modified after they have been created, so ``get_state`` and
+    ``set_state`` do not need to copy them or replay the history.
     """
     
     def __init__(self, path):
@@ -50,6 +52,18 @@ class KenLMPredictor(UnboundedVocabularyPredictor):
         super(KenLMPredictor, self).__init__()
         self.lm = kenlm.Model(path)
         self.lm_state2 = kenlm.State()
+        self.vocab = []
+    
+    def _get_word_strings(self, max_id):
+        """Returns the list which maps word ids to KenLM strings. The
+        list is extended on demand such that it covers ``max_id``.
+        """
+        vocab = self.vocab
+        if max_id >= len(vocab):
+            vocab.extend(str(w) for w in range(len(vocab), max_id + 1))
+            if len(vocab) > utils.EOS_ID:
+                vocab[utils.EOS_ID] = "</s>"
+        return vocab
     
     def initialize(self, src_sentence):
         """Initializes the KenLM state.
@@ -57,45 +71,48 @@ class KenLMPredictor(UnboundedVocabularyPredictor):
         Args:
             src_sentence (list): Not used
         """
-        self.history = []
-        self._update_lm_state()
-
-    def _update_lm_state(self):
         self.lm_state = kenlm.State()
-        tmp_state = kenlm.State()
         self.lm.BeginSentenceWrite(self.lm_state)
-        for w in self.history[-6:]:
-            self.lm.BaseScore(self.lm_state, w, tmp_state)
-            self.lm_state, tmp_state = tmp_state, self.lm_state
     
     def predict_next(self, words):
-        return {w: self.lm.BaseScore(self.lm_state, 
-                                     "</s>" if w == utils.EOS_ID else str(w),
-                                     self.lm_state2)
-                for w in words}
-    
+        """Scores all ``words`` from the current LM state.
+        
+        Args:
+            words (list): Set of words to score
+        
+        Returns:
+            dict. Scores of ``words``
+        """
+        if not words:
+            return {}
+        vocab = self._get_word_strings(max(words))
+        base_score = self.lm.BaseScore
+        state = self.lm_state
+        scratch = self.lm_state2
+        return {w: base_score(state, vocab[w], scratch) for w in words}
         
     def get_unk_probability(self, posterior):
         """Use the probability for '<unk>' in the language model """
         return self.lm.BaseScore(self.lm_state, "<unk>", self.lm_state2)
     
     def consume(self, word):
-        self.lm.BaseScore(self.lm_state, str(word), self.lm_state2)
-        self.lm_state, self.lm_state2 = self.lm_state2, self.lm_state
-        self.history.append(str(word))
-    
-    def get_state(self):
-        return self.lm_state.clone()
+        """Advances the LM state. A new ``kenlm.State`` is created
+        such that states returned by ``get_state`` stay valid.
+        """
+        new_state = kenlm.State()
+        self.lm.BaseScore(self.lm_state, 
+                          self._get_word_strings(word)[word], 
+                          new_state)
+        self.lm_state = new_state
     
     def get_state(self):
-        """Returns the current n-gram history """
-        return self.history
+        """Returns the current ``kenlm.State`` """
+        return self.lm_state
     
     def set_state(self, state):
-        """Sets the current n-gram history and LM state """
-        self.history = state
-        self._update_lm_state()
+        """Sets the current ``kenlm.State`` """
+        self.lm_state = state
 
     def is_equal(self, state1, state2):
+        """Returns true if the n-gram contexts are the same. """
         return state1 == state2
-
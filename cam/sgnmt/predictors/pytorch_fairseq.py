@@ -21,18 +21,25 @@ https://github.com/pytorch/fairseq
 The fairseq predictor can read any model trained with fairseq.
 """
 
+import argparse
+import copy
+import dataclasses
+import json
 import logging
+import math
 import os
+import time
 
 from cam.sgnmt import utils
 from cam.sgnmt.predictors.core import Predictor
 
+import fairseq
 from fairseq import checkpoint_utils, options, tasks
 from fairseq import utils as fairseq_utils
+from fairseq.models.transformer import TransformerDecoder
 from fairseq.sequence_generator import EnsembleModel
 import torch
 import numpy as np
-import copy
 
 
 
@@ -40,6 +47,19 @@ FAIRSEQ_INITIALIZED = False
 """Set to true by _initialize_fairseq() after first constructor call."""
 
 
+_TASKS = {}
+"""Process-wide cache of fairseq tasks (and therefore dictionaries),
+keyed by data directory and language pair."""
+
+
+_MODELS = {}
+"""Process-wide model registry. Maps (checkpoint path, use_cuda,
+quantize) to loaded models such that checkpoints which are used by 
+multiple predictors are only loaded once. Registered models are shared,
+so they must not be modified (e.g. by ``make_generation_fast_`` or
+quantization) after they have been added."""
+
+
 def _initialize_fairseq(user_dir):
     global FAIRSEQ_INITIALIZED
     if not FAIRSEQ_INITIALIZED:
@@ -58,11 +78,262 @@ def get_fairseq_args(model_path, lang_pair):
     return options.parse_args_and_arch(parser, input_args)
 
 
+def get_fairseq_task(model_path, lang_pair):
+    """Sets up the fairseq task for ``model_path``, or fetches it from
+    the task cache if a model in the same directory with the same
+    language pair has been set up before.
+    """
+    key = (os.path.dirname(model_path), lang_pair)
+    if key not in _TASKS:
+        start_time = time.time()
+        args = get_fairseq_args(model_path, lang_pair)
+        _TASKS[key] = tasks.setup_task(args)
+        logging.info("Set up fairseq task and dictionaries for %s in %.2f "
+                     "seconds" % (model_path, time.time() - start_time))
+    return _TASKS[key]
+
+
+def get_quantized_path(model_path):
+    """Returns the path of the cached int8 version of ``model_path``.
+    The quantized checkpoint is stored next to the original one.
+    """
+    return "%s.int8" % model_path
+
+
+def get_checkpoint_stamp(model_path):
+    """Returns size and modification time of the checkpoint in 
+    ``model_path``. This is stored with the quantized checkpoint to 
+    detect caches which are older than the checkpoint.
+    """
+    st = os.stat(model_path)
+    return [st.st_size, st.st_mtime]
+
+
+def _serialize_model_args(model_args):
+    """Converts the model configuration returned by fairseq to JSON.
+    fairseq < 0.10 uses ``argparse.Namespace`` objects, later versions
+    OmegaConf configs or dataclasses.
+
+    Returns:
+        tuple. Pair of format name and JSON string
+    """
+    if isinstance(model_args, argparse.Namespace):
+        return "namespace", json.dumps(vars(model_args))
+    from omegaconf import OmegaConf
+    if dataclasses.is_dataclass(model_args):
+        model_args = OmegaConf.structured(model_args)
+    return "omegaconf", json.dumps(OmegaConf.to_container(model_args,
+                                                          resolve=True))
+
+
+def _build_model_from_args(task, args_format, args_json):
+    """Builds an empty model from a configuration which was serialized
+    with ``_serialize_model_args``. """
+    config = json.loads(args_json)
+    if args_format == "namespace":
+        return task.build_model(argparse.Namespace(**config))
+    from omegaconf import OmegaConf
+    return task.build_model(OmegaConf.create(config).model)
+
+
+def quantize_model(model):
+    """Applies dynamic int8 quantization to all linear layers of
+    ``model``. Weights are quantized ahead of time, activations are
+    quantized on the fly. This only works on CPU.
+    """
+    return torch.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_check_sentences(path):
+    """Loads the sample set for the quantization accuracy check. Each
+    line contains a source sentence in word id format.
+    """
+    with open(path) as f:
+        return [[int(w) for w in line.strip().split()] for line in f]
+
+
+def _snapshot_incremental_state(inc_state):
+    """Copies the dictionary structure of a fairseq incremental state.
+    fairseq updates the per-module buffers in place, but replaces the
+    cached tensors instead of writing into them. Therefore, copying the
+    two dictionary levels is enough to protect a snapshot from future
+    decoder calls, and the tensors themselves are shared.
+    """
+    return {key: dict(val) if isinstance(val, dict) else val
+            for key, val in inc_state.items()}
+
+
+CHUNKED_FAIRSEQ_VERSIONS = ("0.9.",)
+"""fairseq versions whose ``TransformerDecoder`` internals match 
+``_forward_transformer_chunk``. Other versions use step-wise decoding
+in ``predict_next_forced()``."""
+
+
+def _supports_chunks(decoder):
+    """Returns true if ``_forward_transformer_chunk`` can be used with
+    ``decoder``. This requires a transformer decoder from one of the
+    ``CHUNKED_FAIRSEQ_VERSIONS``. """
+    return (fairseq.__version__.startswith(CHUNKED_FAIRSEQ_VERSIONS)
+            and isinstance(decoder, TransformerDecoder)
+            and not getattr(decoder, "cross_self_attention", False))
+
+
+def _forward_transformer_chunk(decoder, tokens, n_new, encoder_out,
+                               incremental_state):
+    """Runs the fairseq ``TransformerDecoder`` ``decoder`` over the last
+    ``n_new`` positions of ``tokens`` in a single pass. fairseq only
+    feeds the last position in incremental mode, so this is a version
+    of ``TransformerDecoder.extract_features`` for multiple positions:
+    The new positions attend to the keys and values of the history in
+    ``incremental_state`` and causally to each other, and are appended
+    to ``incremental_state``.
+
+    Returns:
+        tuple. Decoder output like in ``TransformerDecoder.forward``
+    """
+    positions = None
+    if decoder.embed_positions is not None:
+        positions = decoder.embed_positions(tokens)[:, -n_new:]
+    x = decoder.embed_scale * decoder.embed_tokens(tokens[:, -n_new:])
+    if decoder.project_in_dim is not None:
+        x = decoder.project_in_dim(x)
+    if positions is not None:
+        x += positions
+    if getattr(decoder, "layernorm_embedding", None) is not None:
+        x = decoder.layernorm_embedding(x)
+    x = x.transpose(0, 1)
+    n_prev = tokens.size(1) - n_new
+    self_attn_mask = torch.cat([
+        x.new_zeros(n_new, n_prev),
+        fairseq_utils.fill_with_neg_inf(x.new_zeros(n_new, n_new)).triu(1)],
+        dim=1)
+    if isinstance(encoder_out, dict):
+        enc = encoder_out["encoder_out"]
+        enc_padding_mask = encoder_out["encoder_padding_mask"]
+    else:
+        enc = encoder_out.encoder_out
+        enc_padding_mask = encoder_out.encoder_padding_mask
+    if isinstance(enc, list): # fairseq >= 0.10 stores lists
+        enc = enc[0] if enc else None
+    if isinstance(enc_padding_mask, list):
+        enc_padding_mask = enc_padding_mask[0] if enc_padding_mask else None
+    for layer in decoder.layers:
+        x = layer(x, enc, enc_padding_mask, incremental_state,
+                  self_attn_mask=self_attn_mask)[0]
+    if decoder.layer_norm is not None:
+        x = decoder.layer_norm(x)
+    x = x.transpose(0, 1)
+    if decoder.project_out_dim is not None:
+        x = decoder.project_out_dim(x)
+    return decoder.output_layer(x), None
+
+
+def _truncate_transformer_state(decoder, incremental_state, length):
+    """Removes all but the first ``length`` positions from the self
+    attention buffers of ``decoder`` in ``incremental_state``. The
+    buffers are replaced, not modified. Encoder attention buffers are
+    not changed.
+    """
+    for layer in decoder.layers:
+        buf = layer.self_attn._get_input_buffer(incremental_state)
+        if not buf:
+            continue
+        truncated = {}
+        for key, val in buf.items():
+            if val is not None and key in ("prev_key", "prev_value"):
+                val = val[:, :, :length]
+            elif val is not None and key == "prev_key_padding_mask":
+                val = val[:, :length]
+            truncated[key] = val
+        layer.self_attn._set_input_buffer(incremental_state, truncated)
+
+
+class IncrementalStatePool(object):
+    """Stores snapshots of fairseq incremental states in numbered 
+    slots. A slot is never modified after allocation, so forking a
+    predictor state only increments the reference count of its slot.
+    Released slots are put back on a free list and reused.
+    """
+
+    def __init__(self):
+        """Creates an empty pool. """
+        self.slots = []
+        self.ref_counts = []
+        self.free_slots = []
+
+    def alloc(self, inc_states):
+        """Stores ``inc_states`` in a free slot and returns the slot
+        index. The reference count of the new slot is 1.
+        """
+        if self.free_slots:
+            slot = self.free_slots.pop()
+            self.slots[slot] = inc_states
+            self.ref_counts[slot] = 1
+        else:
+            slot = len(self.slots)
+            self.slots.append(inc_states)
+            self.ref_counts.append(1)
+        return slot
+
+    def fork(self, slot):
+        """Adds a reference to ``slot`` and returns it. """
+        self.ref_counts[slot] += 1
+        return slot
+
+    def get(self, slot):
+        """Returns the incremental states stored in ``slot``. """
+        return self.slots[slot]
+
+    def release(self, slot):
+        """Removes a reference to ``slot``, and returns the slot to the
+        pool if it is not referenced anymore.
+        """
+        self.ref_counts[slot] -= 1
+        if self.ref_counts[slot] <= 0:
+            self.slots[slot] = None
+            self.free_slots.append(slot)
+
+    def __len__(self):
+        """Number of slots in use. """
+        return len(self.slots) - len(self.free_slots)
+
+
+class FairseqPredictorState(object):
+    """Predictor state of the ``FairseqPredictor``. It holds the 
+    consumed history as tuple and the index of the pool slot with the
+    incremental states. Copies of the state share the slot, and the 
+    slot is released when the last copy is garbage collected.
+    """
+
+    __slots__ = ('consumed', 'slot', 'pool')
+
+    def __init__(self, consumed, slot, pool):
+        self.consumed = consumed
+        self.slot = slot
+        self.pool = pool
+
+    def __copy__(self):
+        return FairseqPredictorState(self.consumed, 
+                                     self.pool.fork(self.slot), 
+                                     self.pool)
+
+    def __deepcopy__(self, memo):
+        return self.__copy__()
+
+    def __del__(self):
+        try:
+            self.pool.release(self.slot)
+        except (AttributeError, TypeError):
+            pass # Interpreter shutdown
+
+
 class FairseqPredictor(Predictor):
     """Predictor for using fairseq models."""
 
     def __init__(self, model_path, user_dir, lang_pair, n_cpu_threads=-1, 
-        subtract_uni=False, subtract_marg=False, marg_path=None, lmbda=1.0, ppmi=False, epsilon=0
+        subtract_uni=False, subtract_marg=False, marg_path=None, lmbda=1.0, ppmi=False, epsilon=0,
+        quantize=False, quantize_check_path=None, quantize_check_threshold=0.99
         ):
         """Initializes a fairseq predictor.
 
@@ -73,26 +344,49 @@ class FairseqPredictor(Predictor):
             user_dir (string): Path to fairseq user directory.
             n_cpu_threads (int): Number of CPU threads. If negative,
                                  use GPU.
+            quantize (bool): If true, apply dynamic int8 quantization
+                             to the linear layers of all models. Only
+                             used for CPU decoding. The quantized
+                             models are cached in ``<model_path>.int8``
+            quantize_check_path (string): If set, compare the int8
+                                          models against fp32 on the
+                                          sentences in this file
+            quantize_check_threshold (float): Minimum top-1 agreement
+                                              between fp32 and int8
+                                              in the accuracy check
         """
         super(FairseqPredictor, self).__init__()
         _initialize_fairseq(user_dir)
         self.use_cuda = torch.cuda.is_available() and n_cpu_threads < 0
-
-        args = get_fairseq_args(model_path, lang_pair)
+        if n_cpu_threads > 0:
+            torch.set_num_threads(n_cpu_threads)
+        self.quantize = quantize and not self.use_cuda
+        if quantize and self.use_cuda:
+            logging.warn("Dynamic int8 quantization is only supported on "
+                         "CPU. Set --n_cpu_threads to use it.")
+        self.quantize_check_sentences = None
+        if self.quantize and quantize_check_path:
+            self.quantize_check_sentences = load_check_sentences(
+                quantize_check_path)
+            self.quantize_check_stamp = [os.path.abspath(quantize_check_path)] \
+                + get_checkpoint_stamp(quantize_check_path)
+        self.quantize_check_threshold = quantize_check_threshold
 
         # Setup task, e.g., translation
-        task = tasks.setup_task(args)
-        source_dict = task.source_dictionary
-        target_dict = task.target_dictionary
+        self.task = get_fairseq_task(model_path, lang_pair)
+        source_dict = self.task.source_dictionary
+        target_dict = self.task.target_dictionary
         self.src_vocab_size = len(source_dict) + 1
         self.trg_vocab_size = len(target_dict) + 1
         self.pad_id = target_dict.pad()
         self.eos_id = target_dict.eos()
         self.bos_id = target_dict.bos()
-         # Load ensemble
-        self.models = self.load_models(model_path, task)
-        self.model = EnsembleModel(self.models)
-        self.model.eval()
+        # Ensemble is loaded lazily in initialize()
+        self.model_path = model_path
+        self.models = None
+        self.state_pool = IncrementalStatePool()
+        self.cur_state = None
+        self.forced_inc_states = {}
 
         assert not subtract_marg & subtract_uni
         self.use_uni_dist = subtract_uni
@@ -109,35 +403,264 @@ class FairseqPredictor(Predictor):
         if self.use_marg_dist:
             if not marg_path:
                 raise AttributeError("No path (--marg_path) given for marginal model when --subtract_marg used")
-            args = get_fairseq_args(marg_path, lang_pair)
             self.ppmi = ppmi
             self.eps = epsilon
             # Setup task, e.g., translation
-            task = tasks.setup_task(args)
-            assert source_dict == task.source_dictionary
-            assert target_dict == task.target_dictionary
-             # Load ensemble
-            self.marg_models = self.load_models(marg_path, task)
+            self.marg_task = get_fairseq_task(marg_path, lang_pair)
+            assert source_dict == self.marg_task.source_dictionary
+            assert target_dict == self.marg_task.target_dictionary
+            self.marg_path = marg_path
+
+
+    def _load_ensembles(self):
+        """Loads the model weights. This is called lazily on the first
+        ``initialize()`` call such that the startup of the decoder is
+        not blocked by reading checkpoints.
+        """
+        self.models = self.load_models(self.model_path, self.task)
+        self.model = EnsembleModel(self.models)
+        self.model.eval()
+        if self.use_marg_dist:
+            self.marg_models = self.load_models(self.marg_path, 
+                                                self.marg_task)
             self.marg_model = EnsembleModel(self.marg_models)
             self.marg_model.eval()
 
-
     def load_models(self, model_path, task):
-        logging.info('Loading fairseq model(s) from {}'.format(model_path))
-        models, _ = checkpoint_utils.load_model_ensemble(
-            model_path.split(':'),
+        """Loads the ensemble members in ``model_path`` (separated by
+        colons). Checkpoints which have already been loaded by another
+        fairseq predictor in this process are fetched from the model
+        registry instead of being read again. Registry models are 
+        shared between predictors and must never be modified after
+        loading.
+
+        ``EnsembleModel`` keys incremental states by model, so an
+        ensemble must not contain the same module twice. If a 
+        checkpoint occurs multiple times in ``model_path``, its 
+        repetitions are private copies.
+        """
+        models = []
+        for path in model_path.split(':'):
+            key = (path, self.use_cuda, self.quantize)
+            if key in _MODELS:
+                logging.info("Reusing fairseq model %s" % path)
+            else:
+                start_time = time.time()
+                if self.quantize:
+                    _MODELS[key] = self.load_quantized_model(path, task)
+                else:
+                    _MODELS[key] = self.load_fp32_model(path, task)
+                logging.info("Loaded fairseq model %s in %.2f seconds"
+                             % (path, time.time() - start_time))
+            model = _MODELS[key]
+            if any(m is model for m in models):
+                model = copy.deepcopy(model)
+            models.append(model)
+        return models
+
+    def _load_checkpoint(self, path, task):
+        """Loads the fp32 model in ``path`` on the CPU and optimizes it
+        for generation.
+
+        Returns:
+            tuple. (model, args) pair with the fairseq model and the
+            arguments it was trained with
+        """
+        logging.info('Loading fairseq model from {}'.format(path))
+        models, model_args = checkpoint_utils.load_model_ensemble(
+            [path],
             task=task,
         )
+        model = models[0]
+
+        # Optimize model for generation
+        model.make_generation_fast_(
+            beamable_mm_beam_size=1,
+            need_attn=False,
+        )
+        return model, model_args
+
+    def load_fp32_model(self, path, task):
+        model, _ = self._load_checkpoint(path, task)
+        if self.use_cuda:
+            model.cuda()
+        return model
+
+    def load_quantized_model(self, path, task):
+        """Loads an int8 version of the model in ``path``. The model is
+        read from its cached quantized checkpoint if the cache matches
+        the current checkpoint. Otherwise, the fp32 model is quantized
+        after ``make_generation_fast_`` and the result is written to 
+        the cache. The result of the accuracy check is stored in the
+        cache as well, so the fp32 model is only loaded for the check
+        if the cache has no result for the current sample set.
+        """
+        cache_path = get_quantized_path(path)
+        cached = self._read_quantized_cache(path, cache_path)
+        model = None
+        if cached is not None:
+            model = self._build_quantized_model(cached, cache_path, task)
+        if model is None:
+            fp32_model, model_args = self._load_checkpoint(path, task)
+            fp32_model.eval()
+            model = quantize_model(fp32_model)
+            model.eval()
+            check = None
+            if self.quantize_check_sentences:
+                check = self.check_quantization_accuracy(fp32_model, model)
+            try:
+                args_format, args_json = _serialize_model_args(model_args)
+            except Exception as e:
+                logging.warn("Could not serialize the configuration of %s. "
+                             "The quantized model is not cached: %s" 
+                             % (path, e))
+                return model
+            self._write_quantized_cache(cache_path, {
+                "checkpoint": get_checkpoint_stamp(path),
+                "args_format": args_format,
+                "args": args_json,
+                "model": model.state_dict(),
+                "check": check})
+            return model
+        if self.quantize_check_sentences:
+            check = cached.get("check")
+            if check and check["sentences"] == self.quantize_check_stamp:
+                self._report_quantization_check(check["agreement"],
+                                                check["max_diff"])
+            else:
+                fp32_model, _ = self._load_checkpoint(path, task)
+                fp32_model.eval()
+                cached["check"] = self.check_quantization_accuracy(
+                    fp32_model, model)
+                self._write_quantized_cache(cache_path, cached)
+        return model
+
+    def _read_quantized_cache(self, path, cache_path):
+        """Reads the quantized model cache in ``cache_path``. The cache
+        stores the state dict of the int8 model together with the 
+        serialized model configuration and the accuracy check result.
+
+        Returns:
+            dict. Contents of the cache, or None if the cache does not
+            exist or was created from a different version of ``path``
+        """
+        if not os.path.isfile(cache_path):
+            return None
+        try:
+            cached = torch.load(cache_path, map_location="cpu")
+        except Exception as e:
+            logging.warn("Could not read quantized model cache %s: %s"
+                         % (cache_path, e))
+            return None
+        if cached.get("checkpoint") != get_checkpoint_stamp(path):
+            logging.info("Quantized model cache %s is stale" % cache_path)
+            return None
+        return cached
 
-        # Optimize ensemble for generation
-        for model in models:
+    def _build_quantized_model(self, cached, cache_path, task):
+        """Builds an empty model from the configuration in ``cached``,
+        quantizes it, and loads the cached int8 state dict into it.
+
+        Returns:
+            The int8 model, or None if the model cannot be built with
+            the installed fairseq version
+        """
+        logging.info("Loading quantized fairseq model from %s" % cache_path)
+        try:
+            model = _build_model_from_args(task, cached["args_format"],
+                                           cached["args"])
             model.make_generation_fast_(
                 beamable_mm_beam_size=1,
                 need_attn=False,
             )
-            if self.use_cuda:
-                model.cuda()
-        return models
+            model.eval()
+            model = quantize_model(model)
+            model.load_state_dict(cached["model"])
+        except Exception as e:
+            logging.warn("Could not restore quantized model from %s: %s"
+                         % (cache_path, e))
+            return None
+        model.eval()
+        return model
+
+    def _write_quantized_cache(self, cache_path, cached):
+        """Stores ``cached`` in ``cache_path``. The file is written to a
+        temporary file first such that concurrent processes never read
+        a partial cache. Failures are logged and otherwise ignored.
+        """
+        tmp_path = "%s.%d.tmp" % (cache_path, os.getpid())
+        try:
+            torch.save(cached, tmp_path)
+            os.replace(tmp_path, cache_path)
+            logging.info("Stored quantized fairseq model in %s"
+                         % cache_path)
+        except Exception as e:
+            logging.warn("Could not cache quantized model in %s: %s"
+                         % (cache_path, e))
+
+    def check_quantization_accuracy(self, fp32_model, int8_model):
+        """Compares the int8 model with the fp32 model on the sample
+        set in ``quantize_check_sentences``. Both models are run in
+        teacher forcing mode along the greedy fp32 translation. We log
+        the top-1 agreement and the maximum absolute difference between
+        the log-probabilities, and warn if the agreement is below
+        ``quantize_check_threshold``.
+
+        Returns:
+            dict. Check result which can be stored in the cache
+        """
+        fp32_ensemble = EnsembleModel([fp32_model])
+        int8_ensemble = EnsembleModel([int8_model])
+        n_agree = 0
+        n_total = 0
+        max_diff = 0.0
+        with torch.no_grad():
+            for src_sentence in self.quantize_check_sentences:
+                src = {
+                    'src_tokens': torch.LongTensor([utils.oov_to_unk(
+                        src_sentence + [utils.EOS_ID], self.src_vocab_size)]),
+                    'src_lengths': torch.LongTensor([len(src_sentence) + 1])}
+                fp32_enc = fp32_ensemble.forward_encoder(src)
+                int8_enc = int8_ensemble.forward_encoder(src)
+                fp32_ensemble.incremental_states[fp32_model] = {}
+                int8_ensemble.incremental_states[int8_model] = {}
+                consumed = [utils.GO_ID or utils.EOS_ID]
+                max_len = 2 * len(src_sentence) + 2
+                while len(consumed) < max_len:
+                    inputs = torch.LongTensor([consumed])
+                    fp32_lprobs, _ = fp32_ensemble.forward_decoder(
+                        inputs, fp32_enc)
+                    int8_lprobs, _ = int8_ensemble.forward_decoder(
+                        inputs, int8_enc)
+                    fp32_best = int(fp32_lprobs[0].argmax())
+                    n_total += 1
+                    if int(int8_lprobs[0].argmax()) == fp32_best:
+                        n_agree += 1
+                    finite = torch.isfinite(fp32_lprobs[0])
+                    diff = (fp32_lprobs[0][finite] 
+                            - int8_lprobs[0][finite]).abs().max().item()
+                    max_diff = max(max_diff, diff)
+                    consumed.append(fp32_best)
+                    if fp32_best == self.eos_id:
+                        break
+        agreement = float(n_agree) / n_total if n_total else 1.0
+        self._report_quantization_check(agreement, max_diff)
+        return {"sentences": self.quantize_check_stamp,
+                "agreement": agreement,
+                "max_diff": max_diff}
+
+    def _report_quantization_check(self, agreement, max_diff):
+        """Logs the result of the quantization accuracy check. """
+        logging.info("Quantization check on %d sentences: top-1 agreement="
+                     "%f max_abs_diff=%f" % (
+                         len(self.quantize_check_sentences),
+                         agreement,
+                         max_diff))
+        if agreement < self.quantize_check_threshold:
+            logging.warn("The int8 model agrees with the fp32 model in only "
+                         "%f of the greedy decisions (threshold: %f). "
+                         "Consider decoding without --fairseq_quantize."
+                         % (agreement, self.quantize_check_threshold))
 
     def get_unk_probability(self, posterior):
         """Fetch posterior[utils.UNK_ID]"""
@@ -145,6 +668,7 @@ class FairseqPredictor(Predictor):
                 
     def predict_next(self):
         """Call the fairseq model."""
+        self._detach_incremental_states()
         inputs = torch.LongTensor([self.consumed])
         if self.use_cuda:
             inputs = inputs.cuda()
@@ -164,8 +688,198 @@ class FairseqPredictor(Predictor):
 
         return lprobs[0] if self.use_cuda else np.array(lprobs[0])
     
+    def _forward_decoder_full(self, ensemble, tokens, encoder_outs):
+        """Runs the decoders of ``ensemble`` over the complete target
+        prefixes in ``tokens`` (batch x time) without incremental 
+        states, and returns the ensemble log-probabilities at each 
+        position (batch x time x vocab).
+        """
+        log_probs = []
+        for model, encoder_out in zip(ensemble.models, encoder_outs):
+            decoder_out = model.decoder(tokens, encoder_out)
+            log_probs.append(model.get_normalized_probs(
+                decoder_out, log_probs=True))
+        if len(log_probs) == 1:
+            return log_probs[0]
+        return (torch.logsumexp(torch.stack(log_probs, dim=0), dim=0) 
+                - math.log(len(log_probs)))
+
+    def _forced_lprobs(self, inputs):
+        """Teacher-forced counterpart of ``predict_next()``: Returns
+        the (batch x time x vocab) scores for the target prefixes in
+        ``inputs``, including the unigram or marginal model terms.
+        """
+        batch_size = inputs.size(0)
+        encoder_outs = self.encoder_outs
+        if batch_size > 1:
+            new_order = torch.zeros(batch_size).long()
+            if self.use_cuda:
+                new_order = new_order.cuda()
+            encoder_outs = self.model.reorder_encoder_out(encoder_outs, 
+                                                          new_order)
+        lprobs = self._forward_decoder_full(self.model, inputs, encoder_outs)
+        lprobs[:, :, self.pad_id] = utils.NEG_INF
+        if self.use_uni_dist:
+            lprobs = lprobs - self.lmbda*self.log_uni_dist
+        if self.use_marg_dist:
+            marg_encoder_outs = self.marg_encoder_outs
+            if batch_size > 1:
+                marg_encoder_outs = self.marg_model.reorder_encoder_out(
+                    marg_encoder_outs, new_order)
+            marg_lprobs = self._forward_decoder_full(
+                self.marg_model, inputs, marg_encoder_outs)
+            if self.ppmi:
+                marg_lprobs = torch.clamp(marg_lprobs, -self.eps)
+            lprobs = lprobs - self.lmbda*marg_lprobs
+        return lprobs
+
+    def _forward_decoder_chunk(self, ensemble, tokens, n_new, 
+                               encoder_outs):
+        """Runs the decoders of ``ensemble`` incrementally over the last
+        ``n_new`` positions of ``tokens`` (1 x time). Transformer 
+        decoders process them in a single pass. Other decoders are fed
+        one position at a time, and we keep a copy of their incremental
+        states after each position in ``forced_inc_states`` for 
+        ``rollback()``.
+
+        Returns:
+            tensor. (``n_new`` x vocab) ensemble log-probabilities
+        """
+        log_probs = []
+        for model, encoder_out in zip(ensemble.models, encoder_outs):
+            inc_state = ensemble.incremental_states[model]
+            if _supports_chunks(model.decoder):
+                decoder_out = _forward_transformer_chunk(
+                    model.decoder, tokens, n_new, encoder_out, inc_state)
+            else:
+                steps = []
+                snapshots = []
+                for pos in range(tokens.size(1) - n_new + 1, 
+                                 tokens.size(1) + 1):
+                    step_out = model.forward_decoder(
+                        tokens[:, :pos], encoder_out=encoder_out,
+                        incremental_state=inc_state)
+                    steps.append(step_out[0][:, -1:, :])
+                    snapshots.append(_snapshot_incremental_state(inc_state))
+                self.forced_inc_states[model] = snapshots
+                decoder_out = (torch.cat(steps, dim=1), None)
+            log_probs.append(model.get_normalized_probs(
+                decoder_out, log_probs=True)[0])
+        if len(log_probs) == 1:
+            return log_probs[0]
+        return (torch.logsumexp(torch.stack(log_probs, dim=0), dim=0) 
+                - math.log(len(log_probs)))
+
+    def predict_next_forced(self, words):
+        """Scores the current history extended by each prefix of 
+        ``words`` in a single incremental decoder pass. This is used 
+        for verifying the proposals of a draft model in speculative
+        decoding. Afterwards, the predictor is in the same state as 
+        after alternately calling ``predict_next()`` and ``consume()``
+        for all ``words`` followed by a final ``predict_next()``. 
+        Transformer decoders process all positions in one pass with 
+        different matrix shapes than ``predict_next()``, so scores may
+        differ from it by floating point rounding. Use
+        ``rollback()`` to remove rejected words from the history. Like
+        ``predict_next()``, this must be called after ``consume()`` or
+        ``initialize()``.
+
+        Args:
+            words (list): Target words to append to the history
+
+        Returns:
+            list. ``len(words)+1`` posteriors. The i-th posterior is 
+            the distribution after consuming the first i ``words``
+        """
+        self._detach_incremental_states()
+        self.forced_inc_states = {}
+        self.consumed.extend(words)
+        n_new = len(words) + 1
+        inputs = torch.LongTensor([self.consumed])
+        if self.use_cuda:
+            inputs = inputs.cuda()
+        with torch.no_grad():
+            lprobs = self._forward_decoder_chunk(
+                self.model, inputs, n_new, self.encoder_outs)
+            lprobs[:, self.pad_id] = utils.NEG_INF
+            if self.use_uni_dist:
+                lprobs = lprobs - self.lmbda*self.log_uni_dist
+            if self.use_marg_dist:
+                marg_lprobs = self._forward_decoder_chunk(
+                    self.marg_model, inputs, n_new, self.marg_encoder_outs)
+                if self.ppmi:
+                    marg_lprobs = torch.clamp(marg_lprobs, -self.eps)
+                lprobs = lprobs - self.lmbda*marg_lprobs
+        return list(lprobs.cpu().numpy())
+
+    def rollback(self, n_words):
+        """Removes the last ``n_words`` words added by the last call of
+        ``predict_next_forced()`` from the history together with their
+        incremental states. The cache of the remaining history is kept.
+        Afterwards, the predictor is in the same state as after 
+        ``predict_next()`` on the shorter history.
+
+        Args:
+            n_words (int): Number of words to remove
+        """
+        if n_words <= 0:
+            return
+        self.consumed = self.consumed[:-n_words]
+        length = len(self.consumed)
+        for ensemble, models in self._get_ensembles():
+            for model in models:
+                if _supports_chunks(model.decoder):
+                    _truncate_transformer_state(
+                        model.decoder, ensemble.incremental_states[model],
+                        length)
+                else:
+                    ensemble.incremental_states[model] = \
+                        self.forced_inc_states[model][-n_words-1]
+        self.forced_inc_states = {}
+
+    def score_sequences(self, trg_sentences, batch_size=0):
+        """Scores complete target sentences given the current source
+        sentence with teacher forcing. All sentences in a batch are
+        scored in one parallel decoder pass, which is much faster than
+        the ``predict_next()``/``consume()`` loop for reference or
+        n-best list scoring. Does not change the predictor state.
+
+        Args:
+            trg_sentences (list): List of target sentences (lists of
+                                  word ids) without <S> or </S>
+            batch_size (int): Maximum number of sentences per decoder
+                              pass. If not positive, score all 
+                              sentences in a single pass
+
+        Returns:
+            list. For each sentence a numpy array with the scores of
+            all its tokens, followed by the score of </S>
+        """
+        if batch_size <= 0:
+            batch_size = max(1, len(trg_sentences))
+        scores = []
+        for start in range(0, len(trg_sentences), batch_size):
+            targets = [list(sen) + [utils.EOS_ID] 
+                       for sen in trg_sentences[start:start+batch_size]]
+            max_len = max(len(target) for target in targets)
+            inputs = torch.LongTensor([
+                [utils.GO_ID or utils.EOS_ID] + target[:-1]
+                + [self.pad_id] * (max_len - len(target))
+                for target in targets])
+            if self.use_cuda:
+                inputs = inputs.cuda()
+            with torch.no_grad():
+                lprobs = self._forced_lprobs(inputs).cpu().numpy()
+            for idx, target in enumerate(targets):
+                scores.append(lprobs[idx, np.arange(len(target)), target])
+        return scores
+    
     def initialize(self, src_sentence):
-        """Initialize source tensors, reset consumed."""
+        """Initialize source tensors, reset consumed. Loads the models
+        on the first call."""
+        if self.models is None:
+            self._load_ensembles()
+        self.cur_state = None
         self.consumed = []
         src_tokens = torch.LongTensor([
             utils.oov_to_unk(src_sentence + [utils.EOS_ID],
@@ -206,6 +920,7 @@ class FairseqPredictor(Predictor):
         self.consumed.append(word)
     
     def get_empty_str_prob(self):
+        self._detach_incremental_states()
         inputs = torch.LongTensor([[utils.GO_ID or utils.EOS_ID]])
         if self.use_cuda:
             inputs = inputs.cuda()
@@ -226,19 +941,67 @@ class FairseqPredictor(Predictor):
         return lprobs[0,self.eos_id].item()
 
 
+    def _get_ensembles(self):
+        """Returns (ensemble, models) pairs whose incremental states
+        are part of the predictor state."""
+        if self.use_marg_dist:
+            return [(self.model, self.models), 
+                    (self.marg_model, self.marg_models)]
+        return [(self.model, self.models)]
+
+    def _detach_incremental_states(self):
+        """Copy-on-write for incremental states. If the current 
+        incremental states are stored in the pool slot of 
+        ``cur_state``, they are replaced by private copies before
+        the decoder updates them.
+        """
+        if self.cur_state is None:
+            return
+        for (ensemble, models), inc_states in zip(
+                self._get_ensembles(), 
+                self.state_pool.get(self.cur_state.slot)):
+            for model, inc_state in zip(models, inc_states):
+                ensemble.incremental_states[model] = \
+                    _snapshot_incremental_state(inc_state)
+        self.cur_state = None
+
     def get_state(self):
-        """The predictor state is the complete history."""
-        return self.consumed, [self.model.incremental_states[m] 
-                               for m in self.models]
+        """The predictor state is the complete history together with
+        a pool slot holding the incremental states. The current 
+        incremental states are moved to a new slot only if they have
+        been changed by the decoder since the last ``get_state()`` or
+        ``set_state()``. Otherwise, the existing slot is shared."""
+        if self.cur_state is None:
+            inc_states = [[ensemble.incremental_states[m] for m in models]
+                          for ensemble, models in self._get_ensembles()]
+            self.cur_state = FairseqPredictorState(
+                tuple(self.consumed), 
+                self.state_pool.alloc(inc_states),
+                self.state_pool)
+        return FairseqPredictorState(tuple(self.consumed),
+                                     self.state_pool.fork(self.cur_state.slot),
+                                     self.state_pool)
     
     def set_state(self, state):
-        """The predictor state is the complete history."""
-        consumed, inc_states = state
-        self.consumed = copy.copy(consumed)
-        for model, inc_state in zip(self.models, inc_states):
-            self.model.incremental_states[model] = inc_state
+        """Loads the history and references the incremental states in
+        the slot of ``state``. They are copied lazily when 
+        ``predict_next()`` updates them, so the slot itself is never
+        modified."""
+        self.consumed = list(state.consumed)
+        for (ensemble, models), inc_states in zip(
+                self._get_ensembles(), self.state_pool.get(state.slot)):
+            for model, inc_state in zip(models, inc_states):
+                ensemble.incremental_states[model] = inc_state
+        self.cur_state = FairseqPredictorState(
+            state.consumed, 
+            self.state_pool.fork(state.slot),
+            self.state_pool)
 
     def is_equal(self, state1, state2):
         """Returns true if the history is the same """
-        return state1[0] == state2[0]
+        return state1.consumed == state2.consumed
+
+    def get_state_key(self):
+        """The history determines the predictor state. """
+        return tuple(self.consumed)
 
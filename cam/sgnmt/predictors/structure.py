@@ -22,6 +22,8 @@ of operations which cannot be compiled to a string.
 
 import logging
 
+import numpy as np
+
 from cam.sgnmt import utils
 from cam.sgnmt.predictors.core import Predictor, UnboundedVocabularyPredictor
 
@@ -127,6 +129,11 @@ class OSMPredictor(Predictor):
     The predictor supports the original OSNMT operation set (default)
     plus a number of variations that are set by the use_* arguments in
     the constructor.
+
+    The constraints only depend on a few properties of the state (all
+    POPs used, no POP to undo, head at the first or last hole, and the
+    recent operations relevant for illegal sequences). The posterior
+    for each combination is built once and shared between calls.
     """
     
     def __init__(self, src_wmap, trg_wmap, use_jumps=True, use_auto_pop=False, 
@@ -183,6 +190,11 @@ class OSMPredictor(Predictor):
                 self.no_auto_pop.add(OSM_SET_MARKER_ID)
             if use_unpop:
                 self.no_auto_pop.add(OSM_SRC_UNPOP_ID)
+        self.history_len = max([len(seq) - 1 
+                                for seq in self.illegal_sequences] + [0])
+        self.sequence_ops = set(op for seq in self.illegal_sequences
+                                for op in seq[:-1])
+        self.constraint_cache = {}
 
     def _is_pop(self, token):
         if token in self.pop_ids:
@@ -202,30 +214,44 @@ class OSMPredictor(Predictor):
         self.n_holes = 0
         self.head = 0
         self.n_pop = 0
-        self.history = []
+        self.history = ()
+
+    def _build_constraints(self, key):
+        """Builds the posterior for a constraint key as created in
+        ``predict_next``.
+        """
+        force_eos, no_unpop, no_jump_bwd, no_jump_fwd, history = key
+        if force_eos:
+            return {utils.EOS_ID: 0.0}
+        ret = {utils.EOS_ID: utils.NEG_INF}
+        if no_unpop:
+            ret[OSM_SRC_UNPOP_ID] = utils.NEG_INF
+        if no_jump_bwd:
+            ret[OSM_JUMP_BWD_ID] = utils.NEG_INF
+        if no_jump_fwd:
+            ret[OSM_JUMP_FWD_ID] = utils.NEG_INF
+        for seq in self.illegal_sequences:
+            hist = tuple(seq[:-1])
+            if history[-len(hist):] == hist:
+                ret[seq[-1]] = utils.NEG_INF
+        return ret
 
     def predict_next(self):
         """Apply OSM constraints.
         
         Returns:
-            dict.
+            dict. Shared between states with the same constraints, so
+            it must not be modified.
         """
-        ret = {}
-        if self.n_pop >= self.src_len:
-            return {utils.EOS_ID: 0.0} # Force EOS
-        else:
-            ret[utils.EOS_ID] = utils.NEG_INF
-        if self.use_unpop and self.n_pop <= 0:
-            ret[OSM_SRC_UNPOP_ID] = utils.NEG_INF
-        if self.use_jumps:
-            if self.head <= 0:
-                ret[OSM_JUMP_BWD_ID] = utils.NEG_INF
-            if self.head >= self.n_holes:
-                ret[OSM_JUMP_FWD_ID] = utils.NEG_INF
-        for seq in self.illegal_sequences:
-            hist = seq[:-1]
-            if self.history[-len(hist):] == hist:
-                ret[seq[-1]] = utils.NEG_INF
+        key = (self.n_pop >= self.src_len,
+               self.use_unpop and self.n_pop <= 0,
+               self.use_jumps and self.head <= 0,
+               self.use_jumps and self.head >= self.n_holes,
+               self.history)
+        ret = self.constraint_cache.get(key)
+        if ret is None:
+            ret = self._build_constraints(key)
+            self.constraint_cache[key] = ret
         return ret
         
     def get_unk_probability(self, posterior):
@@ -238,8 +264,10 @@ class OSMPredictor(Predictor):
         if not self._is_pop(word):
             if self.use_unpop and word == OSM_SRC_UNPOP_ID:
                 self.n_pop -= 1
-            else:
-                self.history.append(word)
+            elif self.history_len > 0:
+                # Only operations in illegal sequences are distinguished
+                op = word if word in self.sequence_ops else None
+                self.history = (self.history + (op,))[-self.history_len:]
         else:
             self.n_pop += 1
         if self.use_jumps:
@@ -252,10 +280,10 @@ class OSMPredictor(Predictor):
                 self.head -= 1
     
     def get_state(self):
-        return self.n_holes, self.head, self.n_pop
+        return self.n_holes, self.head, self.n_pop, self.history
     
     def set_state(self, state):
-        self.n_holes, self.head, self.n_pop = state
+        self.n_holes, self.head, self.n_pop, self.history = state
 
     def is_equal(self, state1, state2):
         """Trivial implementation"""
@@ -271,6 +299,10 @@ class ForcedOSMPredictor(Predictor):
     the current history. It allows terminal symbols which are 
     consistent with the reference. The end-of-sentence symbol is
     supressed until all words in the reference have been consumed.
+
+    The compiled history is a tuple, so states are hashable. Alignments
+    and posteriors are cached per sentence by compiled history and head
+    position.
     """
     
     def __init__(self, trg_wmap, trg_test_file):
@@ -298,9 +330,11 @@ class ForcedOSMPredictor(Predictor):
         Args:
             src_sentence (list): Not used
         """
-        self.compiled = ["X"]
+        self.compiled = ("X",)
         self.head = 0
         self.cur_trg_sentence = self.trg_sentences[self.current_sen_id] 
+        self.align_cache = {}
+        self.posterior_cache = {}
 
     def _is_complete(self):
         """Returns true if the compiled sentence contains the right
@@ -356,10 +390,23 @@ class ForcedOSMPredictor(Predictor):
         """Apply word reference constraints.
         
         Returns:
-            dict.
+            dict. Shared between hypotheses with the same state, so it
+            must not be modified.
         """
+        key = (self.compiled, self.head)
+        ret = self.posterior_cache.get(key)
+        if ret is None:
+            ret = self._build_posterior()
+            self.posterior_cache[key] = ret
+        return ret
+
+    def _build_posterior(self):
+        """Computes the posterior for the current state. """
         ret = {OSM_SRC_POP_ID: 0.0}
-        possible_words = self._align()
+        possible_words = self.align_cache.get(self.compiled)
+        if possible_words is None:
+            possible_words = self._align()
+            self.align_cache[self.compiled] = possible_words
         if possible_words[self.head]:
             ret[OSM_SET_MARKER_ID] = 0.0
         if any(possible_words[:self.head]):
@@ -382,7 +429,7 @@ class ForcedOSMPredictor(Predictor):
             self.head += step
 
     def _insert_op(self, op):
-        self.compiled = self.compiled[:self.head] + [op] + \
+        self.compiled = self.compiled[:self.head] + (op,) + \
                         self.compiled[self.head:]
         self.head += 1
     
@@ -412,6 +459,11 @@ class BracketPredictor(UnboundedVocabularyPredictor):
     """This predictor constrains the output to well-formed bracket
     expressions. It also allows to specify the number of terminals with
     an external length distribution file.
+
+    Posteriors which do not depend on the candidate words (balanced
+    start, unbalanced, unbalanced without closing brackets) are
+    precomputed and shared. Opening brackets among the candidates are
+    selected with a vectorized filter when the maximum depth is reached.
     """
     
     def __init__(self, max_terminal_id, closing_bracket_id, max_depth=-1, 
@@ -436,6 +488,14 @@ class BracketPredictor(UnboundedVocabularyPredictor):
             self.closing_bracket_ids = utils.split_comma(closing_bracket_id, int)
         except:
             self.closing_bracket_ids = [int(closing_bracket_id)]
+        self.closing_bracket_array = np.array(self.closing_bracket_ids,
+                                              dtype=np.int64)
+        self.no_closing_posterior = {i: utils.NEG_INF 
+                                     for i in self.closing_bracket_ids}
+        self.unbalanced_posterior = {utils.EOS_ID: utils.NEG_INF}
+        self.initial_posterior = dict(self.no_closing_posterior)
+        self.initial_posterior[utils.EOS_ID] = utils.NEG_INF
+        self.unbalanced_no_closing_posterior = self.initial_posterior
         self.max_depth = max_depth if max_depth >= 0 else 1000000
         if extlength_path:
             self.length_scores = load_external_lengths(extlength_path)
@@ -456,8 +516,12 @@ class BracketPredictor(UnboundedVocabularyPredictor):
             self.cur_length_scores = self.length_scores[self.current_sen_id]
             self.max_length = max(self.cur_length_scores)
 
-    def _no_closing_bracket(self):
-        return {i: utils.NEG_INF for i in self.closing_bracket_ids}
+    def _get_opening_brackets(self, words):
+        """Returns the opening brackets in ``words`` as list. """
+        words = np.fromiter(words, dtype=np.int64, count=len(words))
+        mask = words > self.max_terminal_id
+        mask &= ~np.isin(words, self.closing_bracket_array)
+        return words[mask].tolist()
     
     def predict_next(self, words):
         """If the maximum depth is reached, exclude all opening
@@ -467,31 +531,32 @@ class BracketPredictor(UnboundedVocabularyPredictor):
         Args:
             words (list): Set of words to score
         Returns:
-            dict.
+            dict. Might be shared between calls, so it must not be 
+            modified.
         """
         if self.cur_depth == 0:
             # Balanced: Score EOS with extlengths, supress closing bracket
             if self.ends_with_opening:  # Initial predict next call
-                ret = self._no_closing_bracket()
-                ret[utils.EOS_ID] = utils.NEG_INF
-                return ret
+                return self.initial_posterior
             return {utils.EOS_ID: self.cur_length_scores.get(
                         self.n_terminals, utils.NEG_INF) 
                        if self.length_scores else 0.0}
         # Unbalanced: do not allow EOS
-        ret = {utils.EOS_ID: utils.NEG_INF}
-        if (self.cur_depth >= self.max_depth 
-                or self.n_terminals >= self.max_length):
-            # Do not allow opening brackets
-            ret.update({w: utils.NEG_INF for w in words 
-                if (w > self.max_terminal_id 
-                    and not w in self.closing_bracket_ids)})
-        if (self.length_scores 
-                and self.cur_depth == 1 
-                and self.n_terminals > 0 
-                and not self.n_terminals in self.cur_length_scores):
-            # Do not allow to go back to depth 0 with wrong number of terminals
-            ret.update(self._no_closing_bracket())
+        # Do not allow to go back to depth 0 with wrong number of terminals
+        no_closing = (self.length_scores 
+                      and self.cur_depth == 1 
+                      and self.n_terminals > 0 
+                      and not self.n_terminals in self.cur_length_scores)
+        if (self.cur_depth < self.max_depth 
+                and self.n_terminals < self.max_length):
+            if no_closing:
+                return self.unbalanced_no_closing_posterior
+            return self.unbalanced_posterior
+        # Do not allow opening brackets
+        ret = dict.fromkeys(self._get_opening_brackets(words), utils.NEG_INF)
+        ret[utils.EOS_ID] = utils.NEG_INF
+        if no_closing:
+            ret.update(self.no_closing_posterior)
         return ret
         
     def get_unk_probability(self, posterior):
@@ -30,9 +30,11 @@ which transduces character to predictor-unit sequences.
 
 import copy
 import logging
+import os
+
+import numpy as np
 
 from cam.sgnmt import utils
-from cam.sgnmt.misc.trie import SimpleTrie
 from cam.sgnmt.predictors.core import UnboundedVocabularyPredictor, Predictor
 from cam.sgnmt.utils import NEG_INF, common_get
 
@@ -41,6 +43,93 @@ EPS_ID = 0
 """OpenFST's reserved ID for epsilon arcs. """
 
 
+class TokTransducer(object):
+    """Epsilon-free lookup tables for a tokenization transducer. The
+    arcs of the FST are copied into tuples once. Traversals along
+    input epsilon arcs are computed on demand and memoized, so each 
+    (state, character) pair is resolved only once per run. Output label
+    sequences are stored as tuples which are shared between all
+    ``CombinedState`` instances that use them.
+    """
+    
+    def __init__(self, fst_obj):
+        """Compiles the arcs of ``fst_obj``.
+        
+        Args:
+            fst_obj (Fst): Transducer from characters to predictor 
+                           tokens
+        """
+        self.start = fst_obj.start()
+        self.arcs = [tuple((arc.ilabel, arc.olabel, arc.nextstate)
+                           for arc in fst_obj.arcs(state))
+                     for state in range(fst_obj.num_states())]
+        self.transitions = {}
+        self.char_labels = {}
+    
+    def get_transitions(self, node, char):
+        """Returns all states reachable from ``node`` via any number of
+        input epsilon arcs followed by an arc with input label 
+        ``char``.
+        
+        Args:
+            node (int): FST state
+            char (int): Index of character
+        
+        Returns:
+            tuple. Pairs (state, output labels) where output labels is
+            a tuple of the non-epsilon output labels along the path
+        """
+        key = (node, char)
+        transitions = self.transitions.get(key)
+        if transitions is None:
+            acc = []
+            self._dfs(acc, node, char, ())
+            transitions = tuple(acc)
+            self.transitions[key] = transitions
+        return transitions
+    
+    def _dfs(self, acc, root_node, char, outputs):
+        """Helper method for ``get_transitions`` for traversing the FST
+        along ``char`` and epsilon arcs with DFS.
+        """
+        for ilabel, olabel, nextstate in self.arcs[root_node]:
+            next_outputs = outputs + (olabel,) if olabel != EPS_ID \
+                                              else outputs
+            if ilabel == EPS_ID:
+                self._dfs(acc, nextstate, char, next_outputs)
+            elif ilabel == char:
+                acc.append((nextstate, next_outputs))
+    
+    def get_char_labels(self, node):
+        """Returns the characters which can be consumed from ``node``
+        together with the first output label on the path.
+        
+        Args:
+            node (int): FST state
+        
+        Returns:
+            tuple. Unique pairs (character, first output label). The
+            first output label is 0 if there is no output label before
+            the character arc.
+        """
+        char_labels = self.char_labels.get(node)
+        if char_labels is None:
+            acc = set()
+            self._collect_chars(acc, node, EPS_ID)
+            char_labels = tuple(acc)
+            self.char_labels[node] = char_labels
+        return char_labels
+    
+    def _collect_chars(self, acc, root_node, first_olabel):
+        """Helper method for ``get_char_labels``. """
+        for ilabel, olabel, nextstate in self.arcs[root_node]:
+            arc_first_olabel = first_olabel if first_olabel else olabel
+            if ilabel == EPS_ID:
+                self._collect_chars(acc, nextstate, arc_first_olabel)
+            else:
+                acc.add((ilabel, arc_first_olabel))
+
+
 class CombinedState(object):
     """Combines an FST state with predictor state. Use by the fsttok
     predictor.
@@ -50,54 +139,34 @@ class CombinedState(object):
                  fst_node, 
                  pred_state, 
                  posterior, 
-                 unconsumed = [], 
+                 unconsumed = (), 
                  pending_score = 0.0):
         self.fst_node = fst_node
         self.pred_state = pred_state
         self.posterior = posterior
-        self.unconsumed = list(unconsumed)
+        self.unconsumed = tuple(unconsumed)
         self.pending_score = pending_score
     
-    def traverse_fst(self, trans_fst, char):
+    def traverse_fst(self, transducer, char):
         """Returns a list of ``CombinedState``s with the same predictor
         state and posterior, but an ``fst_node`` which is reachable
         via the input label ``char``. If the output tabe contains
         symbols, add them to ``unconsumed``.
         
         Args:
-            trans_fst (Fst): FST to traverse
+            transducer (TokTransducer): Compiled FST to traverse
             char (int): Index of character
         
         Returns:
             list. List of combined states reachable via ``char``
         """
-        ret = []
-        self._dfs(trans_fst, ret, self.fst_node, char, self.unconsumed)
-        return ret
-    
-    def _dfs(self, trans_fst, acc, root_node, char, cur_unconsumed):
-        """Helper method for ``traverse_fst`` for traversing the FST
-        along ``char`` and epsilon arcs with DFS.
-        
-        Args:
-            trans_fst (Fst): FST to traverse
-            acc (list): Accumulator list
-            root_node (int): State in the FST to start
-            char (int): Index of character
-            cur_unconsumed (list): Unconsumed predictor tokens so far
-        """
-        for arc in trans_fst.arcs(root_node):
-            next_unconsumed = list(cur_unconsumed)
-            if arc.olabel != EPS_ID:
-                next_unconsumed.append(arc.olabel)
-            if arc.ilabel == EPS_ID:
-                self._dfs(trans_fst, acc, arc.nextstate, char, next_unconsumed)
-            elif arc.ilabel == char:
-                acc.append(CombinedState(arc.nextstate,
-                                         self.pred_state,
-                                         self.posterior,
-                                         next_unconsumed,
-                                         self.pending_score))
+        return [CombinedState(node,
+                              self.pred_state,
+                              self.posterior,
+                              self.unconsumed + outputs,
+                              self.pending_score)
+                for node, outputs in transducer.get_transitions(
+                    self.fst_node, char)]
     
     def score(self, token, predictor):
         """Returns a score which can be added if ``token`` is consumed
@@ -130,7 +199,7 @@ class CombinedState(object):
             predictor.consume(token)
             self.posterior = predictor.predict_next()
         self.pred_state = copy.deepcopy(predictor.get_state())
-        self.unconsumed = []
+        self.unconsumed = ()
     
     def consume_single(self, predictor):
         """Consume a single token in ``self.unconsumed``.
@@ -197,7 +266,7 @@ class FSTTokPredictor(Predictor):
         if isinstance(slave_predictor, UnboundedVocabularyPredictor):
             logging.fatal("fsttok cannot wrap an unbounded "
                           "vocabulary predictor.")
-        self.trans_fst = utils.load_fst(path)
+        self.transducer = TokTransducer(utils.load_fst(path))
     
     def initialize(self, src_sentence):
         """Pass through to slave predictor. The source sentence is not
@@ -206,7 +275,7 @@ class FSTTokPredictor(Predictor):
         """
         self.slave_predictor.initialize(src_sentence)
         posterior = self.slave_predictor.predict_next()
-        self.states = [CombinedState(self.trans_fst.start(),
+        self.states = [CombinedState(self.transducer.start,
                                      self.slave_predictor.get_state(),
                                      posterior)]
         self.last_prediction = {}
@@ -219,27 +288,22 @@ class FSTTokPredictor(Predictor):
         self.slave_predictor.initialize_heuristic(src_sentence)
     
     def predict_next(self):
+        """Scores all characters which can be consumed from one of the
+        current FST nodes. The reachable characters of each node are
+        looked up in the compiled transducer.
+        """
         self.last_prediction = {}
         for state in self.states:
-            self._collect_chars(state, state.fst_node, None)
-        return self.last_prediction
-    
-    def _collect_chars(self, state, root_node, first_olabel):
-        """Recursively builds up ``last_prediction`` by traversing
-        epsilon arcs in the FST from ``root_node``
-        """
-        for arc in self.trans_fst.arcs(root_node):
-            arc_first_olabel = first_olabel if first_olabel else arc.olabel
-            if arc.ilabel == EPS_ID:
-                self._collect_chars(state, arc.nextstate, arc_first_olabel)
-            else:
-                score = state.score(arc_first_olabel, self.slave_predictor)
-                if arc.ilabel in self.last_prediction: 
-                    self.last_prediction[arc.ilabel] = max(
-                                            self.last_prediction[arc.ilabel], 
+            for char, first_olabel in self.transducer.get_char_labels(
+                    state.fst_node):
+                score = state.score(first_olabel, self.slave_predictor)
+                if char in self.last_prediction: 
+                    self.last_prediction[char] = max(
+                                            self.last_prediction[char], 
                                             score)
                 else:
-                    self.last_prediction[arc.ilabel] = score
+                    self.last_prediction[char] = score
+        return self.last_prediction
 
     def get_unk_probability(self, posterior):
         """Always returns negative infinity. Handling UNKs needs to be 
@@ -272,7 +336,7 @@ class FSTTokPredictor(Predictor):
         """
         next_states = []
         for state in self.states:
-            next_states.extend(state.traverse_fst(self.trans_fst, word))
+            next_states.extend(state.traverse_fst(self.transducer, word))
         consumed_score = self.last_prediction.get(word, 0.0)
         for state in next_states:
             state.pending_score -= consumed_score
@@ -310,6 +374,214 @@ class FSTTokPredictor(Predictor):
         return False
     
 
+class CharPrefixIndex(object):
+    """Flat index over a word-to-character mapping. Words are sorted by
+    their character sequences, so that all words with a given 
+    character prefix form a contiguous range. ``chars`` is a matrix 
+    with one row per word which contains the character ids, padded 
+    with -1. Since -1 is smaller than any character id, the words which
+    end exactly after a prefix are at the beginning of its range.
+    """
+    
+    def __init__(self, words, chars):
+        """Creates the index from sorted arrays.
+        
+        Args:
+            words (array): Word ids, sorted by character sequence
+            chars (array): Character id matrix (padded with -1)
+        """
+        self.words = words
+        self.chars = chars
+        self.max_len = chars.shape[1]
+        # Maps word ids to their position in ``words`` (-1 if missing)
+        self.positions = np.full((int(words.max()) + 1 if len(words) else 0,),
+                                 -1, dtype=np.int64)
+        self.positions[words] = np.arange(len(words))
+        self.word_chars = set(np.unique(chars[chars >= 0]).tolist())
+        self.ranges = {(): (0, len(words))}
+        self.children = {}
+    
+    @staticmethod
+    def load(map_path):
+        """Loads the index for the mapping file ``map_path``. The 
+        compiled index is cached in ``<map_path>.idx.npz`` and only
+        rebuilt if the mapping file is newer than the cache.
+        
+        Args:
+            map_path (string): Path to the mapping file (format: word
+                               char1 char2... charn)
+        
+        Returns:
+            CharPrefixIndex. Index for ``map_path``
+        """
+        cache_path = "%s.idx.npz" % map_path
+        if (os.path.isfile(cache_path) 
+                and os.path.getmtime(cache_path) >= os.path.getmtime(map_path)):
+            with np.load(cache_path) as data:
+                return CharPrefixIndex(data["words"], data["chars"])
+        words = []
+        char_seqs = []
+        with open(map_path) as f:
+            for line in f:
+                l = [int(x) for x in line.strip().split()]
+                if l:
+                    words.append(l[0])
+                    char_seqs.append(l[1:])
+        max_len = max([len(c) for c in char_seqs] + [1])
+        chars = np.full((len(words), max_len), -1, dtype=np.int64)
+        for idx, c in enumerate(char_seqs):
+            chars[idx, :len(c)] = c
+        # lexsort is stable and sorts by the last key first
+        order = np.lexsort(chars.T[::-1]) if len(words) else []
+        words = np.array(words, dtype=np.int64)[order]
+        chars = chars[order]
+        tmp_path = "%s.%d.tmp" % (cache_path, os.getpid())
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez(f, words=words, chars=chars)
+            os.replace(tmp_path, cache_path)
+        except (IOError, OSError) as e:
+            logging.warn("Could not write word2char index %s: %s" % (
+                cache_path, e))
+        return CharPrefixIndex(words, chars)
+    
+    def get_range(self, prefix):
+        """Returns the (begin, end) range of words starting with the
+        character sequence ``prefix``. Ranges are memoized.
+        
+        Args:
+            prefix (tuple): Character ids
+        
+        Returns:
+            tuple. Begin and end position in ``words``
+        """
+        r = self.ranges.get(prefix)
+        if r is None:
+            lo, hi = self.get_range(prefix[:-1])
+            depth = len(prefix) - 1
+            if lo < hi and depth < self.max_len:
+                col = self.chars[lo:hi, depth]
+                r = (lo + int(np.searchsorted(col, prefix[-1], "left")),
+                     lo + int(np.searchsorted(col, prefix[-1], "right")))
+            else:
+                r = (lo, lo)
+            self.ranges[prefix] = r
+        return r
+    
+    def get_children(self, prefix):
+        """Returns how the range of ``prefix`` is split up by the next
+        character. The first child is -1 if there are words which end
+        after ``prefix``.
+        
+        Returns:
+            tuple. Array of next characters and array of start 
+            positions of the corresponding sub-ranges relative to the
+            start of the range of ``prefix``.
+        """
+        children = self.children.get(prefix)
+        if children is None:
+            lo, hi = self.get_range(prefix)
+            depth = len(prefix)
+            if depth < self.max_len:
+                col = self.chars[lo:hi, depth]
+            else:
+                col = np.full((hi - lo,), -1, dtype=np.int64)
+            starts = np.flatnonzero(np.r_[True, col[1:] != col[:-1]]) \
+                if hi > lo else np.zeros((0,), dtype=np.int64)
+            children = (col[starts], starts)
+            self.children[prefix] = children
+        return children
+    
+    def get_word(self, prefix):
+        """Returns the word id for the character sequence ``prefix`` or
+        ``None`` if ``prefix`` is not a word. If multiple words share
+        the same character sequence, the last one in the mapping file
+        is returned.
+        """
+        lo, hi = self.get_range(prefix)
+        if lo == hi:
+            return None
+        depth = len(prefix)
+        if depth < self.max_len:
+            n_words = int(np.searchsorted(self.chars[lo:hi, depth], -1, 
+                                          "right"))
+        else:
+            n_words = hi - lo
+        if n_words == 0:
+            return None
+        return int(self.words[lo + n_words - 1])
+
+
+class _SlaveWordScores(object):
+    """Scores of the slave predictor for the next word. Holds the 
+    scores of all words in ``CharPrefixIndex`` order and caches the
+    marginal scores of character prefixes. Instances are part of the
+    word2char predictor state and are never modified after creation,
+    apart from filling the cache.
+    """
+    
+    def __init__(self, posterior, unk, go, eos, index=None):
+        self.posterior = posterior
+        self.unk = unk
+        self.go = go
+        self.eos = eos
+        self.masses = {}
+        self.scores = None
+        if index is not None:
+            if isinstance(posterior, np.ndarray):
+                words = index.words
+                valid = words < len(posterior)
+                self.scores = np.full((len(words),), unk)
+                self.scores[valid] = posterior[words[valid]]
+            else:
+                self.scores = np.full((len(index.words),), unk)
+                words = np.fromiter(posterior.keys(), dtype=np.int64,
+                                    count=len(posterior))
+                scores = np.fromiter(posterior.values(), dtype=np.float64,
+                                     count=len(posterior))
+                known = (words >= 0) & (words < len(index.positions))
+                positions = index.positions[words[known]]
+                valid = positions >= 0
+                self.scores[positions[valid]] = scores[known][valid]
+    
+    def get_mass(self, index, prefix):
+        """Log-sum of the scores of all words starting with ``prefix``,
+        or the UNK score if there is no such word. The mass of the 
+        empty prefix is defined as 0 such that the character scores of
+        a word sum up to the word score.
+        """
+        if not prefix:
+            return 0.0
+        mass = self.masses.get(prefix)
+        if mass is None:
+            self.get_child_masses(index, prefix[:-1])
+            mass = self.masses.get(prefix, self.unk)
+        return mass
+    
+    def get_child_masses(self, index, prefix):
+        """Computes the masses of all one-character extensions of 
+        ``prefix`` with a single vectorized log-sum-exp.
+        
+        Returns:
+            tuple. Array of next characters and their masses
+        """
+        key = prefix + (None,)
+        child_masses = self.masses.get(key)
+        if child_masses is None:
+            lo, hi = index.get_range(prefix)
+            next_chars, starts = index.get_children(prefix)
+            if hi > lo:
+                lse = np.logaddexp.reduceat(self.scores[lo:hi], starts)
+            else:
+                lse = np.zeros((0,))
+            child_masses = (next_chars.tolist(), lse.tolist())
+            self.masses[key] = child_masses
+            for c, m in zip(*child_masses):
+                if c >= 0:
+                    self.masses[prefix + (c,)] = m
+        return child_masses
+
+
 class Word2charPredictor(UnboundedVocabularyPredictor):
     """This predictor wraps word level predictors when SGNMT is running
     on the character level. The mapping between word ID and character 
@@ -322,9 +594,16 @@ class Word2charPredictor(UnboundedVocabularyPredictor):
     are passed through as they are. To use alternative tokenization on
     the source side, see the altsrc predictor wrapper. The word2char
     wrapper is always an ``UnboundedVocabularyPredictor``.
+    
+    If ``prefix_scores`` is enabled and the slave predictor has a 
+    bounded vocabulary, in-word characters are scored with the 
+    marginal slave probability of all words with the extended prefix,
+    divided by the marginal probability of the current prefix. The 
+    character scores of a word then sum up to the slave word score, 
+    but they are already informative before the word boundary.
     """
     
-    def __init__(self, map_path, slave_predictor):
+    def __init__(self, map_path, slave_predictor, prefix_scores=False):
         """Creates a new word2char wrapper predictor. The map_path 
         file has to be plain text files, each line containing the 
         mapping from a word index to the character index sequence
@@ -334,22 +613,21 @@ class Word2charPredictor(UnboundedVocabularyPredictor):
             map_path (string): Path to the mapping file
             slave_predictor (Predictor): Instance of the predictor with
                                          a different wmap than SGNMT
+            prefix_scores (bool): Score in-word characters with prefix
+                                  marginals of the slave posterior
         """
         super(Word2charPredictor, self).__init__()
         self.slave_predictor = slave_predictor
-        self.words = SimpleTrie()
-        self.word_chars = {}
-        with open(map_path) as f:
-            for line in f:
-                l = [int(x) for x in line.strip().split()]
-                word = l[0]
-                chars = l[1:]
-                self.words.add(chars, word)
-                for c in chars:
-                    self.word_chars[c] = True   
+        self.index = CharPrefixIndex.load(map_path)
+        self.word_chars = self.index.word_chars
+        self.prefix_scores = prefix_scores
         if isinstance(slave_predictor, UnboundedVocabularyPredictor): 
             self._get_stub_prob = self._get_stub_prob_unbounded
             self._start_new_word = self._start_new_word_unbounded
+            if prefix_scores:
+                logging.warn("word2char prefix scores are not supported "
+                             "for unbounded vocabulary slave predictors.")
+                self.prefix_scores = False
         else:
             self._get_stub_prob = self._get_stub_prob_bounded
             self._start_new_word = self._start_new_word_bounded             
@@ -367,63 +645,78 @@ class Word2charPredictor(UnboundedVocabularyPredictor):
         """
         self.slave_predictor.initialize_heuristic(src_sentence)
     
-    def _update_slave_vars(self, posterior):
-        self.slave_unk = self.slave_predictor.get_unk_probability(posterior)
-        self.slave_go = common_get(posterior, utils.GO_ID, self.slave_unk)
-        self.slave_eos = common_get(posterior, utils.EOS_ID, self.slave_unk)
+    def _create_word_scores(self, posterior):
+        """Creates the ``_SlaveWordScores`` for ``posterior``. """
+        unk = self.slave_predictor.get_unk_probability(posterior)
+        return _SlaveWordScores(posterior,
+                                unk,
+                                common_get(posterior, utils.GO_ID, unk),
+                                common_get(posterior, utils.EOS_ID, unk),
+                                self.index if self.prefix_scores else None)
         
     def _start_new_word_unbounded(self):
         """start_new_word implementation for unbounded vocabulary slave
-        predictors. Needs to set slave_go, slave_eos, and slave_unk
+        predictors. Needs to set ``word_scores``.
         """
-        self.word_stub = []
+        self.word_stub = ()
         posterior = self.slave_predictor.predict_next([utils.UNK_ID,
                                                        utils.GO_ID,
                                                        utils.EOS_ID])
-        self._update_slave_vars(posterior)
+        self.word_scores = self._create_word_scores(posterior)
     
     def _start_new_word_bounded(self):
         """start_new_word implementation for bounded vocabulary slave
-        predictors. Needs to set slave_go, slave_eos, slave_unk, and
-        slave_posterior
+        predictors. Needs to set ``word_scores``.
         """
-        self.word_stub = []
-        self.slave_posterior = self.slave_predictor.predict_next()
-        self._update_slave_vars(self.slave_posterior)
+        self.word_stub = ()
+        self.word_scores = self._create_word_scores(
+            self.slave_predictor.predict_next())
     
     def _get_stub_prob_unbounded(self):
         """get_stub_prob implementation for unbounded vocabulary slave
         predictors.
         """
-        word = self.words.get(self.word_stub)
+        word = self.index.get_word(self.word_stub)
         if word:
             posterior = self.slave_predictor.predict_next([word])
-            return common_get(posterior, word, self.slave_unk)
-        return self.slave_unk
+            return common_get(posterior, word, self.word_scores.unk)
+        return self.word_scores.unk
     
     def _get_stub_prob_bounded(self):
         """get_stub_prob implementation for bounded vocabulary slave
         predictors.
         """
-        word = self.words.get(self.word_stub)
-        return common_get(self.slave_posterior,
+        word = self.index.get_word(self.word_stub)
+        return common_get(self.word_scores.posterior,
                           word if word else utils.UNK_ID,
-                          self.slave_unk)
+                          self.word_scores.unk)
     
     def predict_next(self, trgt_words):
         posterior = {}
         stub_prob = False
+        word_scores = self.word_scores
+        if self.prefix_scores:
+            cur_mass = word_scores.get_mass(self.index, self.word_stub)
+            next_chars, masses = word_scores.get_child_masses(
+                self.index, self.word_stub)
+            char_scores = dict(zip(next_chars, masses))
         for ch in trgt_words:
             if ch in self.word_chars:
-                posterior[ch] = 0.0
+                if self.prefix_scores:
+                    posterior[ch] = char_scores.get(ch, word_scores.unk) \
+                                    - cur_mass
+                else:
+                    posterior[ch] = 0.0
             else: # Word boundary marker
                 if stub_prob is False:
                     stub_prob = self._get_stub_prob() if self.word_stub else 0.0
+                    if self.prefix_scores and self.word_stub:
+                        stub_prob -= cur_mass
                 posterior[ch] = stub_prob
         if utils.GO_ID in posterior:
-            posterior[utils.GO_ID] += self.slave_go
+            posterior[utils.GO_ID] += word_scores.go
         if utils.EOS_ID in posterior:
-            posterior[utils.EOS_ID] += self.slave_eos
+            posterior[utils.EOS_ID] += word_scores.eos
         return posterior
         
     def get_unk_probability(self, posterior):
@@ -439,19 +732,22 @@ class Word2charPredictor(UnboundedVocabularyPredictor):
         extend ``word_stub`` by the character.
         """
         if word in self.word_chars:
-            self.word_stub.append(word)
+            self.word_stub = self.word_stub + (word,)
         elif self.word_stub:
-            word = self.words.get(self.word_stub)
+            word = self.index.get_word(self.word_stub)
             self.slave_predictor.consume(word if word else utils.UNK_ID)
             self._start_new_word()
     
     def get_state(self):
-        """Pass through to slave predictor """
-        return self.word_stub, self.slave_predictor.get_state()
+        """Pass through to slave predictor. The slave scores for the 
+        next word are also part of the state. """
+        return (self.word_stub, 
+                self.slave_predictor.get_state(), 
+                self.word_scores)
     
     def set_state(self, state):
         """Pass through to slave predictor """
-        self.word_stub, slave_state = state
+        self.word_stub, slave_state, self.word_scores = state
         self.slave_predictor.set_state(slave_state)
 
     def estimate_future_cost(self, hypo):
@@ -469,8 +765,7 @@ class Word2charPredictor(UnboundedVocabularyPredictor):
     
     def is_equal(self, state1, state2):
         """Pass through to slave predictor """
-        stub1, slave_state1 = state1
-        stub2, slave_state2 = state2
+        stub1, slave_state1, _ = state1
+        stub2, slave_state2, _ = state2
         return (stub1 == stub2 
                 and self.slave_predictor.is_equal(slave_state1, slave_state2))
-
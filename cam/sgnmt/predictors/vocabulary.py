@@ -19,8 +19,12 @@ wrapped predictor. An example is the idxmap wrapper which makes it
 possible to use an alternative word map.
 """
 
-import logging
+from collections import OrderedDict
 import copy
+import heapq
+import logging
+
+import numpy as np
 
 from cam.sgnmt import utils
 from cam.sgnmt.predictors.core import Predictor, UnboundedVocabularyPredictor
@@ -32,6 +36,10 @@ class IdxmapPredictor(Predictor):
     indices and predictors indices each time the predictor is called.
     This mapping is transparent to both the decoder and the wrapped
     slave predictor.
+    
+    Dense slave posteriors are translated with a single gather over a
+    precomputed index array. SGNMT ids without a slave counterpart get
+    the UNK score of the slave predictor.
     """
     
     def __init__(self,
@@ -60,6 +68,17 @@ class IdxmapPredictor(Predictor):
         self.trgt_map = self.load_map(trgt_idxmap_path, "target")
         self.trgt_map_inverse = {slave_idx: gnmt_idx 
                         for gnmt_idx, slave_idx in enumerate(self.trgt_map)}
+        self.gather_indices = {}
+        if self.trgt_map:
+            self.trgt_map_array = np.array(self.trgt_map, dtype=np.int64)
+            # Inverse array (first SGNMT id wins if the map is not a
+            # bijection, e.g. for gaps which are mapped to 0)
+            inverse = np.full((max(self.trgt_map) + 1,), -1, dtype=np.int64)
+            inverse[self.trgt_map_array[::-1]] = np.arange(
+                len(self.trgt_map) - 1, -1, -1)
+            self.trgt_map_inverse_array = inverse
+            self.trgt_map_valid = inverse[self.trgt_map_array] == np.arange(
+                len(self.trgt_map))
     
     def load_map(self, path, name):
         """Load a index map file. Mappings should be bijections, but
@@ -86,6 +105,37 @@ class IdxmapPredictor(Predictor):
             logging.debug("Loaded idxmap from %s" % path)
             return [d[idx] if idx in d else 0 for idx in range(max(d)+1)]
     
+    def _get_gather_indices(self, slave_vocab_size):
+        """Returns an array which maps each SGNMT target id to the
+        slave index to read its score from. Ids which are not mapped
+        bijectively or outside the slave posterior point to UNK.
+        
+        Args:
+            slave_vocab_size (int): Length of the slave posterior
+        
+        Returns:
+            array. Slave indices for all SGNMT target ids
+        """
+        indices = self.gather_indices.get(slave_vocab_size)
+        if indices is None:
+            valid = self.trgt_map_valid & (self.trgt_map_array 
+                                           < slave_vocab_size)
+            indices = np.where(valid, self.trgt_map_array, utils.UNK_ID)
+            self.gather_indices[slave_vocab_size] = indices
+        return indices
+
+    def _translate_posterior(self, posterior):
+        """Translates a slave posterior to SGNMT ids and applies the
+        slave weight. 
+        """
+        if isinstance(posterior, dict):
+            return {self.trgt_map_inverse.get(idx, utils.UNK_ID): 
+                            self.slave_weight * prob 
+                    for idx, prob in posterior.items()}
+        posterior = np.asarray(posterior)
+        return self.slave_weight * posterior[
+                                self._get_gather_indices(len(posterior))]
+    
     def initialize(self, src_sentence):
         """Pass through to slave predictor """
         if not self.src_map:
@@ -98,9 +148,7 @@ class IdxmapPredictor(Predictor):
         """Pass through to slave predictor """
         if not self.trgt_map:
             return self.slave_predictor.predict_next()
-        posterior = self.slave_predictor.predict_next()
-        return {self.trgt_map_inverse.get(idx, utils.UNK_ID): self.slave_weight * prob 
-            for idx, prob in utils.common_iterable(posterior)}
+        return self._translate_posterior(self.slave_predictor.predict_next())
         
     def get_unk_probability(self, posterior):
         """ATTENTION: We should translate the posterior array 
@@ -154,6 +202,10 @@ class IdxmapPredictor(Predictor):
     def is_equal(self, state1, state2):
         """Pass through to slave predictor """
         return self.slave_predictor.is_equal(state1, state2)
+
+    def get_state_key(self):
+        """Pass through to slave predictor """
+        return self.slave_predictor.get_state_key()
         
 
 class UnboundedIdxmapPredictor(IdxmapPredictor, UnboundedVocabularyPredictor):
@@ -179,9 +231,7 @@ class UnboundedIdxmapPredictor(IdxmapPredictor, UnboundedVocabularyPredictor):
             return self.slave_predictor.predict_next(trgt_words)
         posterior = self.slave_predictor.predict_next([self.trgt_map[w] 
                                                        for w in trgt_words])
-        return {self.trgt_map_inverse.get(idx,
-                                          utils.UNK_ID): self.slave_weight*prob 
-                            for idx, prob in utils.common_iterable(posterior)}
+        return self._translate_posterior(posterior)
 
 
 class VocabSpec(object):
@@ -199,6 +249,8 @@ class VocabSpec(object):
         self.max_id = None
         self.min_id = None
         self.tokens = set()
+        self.token_masks = {}
+        self.masks = {}
         for el in spec_str.split(','):
           if el[0] == ">":
             self.min_id = int(el[1:])
@@ -207,6 +259,38 @@ class VocabSpec(object):
           else:
             self.tokens.add(int(el))
 
+    def get_token_mask(self, size):
+        """Returns a boolean array of length ``size`` which is true at
+        the explicitly listed tokens. Masks are cached by size.
+        
+        Args:
+          size (int): Length of the mask
+        """
+        mask = self.token_masks.get(size)
+        if mask is None:
+            mask = np.zeros((size,), dtype=bool)
+            mask[[t for t in self.tokens if 0 <= t < size]] = True
+            self.token_masks[size] = mask
+        return mask
+
+    def get_mask(self, size):
+        """Returns a boolean array of length ``size`` which is true for
+        all tokens in this vocabulary, i.e. the vectorized version of
+        ``contains``. Masks are cached by size.
+        
+        Args:
+          size (int): Length of the mask
+        """
+        mask = self.masks.get(size)
+        if mask is None:
+            mask = np.array(self.get_token_mask(size))
+            if self.max_id is not None:
+                mask[:max(0, self.max_id)] = True
+            if self.min_id is not None:
+                mask[max(0, self.min_id+1):] = True
+            self.masks[size] = mask
+        return mask
+
     def contains(self, token):
         if self.max_id is not None and token < self.max_id:
             return True
@@ -239,10 +323,18 @@ class MaskvocabPredictor(Predictor):
         self.slave_predictor.initialize(src_sentence)
     
     def predict_next(self):
-        """Pass through to slave predictor, set masked to 0.0 """
+        """Pass through to slave predictor, set masked to 0.0. The 
+        slave posterior is copied since predictors may return shared
+        posteriors.
+        """
         posterior = self.slave_predictor.predict_next()
-        for w in self.vocab_spec.tokens:
-            posterior[w] = 0.0
+        if isinstance(posterior, np.ndarray):
+            posterior = posterior.copy()
+            posterior[self.vocab_spec.get_token_mask(len(posterior))] = 0.0
+        else:
+            posterior = dict(posterior)
+            for w in self.vocab_spec.tokens:
+                posterior[w] = 0.0
         return posterior
         
     def get_unk_probability(self, posterior):
@@ -280,6 +372,10 @@ class MaskvocabPredictor(Predictor):
     def is_equal(self, state1, state2):
         """Pass through to slave predictor """
         return self.slave_predictor.is_equal(state1, state2)
+
+    def get_state_key(self):
+        """Pass through to slave predictor """
+        return self.slave_predictor.get_state_key()
         
 
 class UnboundedMaskvocabPredictor(MaskvocabPredictor,
@@ -290,11 +386,19 @@ class UnboundedMaskvocabPredictor(MaskvocabPredictor,
     """
     
     def predict_next(self, trgt_words):
-        """Pass through to slave predictor, set masked to 0.0 """
+        """Pass through to slave predictor, set masked to 0.0. The 
+        slave posterior is copied since predictors may return shared
+        posteriors.
+        """
         posterior = self.slave_predictor.predict_next(trgt_words)
-        for w in self.words:
-            if utils.common_contains(trgt_words, w):
-                posterior[w] = 0.0
+        if isinstance(posterior, np.ndarray):
+            posterior = posterior.copy()
+            posterior[self.vocab_spec.get_token_mask(len(posterior))] = 0.0
+        else:
+            posterior = dict(posterior)
+            for w in self.vocab_spec.tokens:
+                if utils.common_contains(trgt_words, w):
+                    posterior[w] = 0.0
         return posterior
 
 
@@ -330,6 +434,7 @@ class UnkvocabPredictor(Predictor):
         defined """
         posterior = self.slave_predictor.predict_next()
         if utils.UNK_ID in posterior:
+            posterior = dict(posterior) # Slave posterior may be shared
             for w in range(self.trg_vocab_size):
                 if not w in posterior:
                     posterior[w] = utils.NEG_INF
@@ -366,6 +471,10 @@ class UnkvocabPredictor(Predictor):
         """Pass through to slave predictor """
         return self.slave_predictor.is_equal(state1, state2)
 
+    def get_state_key(self):
+        """Pass through to slave predictor """
+        return self.slave_predictor.get_state_key()
+
 
 class SkipvocabInternalHypothesis(object):
     """Helper class for internal beam search in skipvocab."""
@@ -385,7 +494,8 @@ class SkipvocabPredictor(Predictor):
     in-vocabulary word scores are collected from the wrapped predictor.
     """
     
-    def __init__(self, vocab_spec, stop_size, beam, slave_predictor):
+    def __init__(self, vocab_spec, stop_size, beam, slave_predictor,
+                 cache_size=1000):
         """Creates a new skipvocab wrapper predictor.
         
         Args:
@@ -394,16 +504,30 @@ class SkipvocabPredictor(Predictor):
                              stop_size words are in-vocabulary
             beam (int): Beam size of internal beam search
             slave_predictor (Predictor): Wrapped predictor.
+            cache_size (int): Maximum number of internal search results
+                              which are cached per sentence. Caching
+                              requires slave state keys
         """
         super(SkipvocabPredictor, self).__init__()
         self.vocab_spec = VocabSpec(vocab_spec)
         self.slave_predictor = slave_predictor
         self.stop_size = stop_size
         self.beam = beam
+        self.cache_size = cache_size
+        self.search_cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.warned_no_state_key = False
     
     def initialize(self, src_sentence):
         """Pass through to slave predictor """
+        if self.cache_hits + self.cache_misses > 0:
+            logging.debug("Skipvocab search cache: %d hits, %d misses" % (
+                self.cache_hits, self.cache_misses))
         self.slave_predictor.initialize(src_sentence)
+        self.search_cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
     
     def initialize_heuristic(self, src_sentence):
         """Pass through to slave predictor """
@@ -414,19 +538,62 @@ class SkipvocabPredictor(Predictor):
         return self.slave_predictor.get_unk_probability(posterior)
 
     def _is_stopping_posterior(self, posterior):
-        for word, _ in sorted(utils.common_iterable(posterior),
-                              key=lambda h: -h[1])[:self.stop_size]:
+        """Returns true if none of the best ``stop_size`` words in 
+        ``posterior`` is in ``vocab_spec``. 
+        """
+        if isinstance(posterior, np.ndarray):
+            if self.stop_size < len(posterior):
+                top = np.argpartition(-posterior, self.stop_size)[
+                                                            :self.stop_size]
+            else:
+                top = np.arange(len(posterior))
+            return not self.vocab_spec.get_mask(len(posterior))[top].any()
+        for word, _ in heapq.nlargest(self.stop_size,
+                                      utils.common_iterable(posterior),
+                                      key=lambda h: h[1]):
             if self.vocab_spec.contains(word):
                 return False
         return True
- 
+
+    def _get_expansions(self, posterior):
+        """Returns the (word, score) pairs of words in ``vocab_spec``
+        which can be used to expand an internal hypothesis. Only the
+        best ``beam`` of them can survive pruning.
+        """
+        if isinstance(posterior, np.ndarray):
+            words = np.flatnonzero(self.vocab_spec.get_mask(len(posterior)))
+            scores = posterior[words]
+            if self.beam < len(words):
+                top = np.argpartition(-scores, self.beam)[:self.beam]
+                words = words[top]
+                scores = scores[top]
+            return zip(words.tolist(), scores.tolist())
+        return [(word, score) 
+                for word, score in utils.common_iterable(posterior)
+                if self.vocab_spec.contains(word)]
+
     def predict_next(self):
         """This method first performs beam search internally to update
         the slave predictor state to a point where the best stop_size 
         entries in the predict_next() return value are in-vocabulary
         (bounded by max_id). Then, it returns the slave posterior in 
-        that state.
+        that state. Results are cached by the slave state key (see
+        ``Predictor.get_state_key()``) if the slave predictor supports
+        state keys.
         """
+        cache_key = None
+        if self.cache_size > 0:
+            cache_key = self.slave_predictor.get_state_key()
+            if cache_key is None and not self.warned_no_state_key:
+                logging.info("Slave predictor of the skipvocab wrapper does "
+                             "not support state keys. Disable search cache.")
+                self.warned_no_state_key = True
+        if cache_key is not None and cache_key in self.search_cache:
+            self.cache_hits += 1
+            self.search_cache.move_to_end(cache_key)
+            best_predictor_state, best_posterior = self.search_cache[cache_key]
+            self.slave_predictor.set_state(copy.deepcopy(best_predictor_state))
+            return copy.copy(best_posterior)
         hypos = [SkipvocabInternalHypothesis(0.0, 
                                              self.slave_predictor.get_state(),
                                              None)]
@@ -450,14 +617,19 @@ class SkipvocabPredictor(Predictor):
                     best_posterior = posterior
                 else:
                     # Look for ways to expand this hypo with OOV words.
-                    for word, score in utils.common_iterable(posterior):
-                        if self.vocab_spec.contains(word):
-                            next_hypos.append(SkipvocabInternalHypothesis(
-                                hypo.score + score, pred_state, word))
-            next_hypos.sort(key=lambda h: -h.score)
-            hypos = next_hypos[:self.beam]
+                    for word, score in self._get_expansions(posterior):
+                        next_hypos.append(SkipvocabInternalHypothesis(
+                            hypo.score + score, pred_state, word))
+            hypos = heapq.nlargest(self.beam, next_hypos, 
+                                   key=lambda h: h.score)
+        if cache_key is not None:
+            self.cache_misses += 1
+            self.search_cache[cache_key] = (best_predictor_state,
+                                            best_posterior)
+            while len(self.search_cache) > self.cache_size:
+                self.search_cache.popitem(last=False)
         self.slave_predictor.set_state(copy.deepcopy(best_predictor_state))
-        return best_posterior
+        return copy.copy(best_posterior)
         
     def consume(self, word):
         """Pass through to slave predictor """
@@ -486,3 +658,7 @@ class SkipvocabPredictor(Predictor):
         """Pass through to slave predictor """
         return self.slave_predictor.is_equal(state1, state2)
 
+    def get_state_key(self):
+        """Pass through to slave predictor """
+        return self.slave_predictor.get_state_key()
+
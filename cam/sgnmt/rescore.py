@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+# coding=utf-8
+# Copyright 2019 The SGNMT Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This script rescores references or n-best lists with predictors
+which support batched teacher-forced scoring (``score_sequences()``),
+e.g. fairseq. In contrast to forced decoding with the ``forced`` or
+``forcedlst`` predictors, all target sentences of a source sentence
+are scored in parallel decoder passes instead of token by token.
+
+The target sentences are read from --trg_test, either as plain text
+file with one reference per source sentence, or as n-best list in
+Moses format. The per-token scores are written with the usual output
+handlers (--outputs), e.g. 'nbest' or 'timecsv'. Use
+--rescore_batch_size to limit the number of sentences per decoder pass.
+"""
+
+import logging
+import sys
+import traceback
+import time
+
+from cam.sgnmt.decoding import core
+from cam.sgnmt import decode_utils
+from cam.sgnmt import utils, io
+from cam.sgnmt.output import TextOutputHandler
+from cam.sgnmt.ui import get_args
+
+# Load configuration from command line arguments or configuration file
+args = get_args()
+decode_utils.base_init(args)
+
+
+class RescoringDecoder(core.Decoder):
+    """This decoder does not search. It scores a fixed list of target
+    sentences for each source sentence with ``score_sequences()`` of
+    all predictors, and returns them as hypotheses ordered by their
+    combined score.
+    """
+
+    def __init__(self, decoder_args):
+        """Initialize the decoder and load target sentences."""
+        super(RescoringDecoder, self).__init__(decoder_args)
+        self.batch_size = decoder_args.rescore_batch_size
+        self.trg_sentences = load_trg_sentences(decoder_args.trg_test)
+
+    def decode(self, src_sentence):
+        self.initialize_predictors(src_sentence)
+        if self.current_sen_id < len(self.trg_sentences):
+            trg_sentences = self.trg_sentences[self.current_sen_id]
+        else:
+            trg_sentences = []
+        if not trg_sentences:
+            return self.full_hypos
+        all_scores = []
+        for (p, _) in self.predictors:
+            self.apply_predictors_count += 1
+            all_scores.append(p.score_sequences(trg_sentences,
+                                                self.batch_size))
+        for sen_idx, trg_sentence in enumerate(trg_sentences):
+            score_breakdown = []
+            score = 0.0
+            for pos in range(len(trg_sentence) + 1):
+                breakdown = [(scores[sen_idx][pos], w) for scores, (_, w)
+                             in zip(all_scores, self.predictors)]
+                score += sum(s * w for s, w in breakdown)
+                score_breakdown.append(breakdown)
+            self.add_full_hypo(core.Hypothesis(
+                trg_sentence + [utils.EOS_ID], score, score_breakdown))
+        return self.get_full_hypos_sorted()
+
+
+def load_trg_sentences(path):
+    """Loads the target sentences to rescore. If ``path`` is an n-best
+    list in Moses format, return all entries for each sentence id.
+    Otherwise, treat each line as single reference.
+
+    Args:
+        path (string): Path to the reference file or n-best list
+
+    Returns:
+        list. List of lists of target sentences for each source
+        sentence.
+    """
+    trg_sentences = []
+    with open(path) as f:
+        for line in f:
+            if "|||" not in line:
+                trg_sentences.append([[int(w) for w in line.strip().split()]])
+                continue
+            parts = line.split("|||")
+            sen_id = int(parts[0].strip())
+            while len(trg_sentences) <= sen_id:
+                trg_sentences.append([])
+            sen = [int(w) for w in parts[1].strip().split()]
+            if sen and sen[0] == utils.GO_ID:
+                sen = sen[1:]
+            if sen and sen[-1] == utils.EOS_ID:
+                sen = sen[:-1]
+            trg_sentences[sen_id].append(sen)
+    return trg_sentences
+
+
+def load_sentences(path):
+    """Loads source sentences in word id format."""
+    with open(path) as f:
+        return [list(map(int, line.strip().split())) for line in f]
+
+
+io.initialize(args)
+decoder = RescoringDecoder(args)
+decode_utils.add_predictors(decoder)
+for (p, _) in decoder.predictors:
+    if not hasattr(p, "score_sequences"):
+        logging.fatal("Predictor %s does not support batched rescoring."
+                      % p.__class__.__name__)
+        sys.exit(1)
+outputs = decode_utils.create_output_handlers()
+
+src_sentences = load_sentences(args.src_test)
+all_hypos = []
+sen_indices = []
+start_time = time.time()
+for sen_idx in decode_utils.get_sentence_indices(args.range, src_sentences):
+    decoder.set_current_sen_id(sen_idx)
+    try:
+        src = src_sentences[sen_idx]
+        logging.info("Next sentence (ID: %d): %s"
+                     % (sen_idx + 1, ' '.join(map(str, src))))
+        start_hypo_time = time.time()
+        decoder.apply_predictors_count = 0
+        hypos = decoder.decode(src)
+        if not hypos:
+            logging.error("No target sentences for ID %d!" % (sen_idx+1))
+            continue
+        hypos = decode_utils._postprocess_complete_hypos(hypos)
+        logging.info("Stats (ID: %d): best_score=%f "
+                     "num_hypos=%d "
+                     "time=%.2f" % (sen_idx+1,
+                                    hypos[0].total_score,
+                                    len(hypos),
+                                    time.time() - start_hypo_time))
+        all_hypos.append(hypos)
+        sen_indices.append(sen_idx)
+    except Exception as e:
+        logging.error("An unexpected %s error has occurred at sentence id "
+                      "%d: %s, Stack trace: %s" % (sys.exc_info()[0],
+                                                   sen_idx+1,
+                                                   e,
+                                                   traceback.format_exc()))
+logging.info("Rescoring finished. Time: %.2f" % (time.time() - start_time))
+try:
+    for output_handler in outputs:
+        if isinstance(output_handler, TextOutputHandler):
+            output_handler.open_file()
+            output_handler.write_hypos(all_hypos, sen_indices)
+            output_handler.close_file()
+        else:
+            output_handler.write_hypos(all_hypos, sen_indices)
+except IOError as e:
+    logging.error("I/O error %s occurred when creating output files: %s"
+                  % (sys.exc_info()[0], e))
@@ -277,7 +277,8 @@ def get_parser():
                                  'bigramgreedy',
                                  'astar',
                                  'dijkstra',
-                                 'dijkstra_ts'],
+                                 'dijkstra_ts',
+                                 'speculative'],
                         help="Strategy for traversing the search space which "
                         "is spanned by the predictors.\n\n"
                         "* 'greedy': Greedy decoding (similar to beam=1)\n"
@@ -326,7 +327,14 @@ def get_parser():
                         "score by greedily selecting high scoring bigrams. "
                         "Do not use bow predictor with this search strategy.\n"
                         "* 'astar': A* search. The heuristic function is "
-                        "configured using the --heuristics options.")
+                        "configured using the --heuristics options.\n"
+                        "* 'speculative': Greedy decoding with a single "
+                        "fairseq predictor. A smaller draft model "
+                        "(--speculative_draft_path) proposes "
+                        "--speculative_k tokens which are verified by the "
+                        "fairseq predictor in one pass. Produces the same "
+                        "output as 'greedy' up to numerical ties (see "
+                        "--speculative_check).")
     group.add_argument("--beam", default=10, type=int,
                         help="Size of beam. Only used if --decoder is set to "
                         "'beam' or 'astar'. For 'astar' it limits the capacity"
@@ -525,6 +533,18 @@ def get_parser():
                        help="Used for the syncbeam decoder. Synchronization "
                        "symbol for hypothesis comparision. If negative, use "
                        "syntax_[min|max]_terminal_id.")
+    group.add_argument("--speculative_draft_path", default="",
+                        help="Path to the fairseq draft model (*.pt) for the "
+                        "speculative decoder.")
+    group.add_argument("--speculative_k", default=4, type=int,
+                        help="Number of tokens proposed by the draft model in "
+                        "each round of the speculative decoder.")
+    group.add_argument("--speculative_check", default=False, type='bool',
+                        help="If true, the speculative decoder also decodes "
+                        "each sentence with the greedy decoder and warns if "
+                        "the outputs differ. Use this with small models to "
+                        "verify the single-pass verification of the "
+                        "installed fairseq version.")
     group.add_argument("--max_word_len", default=25, type=int,
                        help="Maximum length of a single word. Only applicable "
                        "to the decoders multisegbeam and syncbeam.")
@@ -616,6 +636,13 @@ def get_parser():
                         "* 'pickle': Dump data as binary pickle.\n"
                         "The path to the output files can be specified with "
                         "--output_path")
+    group.add_argument("--forced_scoring", default=False, type='bool',
+                        help="Only for extract_scores_along_reference.py: If "
+                        "true, predictors with teacher forcing support (like "
+                        "fairseq) score the full reference in a single pass "
+                        "instead of step by step. The posteriors of the "
+                        "first sentence are compared with step-wise scoring, "
+                        "and a warning is logged if they differ.")
     group.add_argument("--remove_eos", default=True, type='bool',
                         help="Whether to remove </S> symbol on output.")
     group.add_argument("--src_wmap", default="",
@@ -775,7 +802,7 @@ def get_parser():
                         "* 'skipvocab': Skip a subset of the predictor "
                         "vocabulary.\n"
                         "               Options: skipvocab_vocab, "
-                        "skipvocab_stop_size\n"
+                        "skipvocab_stop_size, skipvocab_cache_size\n"
                         "* 'ngramize': Extracts n-gram posterior from "
                         "predictors without token-level history.\n"
                         "               Options: min_ngram_order, "
@@ -896,6 +923,15 @@ def get_parser():
     group.add_argument("--pred_trg_vocab_size", default=30000, type=int,
                         help="Predictor target vocabulary size. Used by the"
                         "bow, bowsearch, t2t, nizza, unkc predictors.")
+    group.add_argument("--prefetch_lookahead", default=0, type=int,
+                        help="Number of sentences for which per-sentence "
+                        "resources (lattices for fst, nfst, rtn and n-gram "
+                        "posteriors for ngramc) are loaded in background "
+                        "threads while the current sentence is decoded. "
+                        "Set to 0 to load them synchronously.")
+    group.add_argument("--prefetch_threads", default=2, type=int,
+                        help="Number of background threads for "
+                        "--prefetch_lookahead.")
     
     # Neural predictors
     group = parser.add_argument_group('Neural predictor options')
@@ -971,6 +1007,24 @@ def get_parser():
     group.add_argument("--fairseq_lang_pair", default="",
                        help="Language pair such as 'en-fr' for fairseq. Used "
                        "to load fairseq dictionaries")
+    group.add_argument("--fairseq_quantize", default=False, type='bool',
+                       help="Apply dynamic int8 quantization to the linear "
+                       "layers of fairseq models. Only effective for CPU "
+                       "decoding (--n_cpu_threads). Quantized models are "
+                       "cached next to the original checkpoint with the "
+                       "suffix .int8 and rebuilt if the checkpoint changes")
+    group.add_argument("--fairseq_quantize_check", default="",
+                       help="Path to a file with source sentences in word id "
+                       "format. If set, the quantized fairseq models are "
+                       "compared against fp32 on these sentences. The "
+                       "result is stored in the quantized model cache, so "
+                       "the fp32 models are only loaded for the check if "
+                       "the cache or this file changes.")
+    group.add_argument("--fairseq_quantize_check_threshold", default=0.99,
+                       type=float,
+                       help="Warn if the top-1 agreement between quantized "
+                       "and fp32 fairseq models in --fairseq_quantize_check "
+                       "is below this value.")
 
     # Structured predictors
     group = parser.add_argument_group('Structured predictor options')
@@ -1087,7 +1141,8 @@ def get_parser():
                         "them with the factors defined in the files. The "
                         "format is one ngram per line '<ngram> : <score>'. "
                         "You can use the placeholder %%d for the sentence "
-                        "index.")
+                        "index. Alternatively, specify a single file "
+                        "compiled with scripts/compile_ngram_posteriors.py.")
     group.add_argument("--ngramc_order", default=0, type=int,
                        help="If positive, count only ngrams of the specified "
                        "Order. Otherwise, count all ngrams")
@@ -1109,6 +1164,12 @@ def get_parser():
                         "predictor wrapper stops if the best stop_size "
                          "scores are for in-vocabulary words (ie. with index "
                          "lower or equal skipvocab_max_id")
+    group.add_argument("--skipvocab_cache_size", default=1000, type=int,
+                        help="Maximum number of internal search results the "
+                        "skipvocab predictor wrapper caches per sentence. "
+                        "Results are cached by the state of the wrapped "
+                        "predictor, which requires support for state keys "
+                        "(e.g. fairseq). Set to 0 to disable the cache.")
 
     # Forced predictors
     group = parser.add_argument_group('Forced decoding predictor options')
@@ -1117,6 +1178,11 @@ def get_parser():
                         "This is only required for the predictors 'forced' "
                         "and 'forcedlst'. For 'forcedlst' this needs to point "
                         "to an n-best list in Moses format.")
+    group.add_argument("--rescore_batch_size", default=0, type=int,
+                        help="Maximum number of target sentences which are "
+                        "scored in a single decoder pass by rescore.py. If "
+                        "not positive, all target sentences for a source "
+                        "sentence are scored in one pass.")
     group.add_argument("--forced_spurious", default="",
                         help="Comma separated list of token IDs that are "
                         "allowed to occur anywhere in a sequence when the "
@@ -1183,7 +1249,16 @@ def get_parser():
                         "Path to a mapping file from word ID to sequence of "
                         "character IDs (format: <word-id> <char-id1> <char-id2"
                         ">...). All character IDs which do not occur in this "
-                        "mapping are treated as word boundary symbols.")
+                        "mapping are treated as word boundary symbols. The "
+                        "compiled mapping is cached in <word2char_map>.idx.npz")
+    group.add_argument("--word2char_prefix_scores", default=False, 
+                        type='bool',
+                        help="If true, the word2char wrapper scores each "
+                        "character within a word with the marginal "
+                        "probability of all words with this prefix under "
+                        "the (bounded vocabulary) wrapped predictor, rather "
+                        "than 0. Character scores still sum up to the word "
+                        "score, but beams are pruned more informed.")
     group.add_argument("--fsttok_path", default="tok.fst",
                         help="For the fsttok wrapper. Defines the path to the "
                         "FSt which transduces sequences of SGNMT tokens (eg. "
@@ -1200,7 +1275,13 @@ def get_parser():
     group = parser.add_argument_group('Hiero predictor options')
     group.add_argument("--rules_path", default="rules/rules",
                         help="Only required for predictor lrhiero. Path to "
-                        "the ruleXtract rules file.")
+                        "the ruleXtract rules file. You can use the "
+                        "placeholder %%d for per-sentence filtered grammars.")
+    group.add_argument("--rules_cache_dir", default="",
+                        help="If set, the lrhiero predictor stores parsed "
+                        "grammars in binary form in this directory, and "
+                        "loads them from there if the rules file and "
+                        "--grammar_feature_weights did not change.")
     group.add_argument("--use_grammar_weights", default=False, type='bool',
                         help="Whether to use weights in the synchronous "
                         "grammar for the lrhiero predictor. If set to false, "
@@ -1284,6 +1365,12 @@ def get_parser():
                         "and minimization after each RTN expansion.")
     group.add_argument("--remove_epsilon_in_rtns", default=True, type='bool',
                         help="Whether to remove epsilons after RTN expansion.")
+    group.add_argument("--rtn_cache_size", default=1000, type=int,
+                        help="Maximum number of RTN sub-FSTs which are kept "
+                        "in memory across sentences by the rtn predictor. "
+                        "Sub-FSTs are identified by file identity, so this "
+                        "only helps if sentence directories share sub-FST "
+                        "files via hard or symbolic links.")
     group.add_argument("--normalize_fst_weights", default=False, type='bool',
                         help="Whether to normalize weights in FSTs. This "
                         "forces the weights on outgoing edges to sum up to 1. "
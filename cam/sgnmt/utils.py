@@ -21,13 +21,11 @@ quirks Python sometimes has.
 """
 
 from abc import abstractmethod
+import gzip
 import numpy
 import operator
-from subprocess import call
 from scipy.special import logsumexp
-from shutil import copyfile
 import logging
-import os
 import sys
 
 try:
@@ -226,10 +224,6 @@ def common_contains(obj, key):
 # FST utilities
 
 
-TMP_FILENAME = '/tmp/sgnmt.%s.fst' % os.getpid()
-"""Temporary file name to use if an FST file is zipped. """
-
-
 def w2f(fstweight):
     """Converts an arc weight to float """
     return float(str(fstweight))
@@ -237,8 +231,9 @@ def w2f(fstweight):
 
 def load_fst(path):
     """Loads a FST from the file system using PyFSTs ``read()`` method.
-    GZipped format is also supported. The arc type must be standard
-    or log, otherwise PyFST cannot load them.
+    GZipped format is also supported and decompressed in memory, so
+    this function can be called from multiple threads. The arc type
+    must be standard or log, otherwise PyFST cannot load them.
     
     Args:
         path (string):  Path to the FST file to load
@@ -247,10 +242,8 @@ def load_fst(path):
     """
     try:
         if path[-3:].lower() == ".gz":
-            copyfile(path, "%s.gz" % TMP_FILENAME)
-            call(["gunzip", "%s.gz" % TMP_FILENAME])
-            ret = fst.Fst.read(TMP_FILENAME)
-            os.remove(TMP_FILENAME)
+            with gzip.open(path, "rb") as f:
+                ret = fst.Fst.read_from_string(f.read())
         else: # Fst not zipped
             ret = fst.Fst.read(path)
         logging.debug("Read fst from %s" % path)
@@ -0,0 +1,2 @@
+"""Redirect to ``cam.sgnmt.rescore`` """
+import cam.sgnmt.rescore
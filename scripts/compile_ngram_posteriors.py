@@ -0,0 +1,30 @@
+"""This script compiles per-sentence n-gram posterior files for the
+ngramc predictor into a single binary file. Pass the compiled file to
+--ngramc_path instead of the text files with %d placeholder.
+
+Usage: python compile_ngram_posteriors.py -i ngrams/%d.txt -n 2737 -o ngrams.bin
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+from cam.sgnmt.misc.ngram_store import compile_ngram_posteriors
+
+parser = argparse.ArgumentParser(description='Compiles n-gram posterior files '
+                                 'in the format <ngram> : <score> into a '
+                                 'memory-mappable binary file.')
+parser.add_argument('-i','--input', help='Path to the n-gram posterior files '
+                    'with placeholder %%d for the sentence id', required=True)
+parser.add_argument('-n','--n_sentences', type=int, required=True,
+                    help='Number of sentences')
+parser.add_argument('-o','--output', help='Path to the compiled file',
+                    required=True)
+args = parser.parse_args()
+
+logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                    level=logging.INFO)
+compile_ngram_posteriors(args.input, args.n_sentences, args.output)